@@ -0,0 +1,55 @@
+"""Add up thousands of columns one `+` at a time.
+
+Reports time and peak memory of building the chain, with the default names
+left alone and with each intermediate name formatted along the way, which
+is what building them eagerly used to do. The former should grow linearly
+with the number of terms, the latter quadratically.
+
+    python -m benchmarks.bench_additive_chain
+"""
+
+import time
+import tracemalloc
+
+import subframe
+
+SIZES = (1_000, 2_000, 5_000)
+
+
+def build(columns, eager_names):
+    value = columns[0]
+    for column in columns[1:]:
+        value = value + column
+        if eager_names:
+            value._name
+    return value
+
+
+def measure(columns, eager_names):
+    tracemalloc.start()
+    start = time.perf_counter()
+    value = build(columns, eager_names)
+    name = value._name
+    elapsed = time.perf_counter() - start
+    (_, peak) = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return (elapsed, peak, len(name))
+
+
+def main():
+    table = subframe.table([(f"c{i}", "int64") for i in range(max(SIZES))], name="t")
+    columns = [table[f"c{i}"] for i in range(max(SIZES))]
+    build(columns[:10], False)
+
+    for size in SIZES:
+        for eager_names in (False, True):
+            (elapsed, peak, length) = measure(columns[:size], eager_names)
+            print(
+                f"{size:>5} terms, {'eager' if eager_names else 'lazy':>5} names: "
+                f"{elapsed * 1e3:8.1f} ms, peak {peak / 2**20:7.1f} MiB "
+                f"({length} characters)"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+"""Compare the simple-type fast path with the ANTLR parser.
+
+Compiles and evaluates every return type found in the bundled extension
+YAMLs that both paths understand and reports the time per expression.
+
+    python -m benchmarks.bench_derivation_fast_path
+"""
+
+import timeit
+from importlib.resources import files as importlib_files
+
+import yaml
+
+from substrait.gen.proto.type_pb2 import Type
+
+from subframe.derivation_expression import _compile_simple, _parse
+
+BINDINGS = {"P": 10, "S": 2, "L1": 8, "any1": Type(i64=Type.I64())}
+
+
+def bundled_return_types() -> list[str]:
+    return_types = []
+    for fpath in importlib_files("substrait.extensions").glob("functions*.yaml"):
+        with open(fpath) as f:
+            for functions in yaml.safe_load(f).values():
+                for function in functions:
+                    for impl in function.get("impls", []):
+                        return_types.append(impl["return"])
+
+    return return_types
+
+
+def parser_supports(rtn: str) -> bool:
+    try:
+        _parse(rtn)(BINDINGS)
+    except Exception:
+        return False
+    return True
+
+
+def run(compile_fn, return_types, number):
+    def compile_and_evaluate():
+        for rtn in return_types:
+            compile_fn(rtn)(BINDINGS)
+
+    return timeit.timeit(compile_and_evaluate, number=number) / (
+        number * len(return_types)
+    )
+
+
+def main():
+    return_types = bundled_return_types()
+    simple = [rtn for rtn in return_types if _compile_simple(rtn) is not None]
+    print(f"{len(simple)} of {len(return_types)} bundled return types are simple")
+
+    simple = [rtn for rtn in simple if parser_supports(rtn)]
+    print(f"{len(simple)} of them are also supported by the parser")
+
+    parser_time = run(_parse, simple, number=3)
+    fast_path_time = run(_compile_simple, simple, number=100)
+
+    print(f"parser:    {parser_time * 1e6:10.1f} us per expression")
+    print(f"fast path: {fast_path_time * 1e6:10.1f} us per expression")
+    print(f"speedup:   {parser_time / fast_path_time:10.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+"""Compare shifting field references with the reflection based visitor it replaced.
+
+Each expression is a balanced tree of additions over the columns of a table,
+the references are shifted the way `Value.readjust` does when the table
+ends up on the right side of a join.
+
+    python -m benchmarks.bench_expression_visitor
+"""
+
+import timeit
+
+from google.protobuf.descriptor import FieldDescriptor
+from substrait.gen.proto import algebra_pb2 as stalg
+
+import subframe
+from subframe.utils import shift_field_references
+
+SIZES = (64, 512, 4096)
+
+
+def visit(proto_object, handler):
+    # the previous visitor, it looks at every message field of every message
+    handler(proto_object)
+    fields_to_visit = [
+        field
+        for field in proto_object.DESCRIPTOR.fields
+        if field.type == FieldDescriptor.TYPE_MESSAGE
+    ]
+    for field in fields_to_visit:
+        if field.label == FieldDescriptor.LABEL_REPEATED:
+            for i in proto_object.__getattribute__(field.name):
+                visit(i, handler)
+        elif proto_object.HasField(field.name):
+            visit(proto_object.__getattribute__(field.name), handler)
+
+
+def field_reference_transformer(transforms):
+    def handler(proto_object):
+        if type(proto_object) == stalg.Expression.FieldReference:
+            field = proto_object.direct_reference.struct_field.field
+            new_field = field
+
+            for t in transforms:
+                if field >= t[0][0] and field < t[0][1]:
+                    new_field = field + t[1]
+
+            proto_object.direct_reference.struct_field.field = new_field
+
+    return handler
+
+
+def balanced_sum(size: int) -> stalg.Expression:
+    table = subframe.table([(f"c{i}", "int64") for i in range(size)], name="t")
+    terms = [table[f"c{i}"] for i in range(size)]
+    while len(terms) > 1:
+        terms = [a + b for (a, b) in zip(terms[::2], terms[1::2])] + terms[
+            len(terms) - len(terms) % 2 :
+        ]
+    return terms[0].expression
+
+
+def run(shift, expression, number):
+    def copy_and_shift():
+        copy = stalg.Expression()
+        copy.CopyFrom(expression)
+        shift(copy)
+
+    return timeit.timeit(copy_and_shift, number=number) / number
+
+
+def main():
+    transforms = [((0, 1 << 20), 3)]
+    for size in SIZES:
+        expression = balanced_sum(size)
+        number = max(1, 20_000 // size)
+
+        reflection = run(
+            lambda e: visit(e, field_reference_transformer(transforms)),
+            expression,
+            number,
+        )
+        specialized = run(
+            lambda e: shift_field_references(e, transforms), expression, number
+        )
+
+        print(
+            f"{size:>5} columns: reflection {reflection * 1e3:7.2f} ms, "
+            f"specialized {specialized * 1e3:7.2f} ms "
+            f"({reflection / specialized:4.1f}x)"
+        )
+
+
+if __name__ == "__main__":
+    main()
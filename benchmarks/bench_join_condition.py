@@ -0,0 +1,44 @@
+"""Build expressions over the columns of two tables.
+
+Each step adds a column of the other table to the expression built so far,
+so its columns have to move behind the new column's table every time. The
+time per operator should stay flat as the expression grows.
+
+    python -m benchmarks.bench_join_condition
+"""
+
+import timeit
+
+import subframe
+
+SIZES = (10, 20, 30, 1000)
+
+
+def main():
+    left = subframe.table([(f"l{i}", "int64") for i in range(8)], name="l")
+    right = subframe.table([(f"r{i}", "int64") for i in range(8)], name="r")
+    columns = [right[f"r{i % 8}"] if i % 2 else left[f"l{i % 8}"] for i in range(8)]
+
+    for size in SIZES:
+
+        def build():
+            value = left["l0"]
+            for i in range(size):
+                value = columns[i % 8] + value
+            return value
+
+        number = max(1, 2_000 // size)
+        elapsed = min(timeit.repeat(build, number=number, repeat=5)) / number
+        value = build()
+        materialize = timeit.timeit(lambda: build().expression, number=number)
+        materialize = materialize / number - elapsed
+
+        print(
+            f"{size:>5} operators: {elapsed / size * 1e6:6.2f} us per operator, "
+            f"{materialize * 1e3:6.2f} ms to build the expression "
+            f"({len(value.expression.SerializeToString())} bytes)"
+        )
+
+
+if __name__ == "__main__":
+    main()
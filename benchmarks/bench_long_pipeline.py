@@ -0,0 +1,38 @@
+"""Build long chains of filter/select steps and turn them into a plan.
+
+Shows construction and `to_substrait()` growing linearly with the number of
+steps (extension files are preloaded).
+
+    python -m benchmarks.bench_long_pipeline
+"""
+
+import time
+
+import subframe
+from subframe import registry
+
+STEPS = (100, 500, 1_000, 2_000)
+
+
+def main():
+    registry.preload()
+
+    for steps in STEPS:
+        table = subframe.table([("a", "int64"), ("b", "int64")], name="t")
+
+        start = time.perf_counter()
+        for _ in range(steps):
+            table = table.filter(table["a"] > table["b"]).select("a", "b")
+        built = time.perf_counter()
+        plan = table.to_substrait()
+        planned = time.perf_counter()
+        size = len(plan.SerializeToString())
+
+        print(
+            f"{steps:>5} steps: build {(built - start) * 1e3:7.1f} ms, "
+            f"to_substrait {(planned - built) * 1e3:6.1f} ms, {size} bytes"
+        )
+
+
+if __name__ == "__main__":
+    main()
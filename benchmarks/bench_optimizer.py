@@ -0,0 +1,110 @@
+"""Execute plans with and without the optimizer on the test consumers.
+
+    python -m benchmarks.bench_optimizer
+"""
+
+import time
+
+import numpy as np
+import pyarrow as pa
+
+import subframe
+from subframe.optimizer import optimize
+from tests.consumers.acero import AceroSubstraitConsumer
+from tests.consumers.datafusion import DatafusionSubstraitConsumer
+from tests.consumers.duckdb import DuckDbSubstraitConsumer
+
+ROWS = 2_000_000
+WIDE_COLUMNS = 50
+REPEAT = 5
+
+
+def events():
+    return subframe.table(
+        [(c, "int64") for c in ("a", "b", "c", "d")],
+        name="events",
+    )
+
+
+def filters_and_projections():
+    table = events()
+    for left, right in [("a", "b"), ("b", "c"), ("c", "d"), ("a", "d")]:
+        table = table.filter(table[left] > table[right])
+    for i in range(4):
+        table = table.select("a", "b", "c", d=table["d"] + table["a"])
+    return table
+
+
+def limit_over_union_all():
+    branches = []
+    for left, right in [("a", "b"), ("b", "c"), ("c", "d"), ("a", "d")]:
+        table = events()
+        branches.append(
+            table.filter(table[left] > table[right]).select(
+                "a", s=table["b"] + table["c"]
+            )
+        )
+    return branches[0].union(*branches[1:], distinct=False).limit(10, 0)
+
+
+def narrow_select_from_wide():
+    table = subframe.table(
+        [(f"c{i}", "int64") for i in range(WIDE_COLUMNS)], name="wide"
+    )
+    return table.filter(table["c1"] > table["c2"]).select(s=table["c3"] + table["c1"])
+
+
+def repeated_subexpressions():
+    table = events()
+    total = ((table["a"] + table["b"]) - table["c"]) + table["d"]
+    return table.select(
+        w=total + table["a"],
+        x=total - table["b"],
+        y=total + table["c"],
+        z=total - table["d"],
+    )
+
+
+def main():
+    rng = np.random.default_rng(0)
+    data = pa.table({c: rng.integers(0, 1000, ROWS) for c in ("a", "b", "c", "d")})
+    wide = pa.table(
+        {f"c{i}": rng.integers(0, 1000, ROWS // 4) for i in range(WIDE_COLUMNS)}
+    )
+    datasets = {"events": data, "wide": wide}
+
+    consumers = {
+        "acero": AceroSubstraitConsumer().with_tables(datasets),
+        "datafusion": DatafusionSubstraitConsumer().with_tables(datasets),
+        "duckdb": DuckDbSubstraitConsumer().with_tables(datasets),
+    }
+
+    for query in (
+        filters_and_projections,
+        limit_over_union_all,
+        narrow_select_from_wide,
+        repeated_subexpressions,
+    ):
+        table = query()
+
+        for name, consumer in consumers.items():
+            # acero doesn't support ReadRel.projection
+            optimized = optimize(table, read_projection=name != "acero")
+            timings = []
+            for plan in (table.to_substrait(), optimized.to_substrait()):
+                try:
+                    consumer.execute(plan)
+                    start = time.perf_counter()
+                    for _ in range(REPEAT):
+                        consumer.execute(plan)
+                    timings.append(
+                        f"{(time.perf_counter() - start) / REPEAT * 1e3:8.1f} ms"
+                    )
+                except Exception:
+                    timings.append(f"{'unsupported':>11}")
+
+            print(f"{query.__name__:<24} {name:<11} " + " / ".join(timings))
+
+
+if __name__ == "__main__":
+    main()
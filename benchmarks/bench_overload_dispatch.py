@@ -0,0 +1,85 @@
+"""Resolve every overload in the bundled extension YAMLs.
+
+Each impl gets a concrete signature built from its declared arguments and
+is resolved with a linear scan over all impls of the function (the old
+behaviour) and through the arity/kind index. The resolution cache is
+bypassed in both cases.
+
+    python -m benchmarks.bench_overload_dispatch
+"""
+
+import timeit
+
+from substrait.gen.proto.type_pb2 import Type
+
+from subframe.data_type import from_proto
+from subframe.extension_registry import FunctionRegistry
+
+
+def concrete_type(parameterized_type) -> Type:
+    kind = parameterized_type.WhichOneof("kind")
+
+    if kind == "type_parameter":
+        return Type(i64=Type.I64())
+    elif kind == "decimal":
+        return Type(decimal=Type.Decimal(precision=10, scale=2))
+    elif kind == "list":
+        return Type(list=Type.List(type=concrete_type(parameterized_type.list.type)))
+    else:
+        return Type(**{kind: {}})
+
+
+def signatures(registry: FunctionRegistry):
+    for uri, functions in registry._extension_mapping.items():
+        for name, overloads in functions.items():
+            for entry in overloads:
+                signature = [
+                    from_proto(concrete_type(a)) for a in entry.value_arguments
+                ]
+                if entry.variadic:
+                    signature = signature * max(entry.variadic.get("min", 1), 1)
+                yield (uri, name, signature)
+
+
+def linear_resolve(registry: FunctionRegistry, uri, name, signature):
+    for f in registry._extension_mapping[uri][name]:
+        rtn = f.satisfies_signature(signature)
+        if rtn is not None:
+            return (f, rtn)
+
+
+def resolvable(registry: FunctionRegistry, uri, name, signature) -> bool:
+    try:
+        expected = linear_resolve(registry, uri, name, signature)
+    except Exception:
+        # return types the evaluator doesn't support yet
+        return False
+
+    assert expected == registry._resolve(uri, name, signature)
+    return True
+
+
+def main():
+    registry = FunctionRegistry()
+    registry.preload()
+
+    lookups = [s for s in signatures(registry) if resolvable(registry, *s)]
+    print(f"{len(lookups)} resolvable overloads")
+
+    def run(resolve):
+        def resolve_all():
+            for lookup in lookups:
+                resolve(registry, *lookup)
+
+        return timeit.timeit(resolve_all, number=20) / (20 * len(lookups))
+
+    linear = run(linear_resolve)
+    indexed = run(FunctionRegistry._resolve)
+
+    print(f"linear scan: {linear * 1e6:8.1f} us per lookup")
+    print(f"indexed:     {indexed * 1e6:8.1f} us per lookup")
+    print(f"speedup:     {linear / indexed:8.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,46 @@
+"""Serialize small queries over a large shared base plan.
+
+The base is a UNION ALL of many wide named tables. Each query filters and
+projects it and is serialized once, with `to_substrait_bytes()` and by
+building and serializing the whole plan message.
+
+    python -m benchmarks.bench_plan_bytes
+"""
+
+import time
+
+import subframe
+
+TABLES = 2_000
+COLUMNS = 400
+QUERIES = 20
+
+
+def main():
+    schema = [(f"c{i}", "int64") for i in range(COLUMNS)]
+    tables = [subframe.table(schema, name=f"t{i}") for i in range(TABLES)]
+    base = tables[0].union(*tables[1:], distinct=False)
+
+    start = time.perf_counter()
+    size = len(base.to_substrait_bytes())
+    print(f"base: {size / 2**20:.1f} MiB in {time.perf_counter() - start:.3f} s")
+
+    for spliced in (True, False):
+        elapsed = 0.0
+        for i in range(QUERIES):
+            query = base.filter(base[f"c{i}"] > base["c0"]).select("c0", f"c{i}")
+            start = time.perf_counter()
+            if spliced:
+                query.to_substrait_bytes()
+            else:
+                query.to_substrait().SerializeToString()
+            elapsed += time.perf_counter() - start
+
+        print(
+            f"{'spliced' if spliced else 'whole plan':>10}: "
+            f"{elapsed / QUERIES * 1e3:8.2f} ms per query"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,49 @@
+"""Build a projection of many `t[a] + t[b]` expressions.
+
+Compares one operator call per expression with Table.binary_op, starting
+from a cold resolution cache each time (extension files are preloaded).
+
+    python -m benchmarks.bench_wide_projection
+"""
+
+import time
+
+import subframe
+from subframe import registry
+
+N_COLUMNS = 200
+N_EXPRESSIONS = 10_000
+
+
+def main():
+    table = subframe.table(
+        [(f"c{i}", "int64" if i % 2 else "float") for i in range(N_COLUMNS)],
+        name="wide",
+    )
+    # both sides of a pair have the same type
+    pairs = [
+        (f"c{i % N_COLUMNS}", f"c{(i + 2 * (i // N_COLUMNS + 1)) % N_COLUMNS}")
+        for i in range(N_EXPRESSIONS)
+    ]
+
+    registry.clear_cache()
+    start = time.perf_counter()
+    table.select(
+        *[(table[a] + table[b]).name(f"e{i}") for i, (a, b) in enumerate(pairs)]
+    )
+    per_expression = time.perf_counter() - start
+
+    registry.clear_cache()
+    start = time.perf_counter()
+    table.select(
+        *[v.name(f"e{i}") for i, v in enumerate(table.binary_op("add", pairs))]
+    )
+    batched = time.perf_counter() - start
+
+    print(f"{N_EXPRESSIONS} expressions over {N_COLUMNS} columns")
+    print(f"operator per expression: {per_expression * 1e3:8.1f} ms")
+    print(f"binary_op:               {batched * 1e3:8.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,34 @@
+"""Select and sort columns of very wide tables.
+
+Each run selects every other column and sorts by a few of them, so the time
+per column should stay flat as the schema grows.
+
+    python -m benchmarks.bench_wide_schema
+"""
+
+import time
+
+import subframe
+
+WIDTHS = (10_000, 20_000, 50_000, 100_000)
+
+
+def main():
+    for width in WIDTHS:
+        table = subframe.table([(f"c{i}", "int64") for i in range(width)], name="wide")
+        columns = [f"c{i}" for i in range(0, width, 2)]
+
+        start = time.perf_counter()
+        table.filter(table["c0"] > table["c1"]).select(*columns).order_by(
+            *columns[:100]
+        )
+        elapsed = time.perf_counter() - start
+
+        print(
+            f"{width:>7} columns: {elapsed * 1e3:8.1f} ms, "
+            f"{elapsed / len(columns) * 1e6:5.2f} us per selected column"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -1,13 +1,14 @@
-from typing import Any
+from typing import Any, Iterable
 from builtins import type as ptype
 
 from substrait.gen.proto import type_pb2 as stt
 from substrait.gen.proto import algebra_pb2 as stalg
 from .table import Table
-from .value import Value
+from .value import Value, associative_call
 from .utils import infer_literal_type
 from .extension_registry import FunctionRegistry
 from .case_builder import CaseBuilder
+from .extension_set import empty_extensions, function_extension
 
 registry = FunctionRegistry()
 
@@ -51,7 +52,7 @@ def table(schema, name):
     # plan: stalg.RelRoot = stalg.RelRoot(input=rel, names=column_names)
 
     return Table(
-        rel=rel, names=column_names, struct=struct, extensions={}, relations=[]
+        rel=rel, names=column_names, struct=struct, extensions=empty_extensions
     )
 
 
@@ -136,10 +137,10 @@ def literal(value: Any, type: str = None) -> Value:
 def row_number():
     from subframe import registry
 
-    (func_entry, rtn) = registry.lookup_function(
+    (func_entry, rtn) = registry.resolve_function(
         "functions_arithmetic.yaml",
         function_name="row_number",
-        signature=[],
+        signature=(),
     )
 
     expression = stalg.Expression(
@@ -157,11 +158,40 @@ def row_number():
         expression=expression,
         data_type=rtn,
         name="RowNumber",
-        extensions={func_entry.uri: {str(func_entry): func_entry.anchor}},
+        extensions=function_extension(
+            func_entry.uri, str(func_entry), func_entry.anchor
+        ),
         tables=[],
     )
 
 
+def sum_of(values: Iterable[Value]) -> Value:
+    """The sum of `values`, see `associative_call` for the shape of the expression."""
+    return associative_call(list(values), "functions_arithmetic.yaml", "add", "Add")
+
+
+def all_of(predicates: Iterable[Value]) -> Value:
+    """Whether all of `predicates` hold, a single variadic `and` call."""
+    return associative_call(list(predicates), "functions_boolean.yaml", "and", "And")
+
+
+def any_of(predicates: Iterable[Value]) -> Value:
+    """Whether any of `predicates` holds, a single variadic `or` call."""
+    return associative_call(list(predicates), "functions_boolean.yaml", "or", "Or")
+
+
+def optimize(table: Table) -> Table:
+    """Rewrite the plan of `table` into a simpler one with the same result.
+
+    Evaluates calls on literals, fuses consecutive projections, merges
+    consecutive filters, computes repeated subexpressions once, pushes
+    filters towards the tables they read from, pushes limits below
+    projections and into UNION ALL inputs and prunes the columns read from
+    tables to the ones the plan uses.
+    """
+    return table.optimize()
+
+
 def to_sql(table: Table) -> str:
     from subframe.sql import translate_plan
 
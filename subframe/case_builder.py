@@ -1,22 +1,24 @@
 from substrait.gen.proto import algebra_pb2 as stalg
 from .value import Value
-from .utils import merge_extensions
+from .extension_set import empty_extensions
 
 
 class CaseBuilder:
     def __init__(self):
         self.cases = []
         self.otherwise = None
-        self.extensions = {}
+        self.extensions = empty_extensions
 
     def when(self, if_value: Value, then_value: Value):
         self.cases.append((if_value, then_value))
-        self.extensions = merge_extensions(self.extensions, [if_value, then_value])
+        self.extensions = self.extensions.union(
+            if_value.extensions, then_value.extensions
+        )
         return self
 
     def else_(self, else_value: Value):
         self.otherwise = else_value
-        self.extensions = merge_extensions(self.extensions, [else_value])
+        self.extensions = self.extensions.union(else_value.extensions)
         return self
 
     def end(self):
@@ -35,7 +37,7 @@ class CaseBuilder:
 
         return Value(
             expression=stalg.Expression(if_then=if_then),
-            data_type=self.otherwise.data_type,  # TODO validate type, allow ommitin else
+            data_type=self.otherwise.dtype,  # TODO validate type, allow ommitin else
             name="IfThen",  # TODO update to match ibis
             extensions=self.extensions,
             tables=[],  # TODO
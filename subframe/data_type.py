@@ -0,0 +1,158 @@
+from typing import Optional
+from substrait.gen.proto.type_pb2 import Type
+
+# integer parameters of each kind, in the order they're kept in `parameters`
+integer_parameters = {
+    "decimal": ("precision", "scale"),
+    "varchar": ("length",),
+    "fixed_char": ("length",),
+    "fixed_binary": ("length",),
+    "precision_timestamp": ("precision",),
+    "precision_timestamp_tz": ("precision",),
+    "interval_day": ("precision",),
+    "interval_compound": ("precision",),
+}
+
+_interned: dict[tuple, "DataType"] = {}
+
+
+class DataType:
+    """Immutable substrait type, interned so that equal types are the same object.
+
+    Comparing two DataTypes is an identity check and they can be used as
+    dict keys directly. `parameters` holds the integer parameters of
+    parameterized kinds (e.g. precision and scale of a decimal) or the nested
+    DataTypes of list, map and struct.
+    """
+
+    __slots__ = ("kind", "nullability", "parameters", "variation", "_proto")
+
+    def __init__(
+        self,
+        kind: Optional[str],
+        nullability: int,
+        parameters: tuple,
+        variation: int,
+    ) -> None:
+        self.kind = kind
+        self.nullability = nullability
+        self.parameters = parameters
+        self.variation = variation
+        self._proto = None
+
+    def __setattr__(self, name, value):
+        if name != "_proto" and hasattr(self, name):
+            raise AttributeError("DataType is immutable")
+        object.__setattr__(self, name, value)
+
+    def __reduce__(self):
+        return (
+            data_type,
+            (self.kind, self.nullability, self.parameters, self.variation),
+        )
+
+    def __repr__(self) -> str:
+        parameters = (
+            f"<{', '.join(map(repr, self.parameters))}>" if self.parameters else ""
+        )
+        nullable = "?" if self.nullability == Type.NULLABILITY_NULLABLE else ""
+        return f"{self.kind}{nullable}{parameters}"
+
+    @property
+    def nullable(self) -> bool:
+        return self.nullability == Type.NULLABILITY_NULLABLE
+
+    def to_proto(self) -> Type:
+        """The equivalent `Type` message.
+
+        It's built once per DataType and shared, so it must not be modified.
+        """
+        if self._proto is None:
+            self._proto = _to_proto(self)
+        return self._proto
+
+
+def data_type(
+    kind: Optional[str],
+    nullability: int = Type.NULLABILITY_UNSPECIFIED,
+    parameters: tuple = (),
+    variation: int = 0,
+) -> DataType:
+    key = (kind, nullability, parameters, variation)
+    dtype = _interned.get(key)
+    if dtype is None:
+        dtype = _interned.setdefault(key, DataType(*key))
+    return dtype
+
+
+def from_proto(dtype: Type) -> DataType:
+    if isinstance(dtype, DataType):
+        return dtype
+
+    kind = dtype.WhichOneof("kind")
+
+    if kind is None:
+        return data_type(None)
+    elif kind == "user_defined_type_reference":
+        return data_type(kind, parameters=(dtype.user_defined_type_reference,))
+
+    message = getattr(dtype, kind)
+
+    if kind in integer_parameters:
+        parameters = tuple(
+            (
+                getattr(message, f)
+                if not message.DESCRIPTOR.fields_by_name[f].has_presence
+                or message.HasField(f)
+                else None
+            )
+            for f in integer_parameters[kind]
+        )
+    elif kind == "struct":
+        parameters = tuple(from_proto(t) for t in message.types)
+    elif kind == "list":
+        parameters = (from_proto(message.type),) if message.HasField("type") else ()
+    elif kind == "map":
+        parameters = (from_proto(message.key), from_proto(message.value))
+    elif kind == "user_defined":
+        parameters = (message.type_reference,) + tuple(
+            p.SerializeToString(deterministic=True) for p in message.type_parameters
+        )
+    else:
+        parameters = ()
+
+    return data_type(
+        kind, message.nullability, parameters, message.type_variation_reference
+    )
+
+
+def _to_proto(dtype: DataType) -> Type:
+    if dtype.kind is None:
+        return Type()
+    elif dtype.kind == "user_defined_type_reference":
+        return Type(user_defined_type_reference=dtype.parameters[0])
+
+    proto = Type()
+    message = getattr(proto, dtype.kind)
+    message.SetInParent()
+    message.nullability = dtype.nullability
+    message.type_variation_reference = dtype.variation
+
+    if dtype.kind in integer_parameters:
+        for f, value in zip(integer_parameters[dtype.kind], dtype.parameters):
+            if value is not None:
+                setattr(message, f, value)
+    elif dtype.kind == "struct":
+        message.types.extend([t.to_proto() for t in dtype.parameters])
+    elif dtype.kind == "list":
+        if dtype.parameters:
+            message.type.CopyFrom(dtype.parameters[0].to_proto())
+    elif dtype.kind == "map":
+        message.key.CopyFrom(dtype.parameters[0].to_proto())
+        message.value.CopyFrom(dtype.parameters[1].to_proto())
+    elif dtype.kind == "user_defined":
+        message.type_reference = dtype.parameters[0]
+        for p in dtype.parameters[1:]:
+            message.type_parameters.add().ParseFromString(p)
+
+    return proto
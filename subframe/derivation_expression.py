@@ -1,102 +1,221 @@
-from typing import Optional
-from antlr4 import InputStream, CommonTokenStream
-from subframe.gen.SubstraitTypeLexer import SubstraitTypeLexer
-from subframe.gen.SubstraitTypeParser import SubstraitTypeParser
-from substrait.gen.proto.type_pb2 import Type
+import operator
+import re
+from functools import lru_cache
+from typing import Any, Callable, Optional
+from .data_type import DataType, data_type, integer_parameters
 
+Evaluator = Callable[[dict], Any]
+
+_binary_ops = {
+    "+": operator.add,
+    "-": operator.sub,
+    "*": operator.mul,
+    ">": operator.gt,
+    ">=": operator.ge,
+    "<": operator.lt,
+    "<=": operator.le,
+}
+
+_functions = {
+    "min": min,
+    "max": max,
+}
+
+_simple_types = {
+    "boolean": data_type("bool"),
+    "i8": data_type("i8"),
+    "i16": data_type("i16"),
+    "i32": data_type("i32"),
+    "i64": data_type("i64"),
+    "fp32": data_type("fp32"),
+    "fp64": data_type("fp64"),
+    "string": data_type("string"),
+    "binary": data_type("binary"),
+    "timestamp": data_type("timestamp"),
+    "timestamp_tz": data_type("timestamp_tz"),
+    "date": data_type("date"),
+    "time": data_type("time"),
+    "interval_year": data_type("interval_year"),
+    "uuid": data_type("uuid"),
+}
+
+# name -> kind, the parameters are the kind's integer parameters
+_parameterized_types = {
+    "decimal": "decimal",
+    "varchar": "varchar",
+    "fixedchar": "fixed_char",
+    "fixedbinary": "fixed_binary",
+    "interval_day": "interval_day",
+    "precision_timestamp": "precision_timestamp",
+    "precision_timestamp_tz": "precision_timestamp_tz",
+}
+
+# words the lexer doesn't treat as identifiers
+_keywords = {
+    *_simple_types,
+    *_parameterized_types,
+    "if",
+    "then",
+    "else",
+    "and",
+    "or",
+    "any",
+    "interval_compound",
+    "struct",
+    "nstruct",
+    "list",
+    "map",
+}
+
+_identifier = r"[A-Za-z_$][A-Za-z0-9_$]*"
+_identifier_re = re.compile(_identifier)
+_number_re = re.compile(r"-?[0-9]+")
+_simple_type_re = re.compile(rf"\s*({_identifier})\s*\??\s*")
+_parameterized_type_re = re.compile(rf"\s*({_identifier})\s*\??\s*<([^<>]*)>\s*")
+
+
+def _compile_parameter(txt: str) -> Optional[Evaluator]:
+    if _number_re.fullmatch(txt):
+        number = int(txt)
+        return lambda values: number
+    elif _identifier_re.fullmatch(txt) and txt.lower() not in _keywords:
+        return lambda values: values[txt]
+    else:
+        return None
+
+
+def _compile_simple(x: str) -> Optional[Evaluator]:
+    """Compile plain types like `i64`, `boolean?`, `any1` or `decimal<P, 0>`.
+
+    Returns None for anything that needs the full grammar.
+    """
+    if match := _simple_type_re.fullmatch(x):
+        name = match.group(1)
+        if name.lower() in _simple_types:
+            dtype = _simple_types[name.lower()]
+            return lambda values: dtype
+        return _compile_parameter(name)
+
+    if match := _parameterized_type_re.fullmatch(x):
+        name = match.group(1).lower()
+        if name not in _parameterized_types:
+            return None
+
+        kind = _parameterized_types[name]
+        parameters = [_compile_parameter(p.strip()) for p in match.group(2).split(",")]
+        if len(parameters) != len(integer_parameters[kind]) or None in parameters:
+            return None
+
+        return lambda values: data_type(
+            kind, parameters=tuple(p(values) for p in parameters)
+        )
+
+    return None
+
+
+def _compile(x) -> Evaluator:
+    from subframe.gen.SubstraitTypeParser import SubstraitTypeParser
 
-def _evaluate(x, values: dict):
     if type(x) == SubstraitTypeParser.BinaryExprContext:
-        left = _evaluate(x.left, values)
-        right = _evaluate(x.right, values)
-
-        if x.op.text == "+":
-            return left + right
-        elif x.op.text == "-":
-            return left - right
-        elif x.op.text == "*":
-            return left * right
-        elif x.op.text == ">":
-            return left > right
-        elif x.op.text == ">=":
-            return left >= right
-        elif x.op.text == "<":
-            return left < right
-        elif x.op.text == ">":
-            return left <= right
-        else:
+        left = _compile(x.left)
+        right = _compile(x.right)
+
+        if x.op.text not in _binary_ops:
             raise Exception(f"Unknown binary op {x.op.text}")
+        op = _binary_ops[x.op.text]
+
+        return lambda values: op(left(values), right(values))
     elif type(x) == SubstraitTypeParser.LiteralNumberContext:
-        return int(x.number.text)
+        number = int(x.number.text)
+        return lambda values: number
+    elif type(x) == SubstraitTypeParser.NumericLiteralContext:
+        number = int(x.Number().symbol.text)
+        return lambda values: number
     elif type(x) == SubstraitTypeParser.TypeParamContext:
-        return values[x.identifier.text]
+        identifier = x.identifier.text
+        return lambda values: values[identifier]
     elif type(x) == SubstraitTypeParser.NumericParameterNameContext:
-        return values[x.Identifier().symbol.text]
+        identifier = x.Identifier().symbol.text
+        return lambda values: values[identifier]
     elif type(x) == SubstraitTypeParser.ParenExpressionContext:
-        return _evaluate(x.expr(), values)
+        return _compile(x.expr())
     elif type(x) == SubstraitTypeParser.FunctionCallContext:
-        exprs = [_evaluate(e, values) for e in x.expr()]
+        exprs = [_compile(e) for e in x.expr()]
         func = x.Identifier().symbol.text
 
-        if func == "min":
-            return min(*exprs)
-        elif func == "max":
-            return max(*exprs)
-        else:
+        if func not in _functions:
             raise Exception(f"Unknown function {func}")
+        fn = _functions[func]
+
+        return lambda values: fn(*[e(values) for e in exprs])
     elif type(x) == SubstraitTypeParser.TypeContext:
         scalar_type = x.scalarType()
         parametrized_type = x.parameterizedType()
         if scalar_type:
-            if isinstance(scalar_type, SubstraitTypeParser.I8Context):
-                return Type(i8=Type.I8())
-            elif isinstance(scalar_type, SubstraitTypeParser.I16Context):
-                return Type(i16=Type.I16())
-            elif isinstance(scalar_type, SubstraitTypeParser.I32Context):
-                return Type(i32=Type.I32())
-            elif isinstance(scalar_type, SubstraitTypeParser.I64Context):
-                return Type(i64=Type.I64())
-            elif isinstance(scalar_type, SubstraitTypeParser.Fp32Context):
-                return Type(fp32=Type.FP32())
-            elif isinstance(scalar_type, SubstraitTypeParser.Fp64Context):
-                return Type(fp64=Type.FP64())
-            elif isinstance(scalar_type, SubstraitTypeParser.BooleanContext):
-                return Type(bool=Type.Boolean())
-            else:
+            name = scalar_type.getText().lower()
+            if name not in _simple_types:
                 raise Exception(f"Unknown scalar type {type(scalar_type)}")
+            dtype = _simple_types[name]
+
+            return lambda values: dtype
         elif parametrized_type:
             if isinstance(parametrized_type, SubstraitTypeParser.DecimalContext):
-                precision = _evaluate(parametrized_type.precision, values)
-                scale = _evaluate(parametrized_type.scale, values)
-                return Type(decimal=Type.Decimal(precision=precision, scale=scale))
+                precision = _compile(parametrized_type.precision)
+                scale = _compile(parametrized_type.scale)
+
+                return lambda values: data_type(
+                    "decimal", parameters=(precision(values), scale(values))
+                )
             raise Exception(f"Unknown parametrized type {type(parametrized_type)}")
         else:
             raise Exception()
     elif type(x) == SubstraitTypeParser.NumericExpressionContext:
-        return _evaluate(x.expr(), values)
+        return _compile(x.expr())
     elif type(x) == SubstraitTypeParser.TernaryContext:
-        ifExpr = _evaluate(x.ifExpr, values)
-        thenExpr = _evaluate(x.thenExpr, values)
-        elseExpr = _evaluate(x.elseExpr, values)
+        if_expr = _compile(x.ifExpr)
+        then_expr = _compile(x.thenExpr)
+        else_expr = _compile(x.elseExpr)
 
-        return thenExpr if ifExpr else elseExpr
+        return lambda values: (
+            then_expr(values) if if_expr(values) else else_expr(values)
+        )
     elif type(x) == SubstraitTypeParser.MultilineDefinitionContext:
-        lines = zip(x.Identifier(), x.expr())
+        lines = [(i.symbol.text, _compile(e)) for i, e in zip(x.Identifier(), x.expr())]
+        final_type = _compile(x.finalType)
 
-        for i, e in lines:
-            identifier = i.symbol.text
-            expr_eval = _evaluate(e, values)
-            values[identifier] = expr_eval
+        def multiline(values):
+            values = dict(values)
+            for identifier, expr in lines:
+                values[identifier] = expr(values)
 
-        return _evaluate(x.finalType, values)
+            return final_type(values)
+
+        return multiline
     elif type(x) == SubstraitTypeParser.TypeLiteralContext:
-        return _evaluate(x.type_(), values)
+        return _compile(x.type_())
     else:
         raise Exception(f"Unknown token type {type(x)}")
 
 
-def evaluate(x: str, values: Optional[dict] = None):
+def _parse(x: str) -> Evaluator:
+    # the antlr runtime and the generated modules are slow to import, they're
+    # only loaded once an expression actually needs the grammar
+    from antlr4 import InputStream, CommonTokenStream
+    from subframe.gen.SubstraitTypeLexer import SubstraitTypeLexer
+    from subframe.gen.SubstraitTypeParser import SubstraitTypeParser
+
     lexer = SubstraitTypeLexer(InputStream(x))
     stream = CommonTokenStream(lexer)
     parser = SubstraitTypeParser(stream)
-    return _evaluate(parser.expr(), values)
+    return _compile(parser.expr())
+
+
+@lru_cache(maxsize=1024)
+def compile_expression(x: str) -> Evaluator:
+    """Parse a derivation expression into a function of its parameter bindings."""
+    return _compile_simple(x) or _parse(x)
+
+
+def evaluate(x: str, values: Optional[dict] = None):
+    result = compile_expression(x)(values or {})
+    return result.to_proto() if isinstance(result, DataType) else result
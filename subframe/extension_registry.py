@@ -1,14 +1,17 @@
 from substrait.gen.proto.parameterized_types_pb2 import ParameterizedType
 from substrait.gen.proto.type_pb2 import Type
 from importlib.resources import files as importlib_files
+import hashlib
 import itertools
-from collections import defaultdict
+import os
+import pickle
+from collections import OrderedDict, defaultdict, namedtuple
 from collections.abc import Iterator, Mapping
 from pathlib import Path
 from typing import Any, Optional, Union
-from .derivation_expression import evaluate
+from .data_type import DataType, from_proto
+from .derivation_expression import compile_expression
 
-import yaml
 import re
 
 _normalized_key_names = {
@@ -156,15 +159,46 @@ def to_parameterized_type(dtype: str):
         raise Exception(f"Unkownn type - {dtype}")
 
 
-def violates_integer_option(
-    actual: int, option: ParameterizedType.IntegerOption, parameters: dict
-):
-    integer_type = option.WhichOneof("integer_type")
+def to_argument_pattern(parameterized_type: ParameterizedType) -> tuple:
+    """Flatten a parameterized argument type into `(kind, name, options)`.
+
+    `name` is the type parameter name for `any`-like arguments and `options`
+    the integer options of parameterized kinds, as `("literal", value)` or
+    `("parameter", name)` tuples in DataType parameter order.
+    """
+    kind = parameterized_type.WhichOneof("kind")
+
+    if kind == "type_parameter":
+        return (kind, parameterized_type.type_parameter.name, ())
+    elif kind == "decimal":
+        decimal = parameterized_type.decimal
+        return (
+            kind,
+            None,
+            (
+                _to_integer_pattern(decimal.precision),
+                _to_integer_pattern(decimal.scale),
+            ),
+        )
+
+    # TODO handle all types
+    return (kind, None, ())
+
+
+def _to_integer_pattern(option: ParameterizedType.IntegerOption) -> tuple:
+    if option.WhichOneof("integer_type") == "literal":
+        return ("literal", option.literal)
+    else:
+        return ("parameter", option.parameter.name)
 
-    if integer_type == "literal" and actual != option.literal:
+
+def violates_integer_option(actual: int, option: tuple, parameters: dict):
+    (integer_type, value) = option
+
+    if integer_type == "literal" and actual != value:
         return True
     else:
-        parameter_name = option.parameter.name
+        parameter_name = value if integer_type == "parameter" else ""
         if parameter_name in parameters and parameters[parameter_name] != actual:
             return True
         else:
@@ -173,39 +207,26 @@ def violates_integer_option(
     return False
 
 
-def covers(dtype: Type, parameterized_type: ParameterizedType, parameters: dict):
-    expected_kind = parameterized_type.WhichOneof("kind")
+def covers(dtype: DataType, pattern: tuple, parameters: dict):
+    (expected_kind, parameter_name, options) = pattern
 
     if expected_kind == "type_parameter":
-        parameter_name = parameterized_type.type_parameter.name
         if parameter_name == "any":
             return True
         else:
-            if parameter_name in parameters and parameters[
-                parameter_name
-            ].SerializeToString(deterministic=True) != dtype.SerializeToString(
-                deterministic=True
-            ):
+            if parameter_name in parameters and parameters[parameter_name] is not dtype:
                 return False
             else:
                 parameters[parameter_name] = dtype
                 return True
 
-    kind = dtype.WhichOneof("kind")
-
-    if kind != expected_kind:
+    if dtype.kind != expected_kind:
         return False
 
-    if kind == "decimal":
-        if violates_integer_option(
-            dtype.decimal.scale, parameterized_type.decimal.scale, parameters
-        ) or violates_integer_option(
-            dtype.decimal.precision, parameterized_type.decimal.precision, parameters
-        ):
+    for actual, option in zip(dtype.parameters, options):
+        if violates_integer_option(actual, option, parameters):
             return False
 
-    # TODO handle all types
-
     return True
 
 
@@ -218,6 +239,8 @@ class FunctionEntry:
         self.uri: str = ""
         self.anchor = next(id_generator)
         self.value_arguments = []
+        self.argument_patterns: list[tuple] = []
+        self._rtn_evaluator = None
 
     def parse(self, impl: Mapping[str, Any]) -> None:
         self.rtn = impl["return"]
@@ -227,6 +250,9 @@ class FunctionEntry:
             for val in input_args:
                 if typ := val.get("value"):
                     self.value_arguments.append(to_parameterized_type(typ.strip("?")))
+                    self.argument_patterns.append(
+                        to_argument_pattern(self.value_arguments[-1])
+                    )
                     self.normalized_inputs.append(normalize_substrait_type_names(typ))
                 elif arg_name := val.get("name", None):
                     self.arg_names.append(arg_name)
@@ -238,17 +264,32 @@ class FunctionEntry:
     def __repr__(self) -> str:
         return f"{self.name}:{'_'.join(self.normalized_inputs)}"
 
+    def __getstate__(self) -> dict:
+        state = self.__dict__.copy()
+        state["_rtn_evaluator"] = None
+        state["value_arguments"] = [a.SerializeToString() for a in self.value_arguments]
+        return state
+
+    def __setstate__(self, state: dict) -> None:
+        state["value_arguments"] = [
+            ParameterizedType.FromString(a) for a in state["value_arguments"]
+        ]
+        self.__dict__.update(state)
+        # anchors are only unique within a process, entries restored from a
+        # snapshot get fresh ones
+        self.anchor = next(id_generator)
+
     def castable(self) -> None:
         raise NotImplementedError
 
-    def satisfies_signature(self, signature: tuple) -> Optional[str]:
+    def satisfies_signature(self, signature: tuple) -> Optional[DataType]:
         if self.variadic:
             min_args_allowed = self.variadic.get("min", 0)
             if len(signature) < min_args_allowed:
                 return None
-            inputs = [self.value_arguments[0]] * len(signature)
+            inputs = [self.argument_patterns[0]] * len(signature)
         else:
-            inputs = self.value_arguments
+            inputs = self.argument_patterns
         if len(inputs) != len(signature):
             return None
 
@@ -257,7 +298,14 @@ class FunctionEntry:
         parameters = {}
 
         if all([covers(y, x, parameters) for (x, y) in zipped_args]):
-            return evaluate(self.rtn, parameters)
+            if self._rtn_evaluator is None:
+                self._rtn_evaluator = compile_expression(self.rtn)
+            return self._rtn_evaluator(parameters)
+
+    def first_kind(self) -> Optional[str]:
+        if not self.argument_patterns:
+            return None
+        return self.argument_patterns[0][0]
 
 
 def _parse_func(entry: Mapping[str, Any]) -> Iterator[FunctionEntry]:
@@ -268,9 +316,105 @@ def _parse_func(entry: Mapping[str, Any]) -> Iterator[FunctionEntry]:
         yield sf
 
 
-class FunctionRegistry:
+def _parse_definitions(definitions: dict, uri: str) -> dict[str, list[FunctionEntry]]:
+    functions: dict[str, list[FunctionEntry]] = {}
+    for named_functions in definitions.values():
+        for function in named_functions:
+            for func in _parse_func(function):
+                func.uri = uri
+                functions.setdefault(function["name"], []).append(func)
+
+    return functions
+
+
+class FunctionOverloads:
+    """The impls registered under one function name.
+
+    Impls are bucketed by argument count (variadic ones separately) and by
+    the kind of their first argument, so a lookup only checks the impls that
+    could accept a signature. Candidates keep registration order.
+    """
+
     def __init__(self) -> None:
+        self.entries: list[FunctionEntry] = []
+        self._by_arity: dict[int, dict[Optional[str], list]] = defaultdict(
+            lambda: defaultdict(list)
+        )
+        self._variadic: dict[Optional[str], list] = defaultdict(list)
+        self._candidates: dict[tuple, list[FunctionEntry]] = {}
+
+    def __iter__(self) -> Iterator[FunctionEntry]:
+        return iter(self.entries)
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def extend(self, entries: list[FunctionEntry]) -> None:
+        for entry in entries:
+            position = (len(self.entries), entry)
+            self.entries.append(entry)
+
+            kind = entry.first_kind()
+            if kind == "type_parameter":
+                kind = None
+
+            if entry.variadic:
+                self._variadic[kind].append(position)
+            else:
+                self._by_arity[len(entry.value_arguments)][kind].append(position)
+
+        self._candidates.clear()
+
+    def candidates(self, signature: tuple) -> list[FunctionEntry]:
+        key = (len(signature), signature[0].kind if signature else None)
+
+        if key not in self._candidates:
+            (arity, kind) = key
+            fixed = self._by_arity.get(arity, {})
+            positions = [
+                *fixed.get(kind, []),
+                *(fixed.get(None, []) if kind is not None else []),
+                *[
+                    p
+                    for k in {kind, None}
+                    for p in self._variadic.get(k, [])
+                    if arity >= p[1].variadic.get("min", 0)
+                ],
+            ]
+            self._candidates[key] = [entry for (_, entry) in sorted(positions)]
+
+        return self._candidates[key]
+
+
+def _with_proto_type(resolved: Optional[tuple]) -> Optional[tuple]:
+    if resolved is None or not isinstance(resolved[1], DataType):
+        return resolved
+
+    (func_entry, rtn) = resolved
+    return (func_entry, rtn.to_proto())
+
+
+_SNAPSHOT_FORMAT = 2
+
+CacheInfo = namedtuple("CacheInfo", ["hits", "misses", "evictions", "maxsize", "size"])
+
+
+def _default_cache_dir() -> Path:
+    if cache_dir := os.environ.get("SUBFRAME_CACHE_DIR"):
+        return Path(cache_dir)
+    return Path.home() / ".cache" / "subframe"
+
+
+class FunctionRegistry:
+    def __init__(self, cache_size: int = 4096) -> None:
         self._extension_mapping: dict = defaultdict(dict)
+        self._resolution_cache: OrderedDict = OrderedDict()
+        self.cache_size = cache_size
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.cache_evictions = 0
+        self._pending_files: dict[str, list[Path]] = {}
+        self._bundled_files: set[Path] = set()
         self.id_generator = itertools.count(1)
 
         self.uri_aliases = {}
@@ -282,6 +426,7 @@ class FunctionRegistry:
                 f"https://github.com/substrait-io/substrait/blob/main/extensions/{fpath.name}"
             )
             self.register_extension_yaml(fpath)
+            self._bundled_files.add(Path(fpath))
 
     def register_extension_yaml(
         self,
@@ -291,6 +436,9 @@ class FunctionRegistry:
     ) -> None:
         """Add a substrait extension YAML file to the ibis substrait compiler.
 
+        The file is only recorded here, it's parsed the first time a function
+        under its URI is looked up (or when `preload` is called).
+
         Parameters
         ----------
         fname
@@ -304,8 +452,6 @@ class FunctionRegistry:
 
         """
         fname = Path(fname)
-        with open(fname) as f:  # type: ignore
-            extension_definitions = yaml.safe_load(f)
 
         prefix = (
             prefix.strip("/")
@@ -315,35 +461,196 @@ class FunctionRegistry:
 
         uri = uri or f"{prefix}/{fname.name}"
 
-        self.register_extension_dict(extension_definitions, uri)
+        self._pending_files.setdefault(uri, []).append(fname)
+
+    def _load(self, uri: str) -> None:
+        for fname in self._pending_files.pop(uri, []):
+            self._add_functions(uri, self._parse_file(fname, uri))
+
+    def _parse_file(self, fname: Path, uri: str) -> dict[str, list[FunctionEntry]]:
+        import yaml
+
+        with open(fname) as f:  # type: ignore
+            extension_definitions = yaml.safe_load(f)
+
+        return _parse_definitions(extension_definitions, uri)
+
+    def _snapshot_key(self) -> str:
+        from importlib.metadata import version as package_version
+
+        digest = hashlib.sha256(
+            f"{_SNAPSHOT_FORMAT}:{package_version('substrait')}".encode()
+        )
+        for uri, fnames in sorted(self._pending_files.items()):
+            digest.update(uri.encode())
+            for fname in fnames:
+                # bundled files are covered by the substrait version
+                if fname in self._bundled_files:
+                    digest.update(fname.name.encode())
+                else:
+                    digest.update(hashlib.sha256(fname.read_bytes()).digest())
+
+        return digest.hexdigest()
+
+    def use_snapshot(self, cache_dir: Union[str, Path, None] = None) -> Path:
+        """Load all pending extension files from a precompiled snapshot.
+
+        The snapshot is keyed by the installed substrait version and the
+        contents of user registered extension files. If no matching snapshot
+        exists in `cache_dir` the files are parsed and a new one is written.
+        `cache_dir` defaults to `$SUBFRAME_CACHE_DIR` or `~/.cache/subframe`.
+
+        Returns the path of the snapshot file.
+        """
+        cache_dir = Path(cache_dir) if cache_dir else _default_cache_dir()
+        snapshot_path = cache_dir / f"registry-{self._snapshot_key()[:32]}.pickle"
+
+        try:
+            snapshot = pickle.loads(snapshot_path.read_bytes())
+        except (OSError, pickle.UnpicklingError, EOFError):
+            snapshot = None
+
+        if snapshot is None:
+            snapshot = {
+                uri: self._merge_parsed_files(uri, fnames)
+                for uri, fnames in self._pending_files.items()
+            }
+
+            cache_dir.mkdir(parents=True, exist_ok=True)
+            tmp_path = snapshot_path.with_suffix(f".{os.getpid()}.tmp")
+            tmp_path.write_bytes(
+                pickle.dumps(snapshot, protocol=pickle.HIGHEST_PROTOCOL)
+            )
+            os.replace(tmp_path, snapshot_path)
+
+        for uri, functions in snapshot.items():
+            self._pending_files.pop(uri, None)
+            self._add_functions(uri, functions)
+
+        return snapshot_path
+
+    def _merge_parsed_files(
+        self, uri: str, fnames: list[Path]
+    ) -> dict[str, list[FunctionEntry]]:
+        functions: dict[str, list[FunctionEntry]] = {}
+        for fname in fnames:
+            for name, entries in self._parse_file(fname, uri).items():
+                functions.setdefault(name, []).extend(entries)
+
+        return functions
+
+    def preload(self) -> None:
+        """Parse every registered extension file that hasn't been loaded yet."""
+        for uri in list(self._pending_files):
+            self._load(uri)
 
     def register_extension_dict(self, definitions: dict, uri: str) -> None:
-        for named_functions in definitions.values():
-            for function in named_functions:
-                for func in _parse_func(function):
-                    func.uri = uri
-                    if (
-                        func.uri in self._extension_mapping
-                        and function["name"] in self._extension_mapping[func.uri]
-                    ):
-                        self._extension_mapping[func.uri][function["name"]].append(func)
-                    else:
-                        self._extension_mapping[func.uri][function["name"]] = [func]
+        # files registered earlier under the same uri keep precedence
+        self._load(uri)
+        self._add_functions(uri, _parse_definitions(definitions, uri))
+
+    def _add_functions(
+        self, uri: str, functions: dict[str, list[FunctionEntry]]
+    ) -> None:
+        self.clear_cache(uri)
+        for name, entries in functions.items():
+            if name not in self._extension_mapping[uri]:
+                self._extension_mapping[uri][name] = FunctionOverloads()
+            self._extension_mapping[uri][name].extend(entries)
+
+    def cache_info(self) -> CacheInfo:
+        return CacheInfo(
+            self.cache_hits,
+            self.cache_misses,
+            self.cache_evictions,
+            self.cache_size,
+            len(self._resolution_cache),
+        )
+
+    def clear_cache(self, uri: Optional[str] = None) -> None:
+        """Drop cached signature resolutions, either all of them or only `uri`'s."""
+        if uri is None:
+            self._resolution_cache.clear()
+        else:
+            for key in [k for k in self._resolution_cache if k[0] == uri]:
+                del self._resolution_cache[key]
 
     # TODO add an optional return type check
     def lookup_function(
         self, uri: str, function_name: str, signature: tuple
     ) -> Optional[tuple[FunctionEntry, Type]]:
+        return _with_proto_type(
+            self.resolve_function(
+                uri, function_name, tuple(from_proto(t) for t in signature)
+            )
+        )
+
+    def resolve_function(
+        self, uri: str, function_name: str, signature: tuple[DataType, ...]
+    ) -> Optional[tuple[FunctionEntry, DataType]]:
+        """Like `lookup_function`, but with DataTypes in and out."""
         uri = self.uri_aliases.get(uri, uri)
 
+        if uri in self._pending_files:
+            self._load(uri)
+
+        key = (uri, function_name, tuple(signature))
+
+        if key in self._resolution_cache:
+            self.cache_hits += 1
+            self._resolution_cache.move_to_end(key)
+            return self._resolution_cache[key]
+
+        self.cache_misses += 1
+        resolved = self._resolve(uri, function_name, signature)
+
+        self._resolution_cache[key] = resolved
+        if len(self._resolution_cache) > self.cache_size:
+            self._resolution_cache.popitem(last=False)
+            self.cache_evictions += 1
+
+        return resolved
+
+    def lookup_many(
+        self, uri: str, function_name: str, signatures: list[tuple]
+    ) -> list[Optional[tuple[FunctionEntry, Type]]]:
+        """`lookup_function` for many signatures of the same function."""
+        return [
+            _with_proto_type(resolved)
+            for resolved in self.resolve_many(
+                uri,
+                function_name,
+                [tuple(from_proto(t) for t in signature) for signature in signatures],
+            )
+        ]
+
+    def resolve_many(
+        self, uri: str, function_name: str, signatures: list[tuple[DataType, ...]]
+    ) -> list[Optional[tuple[FunctionEntry, DataType]]]:
+        """`resolve_function` for many signatures of the same function.
+
+        Every distinct signature is resolved once and the result shared.
+        """
+        resolved: dict = {}
+        for signature in signatures:
+            signature = tuple(signature)
+            if signature not in resolved:
+                resolved[signature] = self.resolve_function(
+                    uri, function_name, signature
+                )
+
+        return [resolved[tuple(signature)] for signature in signatures]
+
+    def _resolve(
+        self, uri: str, function_name: str, signature: tuple
+    ) -> Optional[tuple[FunctionEntry, Type]]:
         if (
             uri not in self._extension_mapping
             or function_name not in self._extension_mapping[uri]
         ):
             return None
         functions = self._extension_mapping[uri][function_name]
-        for f in functions:
-            assert isinstance(f, FunctionEntry)
+        for f in functions.candidates(signature):
             rtn = f.satisfies_signature(signature)
             if rtn is not None:
                 return (f, rtn)
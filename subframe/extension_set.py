@@ -0,0 +1,113 @@
+from collections.abc import Iterator, Mapping
+from types import MappingProxyType
+
+
+class ExtensionSet(Mapping):
+    """Immutable set of function declarations, `uri -> {signature: anchor}`.
+
+    A union keeps references to its operands instead of merging them, so it
+    takes constant time no matter how many functions they declare and sets
+    derived from the same one share it. The mapping is only worked out on
+    first lookup, each shared operand is visited once. The set of a single
+    function is interned, see `function_extension`.
+    """
+
+    __slots__ = ("_function", "_parts", "_mapping", "_anchors")
+
+    def __init__(self, function: tuple | None = None, parts: tuple = ()) -> None:
+        # (uri, signature, anchor) of a single function, or the sets unioned
+        self._function = function
+        self._parts = parts
+        self._mapping = None
+        self._anchors = None
+
+    def __repr__(self) -> str:
+        functions = {uri: dict(declared) for uri, declared in self.items()}
+        return f"ExtensionSet({functions!r})"
+
+    def __getitem__(self, uri: str) -> Mapping[str, int]:
+        return self._functions()[uri]
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._functions())
+
+    def __len__(self) -> int:
+        return len(self._functions())
+
+    def function(self, anchor: int) -> tuple[str, str] | None:
+        """`(uri, signature)` of the function declared with `anchor`, if any."""
+        if self._anchors is None:
+            self._anchors = {
+                declared_anchor: (uri, signature)
+                for uri, declared in self._functions().items()
+                for signature, declared_anchor in declared.items()
+            }
+        return self._anchors.get(anchor)
+
+    def union(self, *others: "ExtensionSet") -> "ExtensionSet":
+        parts = []
+        seen = set()
+        for extensions in (self, *others):
+            if extensions is not empty_extensions and id(extensions) not in seen:
+                seen.add(id(extensions))
+                parts.append(extensions)
+
+        if not parts:
+            return empty_extensions
+        elif len(parts) == 1:
+            return parts[0]
+        return ExtensionSet(parts=tuple(parts))
+
+    def _functions(self) -> Mapping[str, Mapping[str, int]]:
+        if self._mapping is None:
+            functions = {}
+            seen = set()
+            stack = [self]
+            while stack:
+                extensions = stack.pop()
+                if id(extensions) in seen:
+                    continue
+                seen.add(id(extensions))
+
+                if extensions._function is not None:
+                    (uri, signature, anchor) = extensions._function
+                    functions.setdefault(uri, {}).setdefault(signature, anchor)
+                elif extensions._mapping is not None and extensions is not self:
+                    for uri, declared in extensions._mapping.items():
+                        for signature, anchor in declared.items():
+                            functions.setdefault(uri, {}).setdefault(signature, anchor)
+                else:
+                    stack.extend(reversed(extensions._parts))
+
+            self._mapping = MappingProxyType(
+                {uri: MappingProxyType(declared) for uri, declared in functions.items()}
+            )
+        return self._mapping
+
+
+empty_extensions = ExtensionSet()
+
+_interned: dict[tuple, ExtensionSet] = {}
+
+
+def function_extension(uri: str, signature: str, anchor: int) -> ExtensionSet:
+    """The set declaring a single function, the same object for the same function."""
+    key = (uri, signature, anchor)
+    extensions = _interned.get(key)
+    if extensions is None:
+        extensions = _interned.setdefault(key, ExtensionSet(function=key))
+    return extensions
+
+
+def extension_set(extensions: Mapping[str, Mapping[str, int]]) -> ExtensionSet:
+    """`extensions` as an ExtensionSet, e.g. from a `{uri: {signature: anchor}}` dict."""
+    if isinstance(extensions, ExtensionSet):
+        return extensions
+
+    return empty_extensions.union(
+        *[
+            function_extension(uri, signature, anchor)
+            for uri, declared in extensions.items()
+            for signature, anchor in declared.items()
+        ]
+    )
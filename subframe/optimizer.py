@@ -0,0 +1,1337 @@
+from collections.abc import Mapping
+from typing import Callable, Iterator, Optional
+from substrait.gen.proto import algebra_pb2 as stalg
+from google.protobuf.descriptor import FieldDescriptor
+from .rel_node import RelNode
+from .data_type import data_type, from_proto
+from .extension_set import extension_set, function_extension
+from .utils import fold_function, nested_expressions
+from .value import scalar_function_digest, expression_digest
+
+Rule = Callable[[RelNode, "Context"], Optional[RelNode]]
+
+
+def rel_type(node: Optional[RelNode]) -> Optional[str]:
+    return node.message.WhichOneof("rel_type") if node is not None else None
+
+
+def single_input(node: RelNode) -> Optional[RelNode]:
+    return node.inputs[0][1] if len(node.inputs) == 1 else None
+
+
+def body(node: RelNode):
+    return getattr(node.message, rel_type(node))
+
+
+def field(index: int) -> stalg.Expression:
+    return stalg.Expression(
+        selection=stalg.Expression.FieldReference(
+            root_reference=stalg.Expression.FieldReference.RootReference(),
+            direct_reference=stalg.Expression.ReferenceSegment(
+                struct_field=stalg.Expression.ReferenceSegment.StructField(
+                    field=index,
+                ),
+            ),
+        )
+    )
+
+
+def field_index(expression: stalg.Expression) -> Optional[int]:
+    """The position of a plain reference to an input column, None otherwise."""
+    if expression.WhichOneof("rex_type") != "selection":
+        return None
+
+    selection = expression.selection
+    if (
+        selection.WhichOneof("root_type") != "root_reference"
+        or selection.WhichOneof("reference_type") != "direct_reference"
+        or selection.direct_reference.WhichOneof("reference_type") != "struct_field"
+        or selection.direct_reference.struct_field.HasField("child")
+    ):
+        return None
+
+    return selection.direct_reference.struct_field.field
+
+
+def nested_messages(message) -> list:
+    """The messages directly inside `message`."""
+    nested = []
+    for descriptor, value in message.ListFields():
+        if descriptor.type != FieldDescriptor.TYPE_MESSAGE:
+            continue
+        elif descriptor.label == FieldDescriptor.LABEL_REPEATED:
+            nested.extend(value)
+        else:
+            nested.append(value)
+    return nested
+
+
+def walk(message) -> Iterator[stalg.Expression]:
+    """All the expressions in `message`, including itself if it's one.
+
+    Subqueries' relations aren't entered, their field references point to
+    their own input.
+    """
+    stack = [message]
+    while stack:
+        message = stack.pop()
+        if isinstance(message, stalg.Expression):
+            yield message
+            stack.extend(nested_expressions(message))
+        else:
+            stack.extend(nested_messages(message))
+
+
+def referenced_fields(expression: stalg.Expression) -> set[int]:
+    return {i for e in walk(expression) if (i := field_index(e)) is not None}
+
+
+def replace_fields(
+    expression: stalg.Expression, replace: Callable[[int], stalg.Expression]
+) -> stalg.Expression:
+    """A copy of `expression` with every column reference `i` replaced by `replace(i)`."""
+    if (index := field_index(expression)) is not None:
+        return replace(index)
+
+    result = stalg.Expression()
+    result.CopyFrom(expression)
+
+    stack = [result]
+    while stack:
+        message = stack.pop()
+        if (index := field_index(message)) is not None:
+            message.CopyFrom(replace(index))
+        else:
+            stack.extend(nested_expressions(message))
+
+    return result
+
+
+def is_trivial(expression: stalg.Expression) -> bool:
+    return expression.WhichOneof("rex_type") in ("selection", "literal")
+
+
+def has_plain_common(message, emit: bool = False) -> bool:
+    """No hints, extensions or (unless allowed) output mapping that a rewrite could lose."""
+    common = message.common
+    return (
+        (emit or common.WhichOneof("emit_kind") != "emit")
+        and not common.HasField("hint")
+        and not common.HasField("advanced_extension")
+        and not message.HasField("advanced_extension")
+    )
+
+
+def apply_emit(columns: list, common: stalg.RelCommon) -> list:
+    if common.WhichOneof("emit_kind") == "emit":
+        return [columns[i] for i in common.emit.output_mapping]
+    return columns
+
+
+def project_node(
+    expressions: list[stalg.Expression], input_width: int, inputs
+) -> RelNode:
+    """A ProjectRel that only outputs `expressions`, like `Table.select` builds."""
+    return RelNode(
+        stalg.Rel(
+            project=stalg.ProjectRel(
+                common=stalg.RelCommon(
+                    emit=stalg.RelCommon.Emit(
+                        output_mapping=range(
+                            input_width, input_width + len(expressions)
+                        )
+                    )
+                ),
+                expressions=expressions,
+            )
+        ),
+        inputs=inputs,
+    )
+
+
+class Context:
+    """What rules need to know about the plan beyond a single node."""
+
+    def __init__(
+        self,
+        read_projection: bool = True,
+        extensions: Optional[Mapping[str, Mapping[str, int]]] = None,
+    ) -> None:
+        # whether reads can select columns, otherwise they're selected by a
+        # projection on top (Acero doesn't support ReadRel.projection)
+        self.read_projection = read_projection
+        # functions declared by rules
+        self.extensions: dict[str, dict[str, int]] = {}
+        # every function the plan can reference, to hash calls with
+        self.declared = extension_set(extensions or {})
+        # anchor -> (uri, name) of every function the plan can reference
+        self.functions: dict[int, tuple[str, str]] = {
+            anchor: (uri, signature.split(":")[0])
+            for (uri, functions) in (extensions or {}).items()
+            for (signature, anchor) in functions.items()
+        }
+        self._widths: dict[int, Optional[int]] = {}
+        self._inputs: dict[int, list[RelNode]] = {}
+        self._nodes: list[RelNode] = []
+
+    def resolve_function(self, uri: str, name: str, signature: tuple) -> tuple:
+        from subframe import registry
+
+        return registry.resolve_function(uri, function_name=name, signature=signature)
+
+    def use_function(self, uri: str, name: str, signature: tuple) -> tuple:
+        """Resolve a function a rule adds to the plan and declare it."""
+        (func_entry, output_type) = self.resolve_function(uri, name, signature)
+        self.extensions.setdefault(func_entry.uri, {})[
+            str(func_entry)
+        ] = func_entry.anchor
+        self.functions[func_entry.anchor] = (func_entry.uri, func_entry.name)
+        self.declared = self.declared.union(
+            function_extension(func_entry.uri, str(func_entry), func_entry.anchor)
+        )
+        return (func_entry, output_type)
+
+    def width(self, node: RelNode) -> Optional[int]:
+        """Number of output columns of `node`, None if it can't be told."""
+        stack = [node]
+        while stack:
+            current = stack[-1]
+            if id(current) in self._widths:
+                stack.pop()
+                continue
+
+            if id(current) not in self._inputs:
+                # cached by id, the nodes are kept alive so ids stay unique
+                self._nodes.append(current)
+                self._inputs[id(current)] = _children(current)
+            children = self._inputs[id(current)]
+
+            pending = [c for c in children if id(c) not in self._widths]
+            if pending:
+                stack.extend(pending)
+                continue
+
+            stack.pop()
+            self._widths[id(current)] = self._width(
+                current, [self._widths[id(c)] for c in children]
+            )
+
+        return self._widths[id(node)]
+
+    def _width(self, node: RelNode, widths: list[Optional[int]]) -> Optional[int]:
+        kind = rel_type(node)
+        message = body(node)
+
+        if kind == "reference":
+            # a view, its only input is the subtree
+            return widths[0] if widths else None
+        elif message.common.WhichOneof("emit_kind") == "emit":
+            return len(message.common.emit.output_mapping)
+        elif None in widths:
+            return None
+        elif kind == "read":
+            if message.HasField("projection"):
+                return len(message.projection.select.struct_items)
+            return len(message.base_schema.struct.types)
+        elif kind in ("filter", "fetch", "sort"):
+            return widths[0]
+        elif kind == "project":
+            return widths[0] + len(message.expressions)
+        elif kind == "aggregate":
+            keys = {
+                e.SerializeToString(deterministic=True)
+                for g in message.groupings
+                for e in g.grouping_expressions
+            }
+            return len(keys) + len(message.measures)
+        elif kind == "cross":
+            return sum(widths)
+        elif kind == "join":
+            if message.type in (
+                stalg.JoinRel.JoinType.JOIN_TYPE_INNER,
+                stalg.JoinRel.JoinType.JOIN_TYPE_LEFT,
+                stalg.JoinRel.JoinType.JOIN_TYPE_RIGHT,
+                stalg.JoinRel.JoinType.JOIN_TYPE_OUTER,
+            ):
+                return sum(widths)
+            return None
+        elif kind == "set":
+            return widths[0]
+        else:
+            return None
+
+
+def _children(node: RelNode) -> list[RelNode]:
+    if node.inputs:
+        return [c for (_, c) in node.inputs]
+
+    # a Rel that was passed to Table whole, its inputs are embedded
+    message = body(node)
+    children = []
+    for f in ("input", "left", "right", "inputs"):
+        if f not in message.DESCRIPTOR.fields_by_name:
+            continue
+        elif f == "inputs":
+            children.extend(RelNode(r) for r in message.inputs)
+        elif message.HasField(f):
+            children.append(RelNode(getattr(message, f)))
+    return children
+
+
+def fuse_projections(node: RelNode, context: Context) -> Optional[RelNode]:
+    """project(project(x)) -> project(x)
+
+    Columns computed by the inner projection are inlined into the outer one,
+    unless that would evaluate a non-trivial expression more than once.
+    """
+    child = single_input(node)
+    if rel_type(node) != "project" or rel_type(child) != "project":
+        return None
+
+    (outer, inner) = (body(node), body(child))
+    if not (
+        has_plain_common(outer, emit=True)
+        and has_plain_common(inner, emit=True)
+        and single_input(child)
+    ):
+        return None
+
+    input_width = context.width(child.inputs[0][1])
+    if input_width is None:
+        return None
+
+    inner_columns = apply_emit(
+        [field(i) for i in range(input_width)] + list(inner.expressions),
+        inner.common,
+    )
+    outer_columns = apply_emit(
+        [field(i) for i in range(len(inner_columns))] + list(outer.expressions),
+        outer.common,
+    )
+
+    uses = [0] * len(inner_columns)
+    for column in outer_columns:
+        for e in walk(column):
+            if (index := field_index(e)) is not None:
+                uses[index] += 1
+    if any(n > 1 and not is_trivial(c) for n, c in zip(uses, inner_columns)):
+        return None
+
+    return project_node(
+        [replace_fields(c, lambda i: inner_columns[i]) for c in outer_columns],
+        input_width,
+        child.inputs,
+    )
+
+
+def _calls(expression: stalg.Expression, context: "Context") -> list[tuple]:
+    """`(call, digest, parent)` for the scalar function calls in `expression`.
+
+    Calls come before the ones nested in them and `parent` is the index of
+    the enclosing call. The digests are the ones `expression_digest` gives.
+    """
+    entries = []
+    stack = [(expression, None, None)]
+    while stack:
+        (e, parent, position) = stack.pop()
+        function = e.scalar_function
+        if (
+            e.WhichOneof("rex_type") != "scalar_function"
+            or function.options
+            or any(a.WhichOneof("arg_type") != "value" for a in function.arguments)
+        ):
+            continue
+        entries.append((e, parent, position))
+        stack.extend(
+            (a.value, len(entries) - 1, j) for j, a in enumerate(function.arguments)
+        )
+
+    # digests of the arguments of each call, nested calls fill in their own
+    arguments = [[None] * len(e.scalar_function.arguments) for (e, _, _) in entries]
+    digests = [None] * len(entries)
+    for i in reversed(range(len(entries))):
+        (e, parent, position) = entries[i]
+        function = e.scalar_function
+        digests[i] = scalar_function_digest(
+            function,
+            [
+                d if d is not None else expression_digest(a.value, context.declared)
+                for d, a in zip(arguments[i], function.arguments)
+            ],
+            context.declared,
+        )
+        if parent is not None:
+            arguments[parent][position] = digests[i]
+
+    return [(e, d, parent) for ((e, parent, _), d) in zip(entries, digests)]
+
+
+def _hoist(
+    calls: list[list[tuple]], hoisted: set[str], input_width: int
+) -> list[stalg.Expression]:
+    """Replace the outermost calls with a digest in `hoisted` by column references.
+
+    The expressions the calls were found in are modified in place. Returns
+    one copy of each replaced call, the first becomes column `input_width`,
+    the next `input_width + 1` and so on.
+    """
+    columns: dict[str, int] = {}
+    expressions = []
+    for entries in calls:
+        replaced = [False] * len(entries)
+        for i, (e, d, parent) in enumerate(entries):
+            if parent is not None and replaced[parent]:
+                replaced[i] = True
+                continue
+            if d not in hoisted:
+                continue
+
+            if d not in columns:
+                columns[d] = input_width + len(expressions)
+                expression = stalg.Expression()
+                expression.CopyFrom(e)
+                expressions.append(expression)
+            replaced[i] = True
+            e.CopyFrom(field(columns[d]))
+
+    return expressions
+
+
+def _copies(expressions) -> list[stalg.Expression]:
+    copies = []
+    for e in expressions:
+        copy = stalg.Expression()
+        copy.CopyFrom(e)
+        copies.append(copy)
+    return copies
+
+
+def _project_over(
+    project: stalg.ProjectRel,
+    expressions: list[stalg.Expression],
+    input_width: int,
+    added: int,
+    inputs,
+) -> RelNode:
+    # `project` with new expressions, over an input with `added` more columns
+    mapping = (
+        project.common.emit.output_mapping
+        if project.common.WhichOneof("emit_kind") == "emit"
+        else range(input_width + len(project.expressions))
+    )
+    return RelNode(
+        stalg.Rel(
+            project=stalg.ProjectRel(
+                common=stalg.RelCommon(
+                    emit=stalg.RelCommon.Emit(
+                        output_mapping=[
+                            i if i < input_width else i + added for i in mapping
+                        ]
+                    )
+                ),
+                expressions=expressions,
+            )
+        ),
+        inputs=inputs,
+    )
+
+
+def eliminate_common_subexpressions(
+    node: RelNode, context: Context
+) -> Optional[RelNode]:
+    """project(x, [f(g(a)), h(g(a))]) -> project(project(x, [g(a)]), [f(#), h(#)])
+
+    Calls that appear more than once in a projection are computed once by a
+    projection below it.
+    """
+    child = single_input(node)
+    if (
+        rel_type(node) != "project"
+        or child is None
+        or not has_plain_common(body(node), emit=True)
+        or _has_window_function(body(node).expressions)
+    ):
+        return None
+
+    input_width = context.width(child)
+    if input_width is None:
+        return None
+
+    expressions = _copies(body(node).expressions)
+    calls = [_calls(e, context) for e in expressions]
+    counts: dict[str, int] = {}
+    for entries in calls:
+        for _, d, _ in entries:
+            counts[d] = counts.get(d, 0) + 1
+
+    hoisted = {d for (d, n) in counts.items() if n > 1}
+    if not hoisted:
+        return None
+
+    columns = _hoist(calls, hoisted, input_width)
+    inner = project_node(
+        [field(i) for i in range(input_width)] + columns, input_width, node.inputs
+    )
+
+    return _project_over(
+        body(node), expressions, input_width, len(columns), [("input", inner)]
+    )
+
+
+def eliminate_common_subexpressions_with_filter(
+    node: RelNode, context: Context
+) -> Optional[RelNode]:
+    """project(filter(x, p(g(a))), [f(g(a))]) -> project(filter(project(x, [g(a)]), p(#)), [f(#)])
+
+    Calls that appear in both the condition and the projection are computed
+    once, before the filter.
+    """
+    child = single_input(node)
+    if (
+        rel_type(node) != "project"
+        or rel_type(child) != "filter"
+        or single_input(child) is None
+        or not has_plain_common(body(node), emit=True)
+        or not has_plain_common(body(child))
+        or _has_window_function(body(node).expressions)
+    ):
+        return None
+
+    input_width = context.width(single_input(child))
+    if input_width is None:
+        return None
+
+    expressions = _copies(body(node).expressions)
+    calls = [_calls(e, context) for e in expressions]
+    if not any(calls):
+        return None
+
+    [condition] = _copies([body(child).condition])
+    calls.insert(0, _calls(condition, context))
+    hoisted = {d for (_, d, _) in calls[0]} & {
+        d for entries in calls[1:] for (_, d, _) in entries
+    }
+    if not hoisted:
+        return None
+
+    columns = _hoist(calls, hoisted, input_width)
+    inner = project_node(
+        [field(i) for i in range(input_width)] + columns, input_width, child.inputs
+    )
+    filtered = RelNode(
+        stalg.Rel(filter=stalg.FilterRel(condition=condition)),
+        inputs=[("input", inner)],
+    )
+
+    return _project_over(
+        body(node), expressions, input_width, len(columns), [("input", filtered)]
+    )
+
+
+def _literal_call(expression: stalg.Expression) -> bool:
+    return expression.WhichOneof("rex_type") == "scalar_function" and all(
+        a.WhichOneof("arg_type") == "value"
+        and a.value.WhichOneof("rex_type") == "literal"
+        for a in expression.scalar_function.arguments
+    )
+
+
+def _nested_calls(expression: stalg.Expression) -> list[stalg.Expression]:
+    """`expression` if it's a call and the calls nested in it through call arguments.
+
+    Calls come before the ones nested in them.
+    """
+    calls = []
+    stack = [expression]
+    while stack:
+        e = stack.pop()
+        if e.WhichOneof("rex_type") == "scalar_function":
+            calls.append(e)
+            stack.extend(
+                a.value
+                for a in e.scalar_function.arguments
+                if a.WhichOneof("arg_type") == "value"
+            )
+    return calls
+
+
+def fold_constants(
+    expression: stalg.Expression, context: Context
+) -> Optional[stalg.Expression]:
+    """A copy of `expression` with the calls on literals evaluated.
+
+    Only calls nested directly in other calls are looked at. Returns None if
+    there's nothing to evaluate.
+    """
+    if not any(_literal_call(e) for e in _nested_calls(expression)):
+        return None
+
+    result = stalg.Expression()
+    result.CopyFrom(expression)
+
+    folded = False
+    # nested calls come after the ones around them, evaluate them first
+    for e in reversed(_nested_calls(result)):
+        if not _literal_call(e) or e.scalar_function.options:
+            continue
+        function = e.scalar_function
+        if (names := context.functions.get(function.function_reference)) is None:
+            continue
+
+        literal = fold_function(
+            *names,
+            from_proto(function.output_type),
+            [a.value for a in function.arguments],
+        )
+        if literal is not None:
+            e.literal.CopyFrom(literal)
+            folded = True
+
+    return result if folded else None
+
+
+def _boolean_literal(expression: stalg.Expression) -> Optional[bool]:
+    if (
+        expression.WhichOneof("rex_type") == "literal"
+        and expression.literal.WhichOneof("literal_type") == "boolean"
+    ):
+        return expression.literal.boolean
+    return None
+
+
+def fold_filter(node: RelNode, context: Context) -> Optional[RelNode]:
+    """Evaluate the calls on literals in a filter's condition.
+
+    Terms that are always true are dropped along with the filter if none
+    are left, a term that's always false replaces the whole condition.
+    """
+    if rel_type(node) != "filter" or not has_plain_common(body(node)):
+        return None
+
+    condition = fold_constants(body(node).condition, context)
+    terms = split_conjunction(context, condition or body(node).condition)
+    kept = [t for t in terms if _boolean_literal(t) is not True]
+
+    if not kept:
+        return single_input(node)
+    elif false := [t for t in kept if _boolean_literal(t) is False]:
+        kept = false[:1]
+
+    if condition is None and len(kept) == len(terms):
+        return None
+
+    return filter_node(context, kept, node.inputs)
+
+
+def fold_project(node: RelNode, context: Context) -> Optional[RelNode]:
+    """Evaluate the calls on literals in a projection's expressions."""
+    if rel_type(node) != "project":
+        return None
+
+    expressions = [fold_constants(e, context) for e in body(node).expressions]
+    if all(e is None for e in expressions):
+        return None
+
+    rel = stalg.Rel()
+    rel.CopyFrom(node.message)
+    for target, e in zip(rel.project.expressions, expressions):
+        if e is not None:
+            target.CopyFrom(e)
+
+    return RelNode(rel, node.inputs)
+
+
+def merge_filters(node: RelNode, context: Context) -> Optional[RelNode]:
+    """filter(filter(x, a), b) -> filter(x, and(a, b))"""
+    child = single_input(node)
+    if rel_type(node) != "filter" or rel_type(child) != "filter":
+        return None
+
+    (outer, inner) = (body(node), body(child))
+    if not (has_plain_common(outer) and has_plain_common(inner)):
+        return None
+
+    condition = conjunction(context, [inner.condition, outer.condition])
+
+    return RelNode(
+        stalg.Rel(filter=stalg.FilterRel(condition=condition)), inputs=child.inputs
+    )
+
+
+_boolean = data_type("bool", nullability=1)
+
+
+def conjunction(
+    context: Context, conditions: list[stalg.Expression]
+) -> stalg.Expression:
+    """`and` of the conditions as a balanced tree of binary calls.
+
+    Some consumers only take two arguments, a balanced tree keeps the nesting
+    shallow. Conjunctions among the conditions are split up first.
+    """
+    (func_entry, output_type) = context.resolve_function(
+        "functions_boolean.yaml", "and", (_boolean, _boolean)
+    )
+    terms = [t for c in conditions for t in conjuncts(c, func_entry.anchor)]
+    if len(terms) > 1:
+        context.use_function("functions_boolean.yaml", "and", (_boolean, _boolean))
+
+    def build(terms):
+        if len(terms) == 1:
+            return terms[0]
+
+        middle = len(terms) // 2
+        return stalg.Expression(
+            scalar_function=stalg.Expression.ScalarFunction(
+                function_reference=func_entry.anchor,
+                output_type=output_type.to_proto(),
+                arguments=[
+                    stalg.FunctionArgument(value=build(terms[:middle])),
+                    stalg.FunctionArgument(value=build(terms[middle:])),
+                ],
+            )
+        )
+
+    return build(terms)
+
+
+def conjuncts(condition: stalg.Expression, anchor: int) -> list[stalg.Expression]:
+    """The terms of a conjunction of `and` calls with the given anchor."""
+    terms = []
+    stack = [condition]
+    while stack:
+        expression = stack.pop()
+        function = expression.scalar_function
+        if (
+            expression.WhichOneof("rex_type") == "scalar_function"
+            and function.function_reference == anchor
+        ):
+            stack.extend(reversed([a.value for a in function.arguments]))
+        else:
+            terms.append(expression)
+    return terms
+
+
+def split_conjunction(
+    context: Context, condition: stalg.Expression
+) -> list[stalg.Expression]:
+    (func_entry, _) = context.resolve_function(
+        "functions_boolean.yaml", "and", (_boolean, _boolean)
+    )
+    return conjuncts(condition, func_entry.anchor)
+
+
+def filter_node(
+    context: Context, conditions: list[stalg.Expression], inputs
+) -> RelNode:
+    return RelNode(
+        stalg.Rel(filter=stalg.FilterRel(condition=conjunction(context, conditions))),
+        inputs=inputs,
+    )
+
+
+def _filter_above(
+    node: RelNode, context: Context, *kinds: str
+) -> Optional[tuple[list[stalg.Expression], RelNode]]:
+    # the terms of a plain filter's condition and its input, if it's of one
+    # of the kinds
+    child = single_input(node)
+    if (
+        rel_type(node) != "filter"
+        or rel_type(child) not in kinds
+        or not has_plain_common(body(node))
+    ):
+        return None
+    return (split_conjunction(context, body(node).condition), child)
+
+
+def _has_window_function(expressions) -> bool:
+    return any(
+        e.WhichOneof("rex_type") == "window_function"
+        for expression in expressions
+        for e in walk(expression)
+    )
+
+
+def push_filter_through_project(node: RelNode, context: Context) -> Optional[RelNode]:
+    """filter(project(x)) -> project(filter(x))
+
+    Only the terms that use columns the projection passes through or sets to
+    a literal are moved, computed columns aren't evaluated twice.
+    """
+    if (found := _filter_above(node, context, "project")) is None:
+        return None
+    (terms, child) = found
+
+    if (
+        single_input(child) is None
+        or not has_plain_common(body(child), emit=True)
+        or _has_window_function(body(child).expressions)
+    ):
+        return None
+
+    input_width = context.width(single_input(child))
+    if input_width is None:
+        return None
+
+    columns = apply_emit(
+        [field(i) for i in range(input_width)] + list(body(child).expressions),
+        body(child).common,
+    )
+
+    (pushed, kept) = ([], [])
+    for term in terms:
+        if all(is_trivial(columns[i]) for i in referenced_fields(term)):
+            pushed.append(replace_fields(term, lambda i: columns[i]))
+        else:
+            kept.append(term)
+    if not pushed:
+        return None
+
+    project = RelNode(
+        child.message, [("input", filter_node(context, pushed, child.inputs))]
+    )
+    return filter_node(context, kept, [("input", project)]) if kept else project
+
+
+# join type -> whether filters can be moved into its left and right input
+_filterable_sides = {
+    stalg.JoinRel.JoinType.JOIN_TYPE_INNER: (True, True),
+    stalg.JoinRel.JoinType.JOIN_TYPE_LEFT: (True, False),
+    stalg.JoinRel.JoinType.JOIN_TYPE_RIGHT: (False, True),
+}
+
+
+def push_filter_into_join(node: RelNode, context: Context) -> Optional[RelNode]:
+    """filter(join(x, y)) -> join(filter(x), filter(y))
+
+    Terms that only use one side's columns are moved to that side, unless
+    the join could add nulls to it.
+    """
+    if (found := _filter_above(node, context, "join", "cross")) is None:
+        return None
+    (terms, child) = found
+
+    if not has_plain_common(body(child)):
+        return None
+
+    (to_left, to_right) = (
+        _filterable_sides.get(body(child).type, (False, False))
+        if rel_type(child) == "join"
+        else (True, True)
+    )
+
+    left_width = context.width(child.inputs[0][1])
+    if left_width is None:
+        return None
+
+    (left, right, kept) = ([], [], [])
+    for term in terms:
+        fields = referenced_fields(term)
+        if to_left and all(i < left_width for i in fields):
+            left.append(term)
+        elif to_right and all(i >= left_width for i in fields):
+            right.append(replace_fields(term, lambda i: field(i - left_width)))
+        else:
+            kept.append(term)
+    if not (left or right):
+        return None
+
+    inputs = [
+        (f, filter_node(context, pushed, [("input", c)]) if pushed else c)
+        for ((f, c), pushed) in zip(child.inputs, (left, right))
+    ]
+    join = RelNode(child.message, inputs)
+    return filter_node(context, kept, [("input", join)]) if kept else join
+
+
+def push_filter_into_set(node: RelNode, context: Context) -> Optional[RelNode]:
+    """filter(union(x, y)) -> union(filter(x), filter(y)), same for other set ops."""
+    if (found := _filter_above(node, context, "set")) is None:
+        return None
+    (terms, child) = found
+
+    if not has_plain_common(body(child)):
+        return None
+
+    return RelNode(
+        child.message,
+        [(f, filter_node(context, terms, [("input", c)])) for (f, c) in child.inputs],
+    )
+
+
+def push_filter_through_sort(node: RelNode, context: Context) -> Optional[RelNode]:
+    """filter(sort(x)) -> sort(filter(x))"""
+    if (found := _filter_above(node, context, "sort")) is None:
+        return None
+    (terms, child) = found
+
+    if not has_plain_common(body(child)):
+        return None
+
+    return RelNode(
+        child.message, [("input", filter_node(context, terms, child.inputs))]
+    )
+
+
+def push_filter_into_read(node: RelNode, context: Context) -> Optional[RelNode]:
+    """Copy a filter's condition into `ReadRel.best_effort_filter`.
+
+    The filter stays, the scan may use the condition to skip data early.
+    """
+    if (found := _filter_above(node, context, "read")) is None:
+        return None
+    (terms, child) = found
+
+    read = body(child)
+    if read.HasField("projection"):
+        return None
+
+    existing = (
+        split_conjunction(context, read.best_effort_filter)
+        if read.HasField("best_effort_filter")
+        else []
+    )
+    known = {t.SerializeToString(deterministic=True) for t in existing}
+    missing = [t for t in terms if t.SerializeToString(deterministic=True) not in known]
+    if not missing:
+        return None
+
+    rel = stalg.Rel()
+    rel.CopyFrom(child.message)
+    rel.read.best_effort_filter.CopyFrom(conjunction(context, existing + missing))
+
+    return RelNode(node.message, [("input", RelNode(rel))])
+
+
+def push_limit_through_project(node: RelNode, context: Context) -> Optional[RelNode]:
+    """fetch(project(x)) -> project(fetch(x)) when the projection is row by row."""
+    child = single_input(node)
+    if rel_type(node) != "fetch" or rel_type(child) != "project":
+        return None
+
+    if not (has_plain_common(body(node)) and single_input(child)):
+        return None
+    if _has_window_function(body(child).expressions):
+        return None
+
+    return RelNode(
+        child.message, inputs=[("input", RelNode(node.message, child.inputs))]
+    )
+
+
+def push_limit_into_union_all(node: RelNode, context: Context) -> Optional[RelNode]:
+    """fetch(union_all(x, y)) -> fetch(union_all(fetch(x), fetch(y)))
+
+    Each input only needs to produce offset + count rows.
+    """
+    child = single_input(node)
+    if rel_type(node) != "fetch" or rel_type(child) != "set":
+        return None
+
+    fetch = body(node)
+    if (
+        not has_plain_common(fetch)
+        or fetch.count < 0
+        or body(child).op != stalg.SetRel.SetOp.SET_OP_UNION_ALL
+    ):
+        return None
+
+    needed = fetch.offset + fetch.count
+    inputs = [
+        (
+            (f, c)
+            if _limited(c, needed)
+            else (
+                f,
+                RelNode(stalg.Rel(fetch=stalg.FetchRel(count=needed)), [("input", c)]),
+            )
+        )
+        for (f, c) in child.inputs
+    ]
+    if all(new is old for ((_, new), (_, old)) in zip(inputs, child.inputs)):
+        return None
+
+    return RelNode(node.message, inputs=[("input", RelNode(child.message, inputs))])
+
+
+def _limited(node: RelNode, count: int) -> bool:
+    # whether the node already produces at most `count` rows
+    while rel_type(node) == "project" and single_input(node):
+        node = single_input(node)
+
+    if rel_type(node) != "fetch":
+        return False
+    fetch = body(node)
+    return fetch.offset == 0 and 0 <= fetch.count <= count
+
+
+default_rules: list[Rule] = [
+    fold_filter,
+    fold_project,
+    fuse_projections,
+    merge_filters,
+    push_filter_through_project,
+    push_filter_into_join,
+    push_filter_into_set,
+    push_filter_through_sort,
+    push_filter_into_read,
+    eliminate_common_subexpressions_with_filter,
+    eliminate_common_subexpressions,
+    push_limit_through_project,
+    push_limit_into_union_all,
+]
+
+
+def rewrite(root: RelNode, rules: list[Rule], context: Context) -> RelNode:
+    """Apply the rules bottom up until none of them changes the plan.
+
+    Shared nodes are rewritten once, so the result is still a DAG.
+    """
+    # both are keyed by id, the nodes are kept alive so ids stay unique
+    done: dict[int, RelNode] = {}
+    rewrites: dict[int, RelNode] = {}
+    seen = []
+    stack = [root]
+
+    while stack:
+        node = stack[-1]
+        if id(node) in done:
+            stack.pop()
+            continue
+        elif id(node) in rewrites:
+            # the rewritten plan has been optimized by now
+            stack.pop()
+            done[id(node)] = done[id(rewrites[id(node)])]
+            continue
+
+        pending = [c for (_, c) in node.inputs if id(c) not in done]
+        if pending:
+            stack.extend(pending)
+            continue
+
+        inputs = [(f, done[id(c)]) for (f, c) in node.inputs]
+        if any(new is not old for ((_, new), (_, old)) in zip(inputs, node.inputs)):
+            current = RelNode(node.message, inputs)
+        else:
+            current = node
+
+        for rule in rules:
+            rewritten = rule(current, context)
+            if rewritten is not None:
+                break
+        else:
+            rewritten = None
+
+        seen.append(node)
+        if rewritten is None:
+            stack.pop()
+            seen.append(current)
+            done[id(node)] = done[id(current)] = current
+        else:
+            # the rewritten nodes may allow more rules to apply
+            rewrites[id(node)] = rewritten
+            stack.append(rewritten)
+
+    return done[id(root)]
+
+
+def prune_columns(root: RelNode, context: Context) -> RelNode:
+    """Drop the columns nothing above a node uses.
+
+    Works out the columns each node has to produce from projections, filter
+    and join conditions, sort keys and aggregates, top down. Then each node
+    is rebuilt, bottom up, to only produce those. Reads select their columns
+    through `ReadRel.projection` and field references are renumbered.
+    """
+    # both are keyed by id, all the nodes are reachable from root
+    parents: dict[int, int] = {id(root): 0}
+    nodes = [root]
+    for node in nodes:
+        for _, child in node.inputs:
+            if id(child) not in parents:
+                parents[id(child)] = 0
+                nodes.append(child)
+            parents[id(child)] += 1
+
+    # None means all the columns
+    required: dict[int, Optional[set[int]]] = {id(root): None}
+    ready = [root]
+    order = []
+    while ready:
+        node = ready.pop()
+        order.append(node)
+        needed = _required_inputs(node, required[id(node)], context)
+
+        for (_, child), columns in zip(node.inputs, needed):
+            if id(child) not in required:
+                required[id(child)] = columns
+            elif required[id(child)] is not None:
+                required[id(child)] = (
+                    None if columns is None else required[id(child)] | columns
+                )
+
+            parents[id(child)] -= 1
+            if parents[id(child)] == 0:
+                ready.append(child)
+
+    pruned: dict[int, tuple[RelNode, Optional[dict[int, int]]]] = {}
+    for node in reversed(order):
+        pruned[id(node)] = _prune(
+            node,
+            required[id(node)],
+            [pruned[id(child)] for (_, child) in node.inputs],
+            context,
+        )
+
+    return pruned[id(root)][0]
+
+
+def _required_inputs(
+    node: RelNode, required: Optional[set[int]], context: Context
+) -> list[Optional[set[int]]]:
+    # the columns each input has to produce when `required` are used
+    kind = rel_type(node)
+    message = body(node)
+
+    if not node.inputs:
+        return []
+    elif kind == "reference" or (
+        message.common.WhichOneof("emit_kind") == "emit" and kind != "project"
+    ):
+        return [None] * len(node.inputs)
+    elif kind in ("filter", "fetch", "sort"):
+        if required is None:
+            return [None]
+        return [required | referenced_fields(message)]
+    elif kind == "project":
+        input_width = context.width(node.inputs[0][1])
+        if input_width is None:
+            return [None]
+
+        entries = _project_entries(message, input_width)
+        if required is not None:
+            entries = [entries[o] for o in required]
+
+        columns = set()
+        for e in entries:
+            if e < input_width:
+                columns.add(e)
+            else:
+                columns |= referenced_fields(message.expressions[e - input_width])
+        return [columns]
+    elif kind == "aggregate":
+        return [referenced_fields(message)]
+    elif kind in ("join", "cross"):
+        widths = [context.width(c) for (_, c) in node.inputs]
+        if None in widths:
+            return [None, None]
+
+        columns = set(range(sum(widths))) if required is None else set(required)
+        columns |= referenced_fields(message)
+        return [
+            {i for i in columns if i < widths[0]},
+            {i - widths[0] for i in columns if i >= widths[0]},
+        ]
+    elif kind == "set" and message.op == stalg.SetRel.SetOp.SET_OP_UNION_ALL:
+        return [required] * len(node.inputs)
+    else:
+        return [None] * len(node.inputs)
+
+
+def _prune(
+    node: RelNode,
+    required: Optional[set[int]],
+    inputs: list[tuple[RelNode, Optional[dict[int, int]]]],
+    context: Context,
+) -> tuple[RelNode, Optional[dict[int, int]]]:
+    # the rebuilt node and where its columns moved, None if they didn't
+    kind = rel_type(node)
+    message = body(node)
+    mappings = [m for (_, m) in inputs]
+    new_inputs = [(f, child) for ((f, _), (child, _)) in zip(node.inputs, inputs)]
+
+    if kind == "read":
+        width = context.width(node)
+        if required is None or width is None or len(required) == width:
+            return (node, None)
+        elif not context.read_projection:
+            return (
+                project_node(
+                    [field(i) for i in sorted(required)], width, [("input", node)]
+                ),
+                _positions(required),
+            )
+
+        # the read's filters refer to its output, they keep their columns
+        required = required | referenced_fields(message)
+        if len(required) == width:
+            return (node, None)
+        mapping = _positions(required)
+
+        items = (
+            [i.field for i in message.projection.select.struct_items]
+            if message.HasField("projection")
+            else range(width)
+        )
+        rel = stalg.Rel()
+        rel.CopyFrom(node.message)
+        rel.read.projection.CopyFrom(
+            stalg.Expression.MaskExpression(
+                select=stalg.Expression.MaskExpression.StructSelect(
+                    struct_items=[
+                        stalg.Expression.MaskExpression.StructItem(field=items[i])
+                        for i in sorted(required)
+                    ]
+                ),
+                maintain_singular_struct=True,
+            )
+        )
+        for name in ("filter", "best_effort_filter"):
+            if rel.read.HasField(name):
+                getattr(rel.read, name).CopyFrom(
+                    _remap(getattr(rel.read, name), mapping)
+                )
+        return (RelNode(rel), mapping)
+    elif not node.inputs:
+        return (node, None)
+    elif kind == "project":
+        return _prune_project(node, required, inputs, context)
+    elif all(m is None for m in mappings):
+        # the inputs' columns didn't move
+        if all(new is old for ((_, new), (_, old)) in zip(new_inputs, node.inputs)):
+            return (node, None)
+        return (RelNode(node.message, new_inputs), None)
+    elif kind in ("filter", "fetch", "sort", "aggregate"):
+        return (
+            RelNode(_remap_message(node.message, mappings[0]), new_inputs),
+            None if kind == "aggregate" else mappings[0],
+        )
+    elif kind in ("join", "cross"):
+        (left, right) = [context.width(c) for (_, c) in node.inputs]
+        new_left = context.width(new_inputs[0][1])
+        mapping = {
+            i: (
+                _moved(mappings[0], i)
+                if i < left
+                else new_left + _moved(mappings[1], i - left)
+            )
+            for i in range(left + right)
+            if (i < left and _kept(mappings[0], i))
+            or (i >= left and _kept(mappings[1], i - left))
+        }
+        return (RelNode(_remap_message(node.message, mapping), new_inputs), mapping)
+    elif kind == "set":
+        width = context.width(node)
+        if required is None and width is None:
+            return (RelNode(node.message, new_inputs), None)
+        columns = range(width) if required is None else sorted(required)
+        exact = []
+        for (f, child), m in zip(new_inputs, mappings):
+            if context.width(child) != len(columns) or any(
+                _moved(m, c) != k for k, c in enumerate(columns)
+            ):
+                child = project_node(
+                    [field(_moved(m, c)) for c in columns],
+                    context.width(child),
+                    [("input", child)],
+                )
+            exact.append((f, child))
+        return (RelNode(node.message, exact), _moves(required, width))
+    else:
+        return (RelNode(node.message, new_inputs), None)
+
+
+def _prune_project(node, required, inputs, context):
+    message = body(node)
+    ((child, mapping),) = inputs
+    input_width = context.width(node.inputs[0][1])
+    if input_width is None:
+        return (RelNode(node.message, [("input", child)]), None)
+
+    entries = _project_entries(message, input_width)
+    outputs = range(len(entries)) if required is None else sorted(required)
+
+    used = sorted(
+        {entries[o] - input_width for o in outputs if entries[o] >= input_width}
+    )
+    position = {e: k for k, e in enumerate(used)}
+    new_width = context.width(child)
+
+    rel = stalg.Rel(
+        project=stalg.ProjectRel(
+            common=stalg.RelCommon(
+                emit=stalg.RelCommon.Emit(
+                    output_mapping=[
+                        (
+                            _moved(mapping, entries[o])
+                            if entries[o] < input_width
+                            else new_width + position[entries[o] - input_width]
+                        )
+                        for o in outputs
+                    ]
+                )
+            ),
+            expressions=[_remap(message.expressions[e], mapping) for e in used],
+        )
+    )
+    return (RelNode(rel, [("input", child)]), _moves(required, len(entries)))
+
+
+def _project_entries(project, input_width: int) -> list[int]:
+    if project.common.WhichOneof("emit_kind") == "emit":
+        return list(project.common.emit.output_mapping)
+    return list(range(input_width + len(project.expressions)))
+
+
+def _moves(required: Optional[set[int]], width: Optional[int]):
+    # where the columns of a node with `width` columns moved if only
+    # `required` are kept, None if none of them moved
+    if required is None or (width is not None and len(required) == width):
+        return None
+    return _positions(required)
+
+
+def _positions(columns: set[int]) -> dict[int, int]:
+    return {c: k for k, c in enumerate(sorted(columns))}
+
+
+def _kept(mapping: Optional[dict[int, int]], i: int) -> bool:
+    return mapping is None or i in mapping
+
+
+def _moved(mapping: Optional[dict[int, int]], i: int) -> int:
+    return i if mapping is None else mapping[i]
+
+
+def _remap(expression, mapping: Optional[dict[int, int]]):
+    if mapping is None:
+        return expression
+    return replace_fields(expression, lambda i: field(mapping[i]))
+
+
+def _remap_message(message: stalg.Rel, mapping: Optional[dict[int, int]]):
+    # a copy of a Rel without inputs with its field references renumbered
+    if mapping is None:
+        return message
+
+    rel = stalg.Rel()
+    rel.CopyFrom(message)
+    stack = nested_messages(getattr(rel, rel.WhichOneof("rel_type")))
+    while stack:
+        m = stack.pop()
+        if isinstance(m, stalg.Expression):
+            m.CopyFrom(_remap(m, mapping))
+        else:
+            stack.extend(nested_messages(m))
+    return rel
+
+
+def optimize(table, rules: Optional[list[Rule]] = None, read_projection: bool = True):
+    """A Table with the same result as `table` and a simpler plan."""
+    context = Context(read_projection=read_projection, extensions=table.extensions)
+    node = rewrite(table.node, default_rules if rules is None else rules, context)
+    node = prune_columns(node, context)
+
+    extensions = table.extensions.union(extension_set(context.extensions))
+    return table._with_same_schema(node, extensions=extensions)
@@ -0,0 +1,359 @@
+from collections import defaultdict
+from substrait.gen.proto import algebra_pb2 as stalg
+from .extension_set import ExtensionSet
+from .utils import digest, field_header, split_fields, stable_digest
+
+
+class RelNode:
+    """A relation in the logical plan that references its inputs instead of copying them.
+
+    `message` is the relation's own `Rel` with its input fields left empty and
+    `inputs` lists `(field, node)` pairs to fill them with, e.g.
+    `("input", child)` for a ProjectRel or `("left", l), ("right", r)` for a
+    JoinRel. Repeated fields like `SetRel.inputs` get one pair per element.
+    A view is a ReferenceRel with a `("subtree_ordinal", node)` pair, the
+    ordinal is only known once the plan's relations are.
+    Nodes are immutable and can be shared by any number of parents.
+    """
+
+    __slots__ = (
+        "message",
+        "inputs",
+        "_rel",
+        "_key",
+        "_fingerprint",
+        "_fields",
+        "_bytes",
+        "_views",
+    )
+
+    def __init__(
+        self,
+        message: stalg.Rel,
+        inputs: tuple[tuple[str, "RelNode"], ...] = (),
+    ) -> None:
+        self.message = message
+        self.inputs = tuple(inputs)
+        self._rel = None
+        self._key = None
+        self._fingerprint = None
+        self._fields = None
+        self._bytes = None
+        self._views = None
+
+    def to_rel(self) -> stalg.Rel:
+        """The complete `Rel` tree, built once and shared, so it must not be modified."""
+        if self._rel is None:
+            rel = stalg.Rel()
+            self.build(rel)
+            self._rel = rel
+        return self._rel
+
+    @property
+    def is_view(self) -> bool:
+        return bool(self.inputs) and self.inputs[0][0] == "subtree_ordinal"
+
+    def build(self, target: stalg.Rel, ordinals: dict[str, int] | None = None) -> None:
+        """Write the complete `Rel` tree into `target`.
+
+        Every node's own message is copied into its place top down, so this is
+        linear in the size of the tree. Copying a finished tree instead would
+        go through protobuf's parser, which rejects deeply nested messages.
+
+        Subtrees whose key is in `ordinals` (other than this node) are
+        written as a ReferenceRel to that plan relation, views whose subtree
+        isn't are inlined.
+        """
+        stack = [(target, self, False)]
+        while stack:
+            (target, node, shareable) = stack.pop()
+            if (
+                shareable
+                and ordinals
+                and (ordinal := ordinals.get(node.key())) is not None
+            ):
+                target.reference.subtree_ordinal = ordinal
+                continue
+            elif node.is_view:
+                stack.append((target, node.inputs[0][1], True))
+                continue
+
+            target.CopyFrom(node.message)
+            body = getattr(target, target.WhichOneof("rel_type"))
+
+            for field, child in node.inputs:
+                slot = getattr(body, field)
+                stack.append(
+                    (slot.add() if hasattr(slot, "add") else slot, child, True)
+                )
+
+    def _own_fields(self) -> tuple[int, list]:
+        # the Rel field of the node's kind and the serialized fields of its
+        # message in field order, inputs as (field number, None, child)
+        if self._fields is None:
+            rel_type = self.message.WhichOneof("rel_type")
+            body = getattr(self.message, rel_type)
+            by_name = body.DESCRIPTOR.fields_by_name
+            fields = [
+                (n, record, None)
+                for (n, record) in split_fields(body.SerializeToString())
+            ]
+            fields += [(by_name[f].number, None, child) for (f, child) in self.inputs]
+            fields.sort(key=lambda f: f[0])
+            self._fields = (
+                self.message.DESCRIPTOR.fields_by_name[rel_type].number,
+                fields,
+            )
+        return self._fields
+
+    def serialize(self, ordinals: dict[str, int] | None = None) -> bytes:
+        """The serialized `Rel` tree that `build` writes, without building it.
+
+        Each node serializes its own message once, the tree is put together
+        by splicing in the bytes of the inputs. Without `ordinals`, the bytes
+        of this node and of nodes with more than one parent in the tree are
+        kept, so later trees over them only serialize what's new.
+        """
+        if not ordinals and self._bytes is not None:
+            return self._bytes
+
+        def resolve(node, shareable):
+            # the bytes of a ReferenceRel or the node to write in place
+            while True:
+                if (
+                    shareable
+                    and ordinals
+                    and (ordinal := ordinals.get(node.key())) is not None
+                ):
+                    rel = stalg.Rel(
+                        reference=stalg.ReferenceRel(subtree_ordinal=ordinal)
+                    )
+                    return rel.SerializeToString()
+                elif not node.is_view:
+                    return node
+                (node, shareable) = (node.inputs[0][1], True)
+
+        root = resolve(self, False)
+        if isinstance(root, bytes):
+            return root
+
+        def size(child):
+            return len(child) if isinstance(child, bytes) else sizes[id(child)]
+
+        # sizes of the Rels, inputs first
+        sizes = {}
+        bodies = {}
+        fields = {}
+        parents = defaultdict(int)
+        stack = [root]
+        while stack:
+            node = stack[-1]
+            if id(node) in sizes:
+                stack.pop()
+                continue
+            elif not ordinals and node._bytes is not None:
+                sizes[id(node)] = len(node._bytes)
+                stack.pop()
+                continue
+
+            if id(node) not in fields:
+                (number, own) = node._own_fields()
+                own = [
+                    (n, record, child if child is None else resolve(child, True))
+                    for (n, record, child) in own
+                ]
+                fields[id(node)] = (number, own)
+                for _, _, child in own:
+                    if isinstance(child, RelNode):
+                        parents[id(child)] += 1
+                        stack.append(child)
+                continue
+
+            stack.pop()
+            (number, own) = fields[id(node)]
+            body = 0
+            for n, record, child in own:
+                if child is None:
+                    body += len(record)
+                else:
+                    body += len(field_header(n, size(child))) + size(child)
+            bodies[id(node)] = body
+            sizes[id(node)] = len(field_header(number, body)) + body
+
+        chunks = []
+        stack = [root]
+        while stack:
+            item = stack.pop()
+            if isinstance(item, bytes):
+                chunks.append(item)
+                continue
+            elif isinstance(item, tuple):
+                (node, start) = item
+                node._bytes = b"".join(chunks[start:])
+                continue
+
+            node = item
+            if not ordinals and node._bytes is not None:
+                chunks.append(node._bytes)
+                continue
+            elif not ordinals and (node is root or parents[id(node)] > 1):
+                stack.append((node, len(chunks)))
+
+            (number, own) = fields[id(node)]
+            chunks.append(field_header(number, bodies[id(node)]))
+            parts = []
+            for n, record, child in own:
+                if child is None:
+                    parts.append(record)
+                else:
+                    parts.extend((field_header(n, size(child)), child))
+            stack.extend(reversed(parts))
+
+        if not ordinals and root._bytes is not None:
+            return root._bytes
+        return b"".join(chunks)
+
+    def has_views(self) -> bool:
+        """Whether there's a view anywhere in the tree, cached per node."""
+        stack = [self]
+        while stack:
+            node = stack[-1]
+            if node._views is not None:
+                stack.pop()
+                continue
+
+            pending = [c for (_, c) in node.inputs if c._views is None]
+            if pending and not node.is_view:
+                stack.extend(pending)
+                continue
+
+            stack.pop()
+            node._views = node.is_view or any(c._views for (_, c) in node.inputs)
+
+        return self._views
+
+    def shared_subtrees(self, repeated: bool = False) -> list["RelNode"]:
+        """The subtrees to lift into plan relations of their own.
+
+        These are the subtrees of views and, if `repeated`, every subtree
+        (other than a leaf) that would be written out more than once. Equal
+        subtrees are found by key. Subtrees come after the ones they
+        reference.
+        """
+        if not repeated and not self.has_views():
+            # keys are only needed if there are views
+            return []
+
+        root = self.key()
+        nodes = {root: self}
+        incoming = {root: 0}
+        stack = [self]
+        while stack:
+            node = stack.pop()
+            for _, child in node.inputs:
+                key = child.key()
+                if key not in nodes:
+                    nodes[key] = child
+                    incoming[key] = 0
+                    stack.append(child)
+                incoming[key] += 1
+
+        # parents before children, counting how often each subtree is written
+        # out, a lifted subtree is written out once
+        written = dict.fromkeys(nodes, 0)
+        written[root] = 1
+        views = set()
+        lifted = set()
+        ready = [root]
+        while ready:
+            key = ready.pop()
+            node = nodes[key]
+            if key != root and (
+                key in views
+                or (repeated and node.inputs and not node.is_view and written[key] > 1)
+            ):
+                lifted.add(key)
+                written[key] = 1
+
+            for _, child in node.inputs:
+                child_key = child.key()
+                if node.is_view:
+                    views.add(child_key)
+                else:
+                    written[child_key] += written[key]
+
+                incoming[child_key] -= 1
+                if incoming[child_key] == 0:
+                    ready.append(child_key)
+
+        # in the order they're first used, after the ones they use
+        order = []
+        done = set()
+        stack = [(self, False)]
+        while stack:
+            (node, expanded) = stack.pop()
+            key = node.key()
+            if expanded:
+                if key in lifted:
+                    order.append(node)
+            elif key not in done:
+                done.add(key)
+                stack.append((node, True))
+                stack.extend((child, False) for (_, child) in reversed(node.inputs))
+
+        return order
+
+    def key(self) -> str:
+        """Hash of the node's own message and the keys of its inputs.
+
+        Equal subtrees of a plan have equal keys. Function anchors are hashed
+        as they are, see `fingerprint` for a hash that's the same in every
+        process. Each node's message is serialized once, no matter how many
+        parents share it.
+        """
+        stack = [self]
+        while stack:
+            node = stack[-1]
+            if node._key is not None:
+                stack.pop()
+                continue
+
+            pending = [c for (_, c) in node.inputs if c._key is None]
+            if pending:
+                stack.extend(pending)
+                continue
+
+            stack.pop()
+            node._key = digest(
+                node.message.SerializeToString(deterministic=True),
+                *[part for (f, c) in node.inputs for part in (f, c._key)],
+            )
+
+        return self._key
+
+    def fingerprint(self, extensions: ExtensionSet) -> str:
+        """Like `key`, but functions are hashed by what they're declared as.
+
+        `extensions` declares the functions of the subtree, the fingerprint
+        depends on their uris and signatures, not on their anchors.
+        """
+        stack = [self]
+        while stack:
+            node = stack[-1]
+            if node._fingerprint is not None:
+                stack.pop()
+                continue
+
+            pending = [c for (_, c) in node.inputs if c._fingerprint is None]
+            if pending:
+                stack.extend(pending)
+                continue
+
+            stack.pop()
+            node._fingerprint = stable_digest(
+                node.message,
+                extensions,
+                *[part for (f, c) in node.inputs for part in (f, c._fingerprint)],
+            )
+
+        return self._fingerprint
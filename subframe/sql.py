@@ -77,9 +77,13 @@ def translate_function_argument(
     arg_type = function_argument.WhichOneof("arg_type")
 
     if arg_type == "value":
-        return translate_expression(
+        sql = translate_expression(
             function_argument.value, extension_functions, context
         )
+        # nested operators keep their precedence
+        if function_argument.value.WhichOneof("rex_type") == "scalar_function":
+            return f"({sql})"
+        return sql
     else:
         raise Exception(f"Unknown arg_type {arg_type}")
 
@@ -110,6 +114,10 @@ def translate_scalar_function(
         return " < ".join(arguments)
     elif func == "lte:any_any":
         return " <= ".join(arguments)
+    elif func == "and:bool":
+        return " AND ".join(arguments)
+    elif func == "or:bool":
+        return " OR ".join(arguments)
     else:
         raise Exception(f"Unknown function {func}")
 
@@ -156,13 +164,19 @@ def translate_project(project_rel: stalg.ProjectRel, extension_functions) -> Sql
 def translate_read(read_rel: stalg.ReadRel, extension_functions) -> SqlTable:
     read_type = read_rel.WhichOneof("read_type")
 
-    select_clause = ", ".join([name for name in read_rel.base_schema.names])
+    columns = list(read_rel.base_schema.names)
+    if read_rel.HasField("projection"):
+        columns = [
+            columns[item.field] for item in read_rel.projection.select.struct_items
+        ]
+
+    select_clause = ", ".join(columns)
 
     if read_type == "named_table":
         names = read_rel.named_table.names
         full_name = ".".join(names)
         sql = f'SELECT {select_clause}\nFROM "{full_name}"'
-        return SqlTable(sql, columns=read_rel.base_schema.names)
+        return SqlTable(sql, columns=columns)
     else:
         raise Exception(f"Unknown read_type {read_type}")
 
@@ -3,46 +3,119 @@ from substrait.gen.proto import algebra_pb2 as stalg
 from substrait.gen.proto import plan_pb2 as stp
 from substrait.gen.proto import type_pb2 as stt
 from substrait.gen.proto.extensions import extensions_pb2 as ste
-from .value import Value, AggregateValue
-from .utils import merge_extensions
+from .value import Value, AggregateValue, binary_functions
+from .utils import digest, field_header, split_fields
+from .extension_set import ExtensionSet, extension_set
+from .data_type import from_proto
+from .rel_node import RelNode
+
+# field numbers of the plan messages the relations are spliced into
+PLAN_RELATIONS = stp.Plan.DESCRIPTOR.fields_by_name["relations"].number
+PLAN_REL_REL = stp.PlanRel.DESCRIPTOR.fields_by_name["rel"].number
+PLAN_REL_ROOT = stp.PlanRel.DESCRIPTOR.fields_by_name["root"].number
+REL_ROOT_INPUT = stalg.RelRoot.DESCRIPTOR.fields_by_name["input"].number
 
 
 class Table:
     def __init__(
         self,
-        rel: stalg.Rel,
+        rel: stalg.Rel | RelNode,
         names: list[str],
         struct: stt.Type.Struct,
-        extensions,
-        relations,
+        extensions: ExtensionSet,
     ) -> None:
-        self.rel = rel
+        self.node = rel if isinstance(rel, RelNode) else RelNode(rel)
         self.names = names
         self.struct = struct
-        self.extensions = extensions
-        self.relations = relations
+        self.extensions = extension_set(extensions)
+        self._dtypes = None
+        self._ordinals = None
+        self._fingerprint = None
+        self._plans = {}
+        self._plan_bytes = {}
+        self._optimized = None
+
+    @property
+    def rel(self) -> stalg.Rel:
+        return self.node.to_rel()
+
+    @property
+    def dtypes(self):
+        if self._dtypes is None:
+            self._dtypes = [from_proto(t) for t in self.struct.types]
+        return self._dtypes
+
+    @property
+    def ordinals(self) -> dict[str, int]:
+        """Column name -> position, the first one for duplicated names."""
+        if self._ordinals is None:
+            self._ordinals = {}
+            for i, name in enumerate(self.names):
+                self._ordinals.setdefault(name, i)
+        return self._ordinals
 
     def __getitem__(self, what: str):
-        expression = stalg.Expression(
-            selection=stalg.Expression.FieldReference(
-                root_reference=stalg.Expression.FieldReference.RootReference(),
-                direct_reference=stalg.Expression.ReferenceSegment(
-                    struct_field=stalg.Expression.ReferenceSegment.StructField(
-                        field=list(self.names).index(what),
-                    ),
-                ),
-            )
-        )
-        return Value(
-            expression,
-            data_type=self.struct.types[list(self.names).index(what)],
+        ordinal = self.ordinals.get(what)
+        if ordinal is None:
+            raise ValueError(f"{what!r} is not a column of the table")
+
+        value = Value(
+            expression=None,
+            data_type=self.dtypes[ordinal],
             name=what,
             tables=[self],
         )
-
-    def to_substrait(self) -> stp.Plan:
-
-        rel_root = stalg.RelRoot(input=self.rel, names=self.names)
+        value._column = (self, ordinal)
+        return value
+
+    def fingerprint(self) -> str:
+        """Hash of the plan and output names.
+
+        Equal fingerprints mean equal plans. Functions are hashed by extension
+        uri and signature, so fingerprints are the same in every process.
+        """
+        if self._fingerprint is None:
+            self._fingerprint = digest(
+                self.node.fingerprint(self.extensions),
+                repr(list(self.names)),
+            )
+        return self._fingerprint
+
+    def optimize(self) -> "Table":
+        """The same table with the optimizer's rules applied to its plan."""
+        if self._optimized is None:
+            from .optimizer import optimize
+
+            self._optimized = optimize(self)
+            self._optimized._optimized = self._optimized
+        return self._optimized
+
+    def to_substrait(self, optimize: bool = False, ctes: bool = False) -> stp.Plan:
+        """The substrait plan of this table.
+
+        With `ctes`, subtrees that appear more than once, e.g. a table joined
+        with itself, are written once as a plan relation of their own and
+        referenced by ReferenceRels, like views are. Not every consumer
+        supports those.
+
+        It's built once per Table and shared, so it must not be modified.
+        """
+        if optimize:
+            return self.optimize().to_substrait(ctes=ctes)
+        if ctes not in self._plans:
+            self._plans[ctes] = self._build_plan(ctes)
+        return self._plans[ctes]
+
+    def to_substrait_bytes(self, optimize: bool = False, ctes: bool = False) -> bytes:
+        """The serialized substrait plan of this table, cached like `to_substrait()`."""
+        if optimize:
+            return self.optimize().to_substrait_bytes(ctes=ctes)
+        if ctes not in self._plan_bytes:
+            self._plan_bytes[ctes] = self._serialize_plan(ctes)
+        return self._plan_bytes[ctes]
+
+    def _plan_header(self) -> stp.Plan:
+        # the plan without its relations
         return stp.Plan(
             extension_uris=[
                 ste.SimpleExtensionURI(extension_uri_anchor=i, uri=e)
@@ -60,12 +133,59 @@ class Table:
                 for fn_name, fn_anchor in e[1].items()
             ],
             version=stp.Version(minor_number=54, producer="subframe"),
-            relations=[stp.PlanRel(rel=rel) for rel in self.relations]
-            + [stp.PlanRel(root=rel_root)],
         )
 
-    def _merged_extensions(self, exprs):
-        return merge_extensions(self.extensions, exprs)
+    def _build_plan(self, ctes: bool) -> stp.Plan:
+        plan = self._plan_header()
+
+        # the trees are built in place, nesting a copy of them would go through
+        # protobuf's parser which limits the depth of messages
+        shared = self.node.shared_subtrees(repeated=ctes)
+        ordinals = {node.key(): i for i, node in enumerate(shared)}
+        for node in shared:
+            node.build(plan.relations.add().rel, ordinals)
+
+        rel_root = plan.relations.add().root
+        rel_root.names.extend(self.names)
+        self.node.build(rel_root.input, ordinals)
+
+        return plan
+
+    def _serialize_plan(self, ctes: bool) -> bytes:
+        # the same bytes as serializing _build_plan's plan, but the relations
+        # are put together from the nodes' cached bytes
+        shared = self.node.shared_subtrees(repeated=ctes)
+        ordinals = {node.key(): i for i, node in enumerate(shared)}
+
+        relations = []
+        for node in shared:
+            rel = node.serialize(ordinals)
+            relations.append([field_header(PLAN_REL_REL, len(rel)), rel])
+
+        rel = self.node.serialize(ordinals)
+        names = stalg.RelRoot(names=self.names).SerializeToString()
+        root = [field_header(REL_ROOT_INPUT, len(rel)), rel, names]
+        root_size = sum(len(chunk) for chunk in root)
+        relations.append([field_header(PLAN_REL_ROOT, root_size), *root])
+
+        fields = split_fields(self._plan_header().SerializeToString())
+        fields += [
+            (
+                PLAN_RELATIONS,
+                [field_header(PLAN_RELATIONS, sum(len(c) for c in chunks)), *chunks],
+            )
+            for chunks in relations
+        ]
+        fields.sort(key=lambda f: f[0])
+
+        return b"".join(
+            chunk
+            for (_, field) in fields
+            for chunk in (field if isinstance(field, list) else [field])
+        )
+
+    def _merged_extensions(self, exprs) -> ExtensionSet:
+        return self.extensions.union(*[e.extensions for e in exprs])
 
     def _to_values(self, exprs: list[Value | str], named_exprs: dict[str, Value | str]):
         combined_exprs = [(e if type(e) == str else e._name, e) for e in exprs] + list(
@@ -79,6 +199,42 @@ class Table:
 
         return combined_exprs
 
+    def binary_op(
+        self, op: str, pairs: list[tuple[Value | str, Value | str]]
+    ) -> list[Value]:
+        """Apply a binary operator like "add" or "gt" to many pairs of columns.
+
+        The function signature is resolved once per distinct pair of argument
+        types, e.g. `t.binary_op("add", [("a", "b"), ("c", "d")])` is
+        equivalent to `[t["a"] + t["b"], t["c"] + t["d"]]`.
+        """
+        from subframe import registry
+
+        (url, func, col_name) = binary_functions[op]
+
+        columns = {}
+
+        def to_value(what):
+            if type(what) != str:
+                return what
+            if what not in columns:
+                columns[what] = self[what]
+            return columns[what]
+
+        merged = []
+        for left, right in pairs:
+            left = to_value(left)
+            merged.append((left, *left._merge_tables(to_value(right))))
+
+        resolved = registry.resolve_many(
+            url, func, [(left.dtype, right.dtype) for (left, _, right) in merged]
+        )
+
+        return [
+            left._apply_resolved_function(right, new_tables, r, col_name)
+            for ((left, new_tables, right), r) in zip(merged, resolved)
+        ]
+
     def select(
         self,
         *exprs: Value | str,  # TODO | Iterable[Value | str],
@@ -88,16 +244,20 @@ class Table:
 
         mapping_counter = itertools.count(len(self.names))
 
-        rel = stalg.Rel(
-            project=stalg.ProjectRel(
-                input=self.rel,
-                common=stalg.RelCommon(
-                    emit=stalg.RelCommon.Emit(
-                        output_mapping=[next(mapping_counter) for _ in combined_exprs]
-                    )
-                ),
-                expressions=[c.expression for c in combined_exprs],
-            )
+        rel = RelNode(
+            stalg.Rel(
+                project=stalg.ProjectRel(
+                    common=stalg.RelCommon(
+                        emit=stalg.RelCommon.Emit(
+                            output_mapping=[
+                                next(mapping_counter) for _ in combined_exprs
+                            ]
+                        )
+                    ),
+                    expressions=[c.expression for c in combined_exprs],
+                )
+            ),
+            inputs=[("input", self.node)],
         )
 
         names = [c._name for c in combined_exprs]
@@ -114,23 +274,20 @@ class Table:
             names=names,
             struct=struct,
             extensions=self._merged_extensions(combined_exprs),
-            relations=self.relations,
         )
 
     def filter(self, *predicates: Value):
         assert len(predicates) == 1
         # TODO ignores all predicates except the first one
         predicate = predicates[0]
-        rel = stalg.Rel(
-            filter=stalg.FilterRel(input=self.rel, condition=predicate.expression)
+        rel = RelNode(
+            stalg.Rel(filter=stalg.FilterRel(condition=predicate.expression)),
+            inputs=[("input", self.node)],
         )
 
-        return Table(
-            rel=rel,
-            names=self.names,
-            struct=self.struct,
+        return self._with_same_schema(
+            rel,
             extensions=self._merged_extensions(predicates),
-            relations=self.relations,
         )
 
     def group_by(self, *by: Value | str, **key_exprs: Value | str):
@@ -141,19 +298,23 @@ class Table:
     def aggregate(self, metrics: list[AggregateValue], by: list[Value | str]):
         combined_exprs = self._to_values(by, {})
 
-        rel = stalg.Rel(
-            aggregate=stalg.AggregateRel(
-                input=self.rel,
-                groupings=[
-                    stalg.AggregateRel.Grouping(
-                        grouping_expressions=[val.expression for val in combined_exprs]
-                    )
-                ],
-                measures=[
-                    stalg.AggregateRel.Measure(measure=expr.aggregate_function)
-                    for expr in metrics
-                ],
-            )
+        rel = RelNode(
+            stalg.Rel(
+                aggregate=stalg.AggregateRel(
+                    groupings=[
+                        stalg.AggregateRel.Grouping(
+                            grouping_expressions=[
+                                val.expression for val in combined_exprs
+                            ]
+                        )
+                    ],
+                    measures=[
+                        stalg.AggregateRel.Measure(measure=expr.aggregate_function)
+                        for expr in metrics
+                    ],
+                )
+            ),
+            inputs=[("input", self.node)],
         )
 
         names = [c._name for c in combined_exprs] + [expr.name for expr in metrics]
@@ -172,115 +333,95 @@ class Table:
             names=names,
             struct=struct,
             extensions=self._merged_extensions([expr for expr in metrics]),
-            relations=self.relations,
         )
 
     def limit(self, n: int | None, offset: int):
-        rel = stalg.Rel(fetch=stalg.FetchRel(input=self.rel, offset=offset, count=n))
-
-        return Table(
-            rel=rel,
-            names=self.names,
-            struct=self.struct,
-            extensions=self.extensions,
-            relations=self.relations,
+        rel = RelNode(
+            stalg.Rel(fetch=stalg.FetchRel(offset=offset, count=n)),
+            inputs=[("input", self.node)],
         )
 
+        return self._with_same_schema(rel, extensions=self.extensions)
+
     def union(self, table: "Table", *rest: "Table", distinct: bool = True):
         tables = [table] + list(rest)
-        rel = stalg.Rel(
-            set=stalg.SetRel(
-                inputs=[self.rel] + [t.rel for t in tables],
-                op=(
-                    stalg.SetRel.SetOp.SET_OP_UNION_DISTINCT
-                    if distinct
-                    else stalg.SetRel.SetOp.SET_OP_UNION_ALL
-                ),
-            )
+        rel = RelNode(
+            stalg.Rel(
+                set=stalg.SetRel(
+                    op=(
+                        stalg.SetRel.SetOp.SET_OP_UNION_DISTINCT
+                        if distinct
+                        else stalg.SetRel.SetOp.SET_OP_UNION_ALL
+                    ),
+                )
+            ),
+            inputs=[("inputs", t.node) for t in [self, *tables]],
         )
 
-        return Table(
-            rel=rel,
-            names=self.names,
-            struct=self.struct,
+        return self._with_same_schema(
+            rel,
             extensions=self._merged_extensions(tables),
-            relations=[rel for t in tables for rel in t.relations],
         )
 
     def intersect(self, table: "Table", *rest: "Table", distinct: bool = True):
         tables = [table] + list(rest)
-        rel = stalg.Rel(
-            set=stalg.SetRel(
-                inputs=[self.rel] + [t.rel for t in tables],
-                op=(
-                    stalg.SetRel.SetOp.SET_OP_INTERSECTION_PRIMARY
-                    if distinct
-                    else stalg.SetRel.SetOp.SET_OP_INTERSECTION_PRIMARY
-                ),
-            )
+        rel = RelNode(
+            stalg.Rel(
+                set=stalg.SetRel(
+                    op=(
+                        stalg.SetRel.SetOp.SET_OP_INTERSECTION_PRIMARY
+                        if distinct
+                        else stalg.SetRel.SetOp.SET_OP_INTERSECTION_PRIMARY
+                    ),
+                )
+            ),
+            inputs=[("inputs", t.node) for t in [self, *tables]],
         )
 
-        return Table(
-            rel=rel,
-            names=self.names,
-            struct=self.struct,
-            extensions=self._merged_extensions(tables),
-            relations=self.relations,
-        )
+        return self._with_same_schema(rel, extensions=self._merged_extensions(tables))
 
     def difference(self, table: "Table", *rest: "Table", distinct: bool = True):
         tables = [table] + list(rest)
-        rel = stalg.Rel(
-            set=stalg.SetRel(
-                inputs=[self.rel] + [t.rel for t in tables],
-                op=(
-                    stalg.SetRel.SetOp.SET_OP_MINUS_PRIMARY
-                    if distinct
-                    else stalg.SetRel.SetOp.SET_OP_MINUS_PRIMARY
-                ),
-            )
+        rel = RelNode(
+            stalg.Rel(
+                set=stalg.SetRel(
+                    op=(
+                        stalg.SetRel.SetOp.SET_OP_MINUS_PRIMARY
+                        if distinct
+                        else stalg.SetRel.SetOp.SET_OP_MINUS_PRIMARY
+                    ),
+                )
+            ),
+            inputs=[("inputs", t.node) for t in [self, *tables]],
         )
 
-        return Table(
-            rel=rel,
-            names=self.names,
-            struct=self.struct,
-            extensions=self._merged_extensions(tables),
-            relations=self.relations,
-        )
+        return self._with_same_schema(rel, extensions=self._merged_extensions(tables))
 
     def order_by(self, *by: str):
-        rel = stalg.Rel(
-            sort=stalg.SortRel(
-                input=self.rel,
-                sorts=[
-                    stalg.SortField(
-                        expr=self[e].expression,
-                        direction=stalg.SortField.SortDirection.SORT_DIRECTION_ASC_NULLS_LAST,
-                    )
-                    for e in by
-                ],
-            )
+        rel = RelNode(
+            stalg.Rel(
+                sort=stalg.SortRel(
+                    sorts=[
+                        stalg.SortField(
+                            expr=self[e].expression,
+                            direction=stalg.SortField.SortDirection.SORT_DIRECTION_ASC_NULLS_LAST,
+                        )
+                        for e in by
+                    ],
+                )
+            ),
+            inputs=[("input", self.node)],
         )
 
-        return Table(
-            rel=rel,
-            names=self.names,
-            struct=self.struct,
-            extensions=self.extensions,
-            relations=self.relations,
-        )
+        return self._with_same_schema(rel, extensions=self.extensions)
 
     def as_scalar(self):
-        expression = stalg.Expression(
-            subquery=stalg.Expression.Subquery(
-                scalar=stalg.Expression.Subquery.Scalar(input=self.rel)
-            )
-        )
+        expression = stalg.Expression()
+        self.node.build(expression.subquery.scalar.input)
 
         return Value(
             expression,
-            data_type=self.struct.types[0],
+            data_type=self.dtypes[0],
             name="ScalarSubquery()",  # TODO why??
             extensions=self.extensions,
             tables=[],
@@ -290,11 +431,9 @@ class Table:
     def cross_join(
         self, table: "Table", *rest: "Table", lname: str = "", rname: str = "_right"
     ):
-        rel = stalg.Rel(
-            cross=stalg.CrossRel(
-                left=self.rel,
-                right=table.rel,
-            )
+        rel = RelNode(
+            stalg.Rel(cross=stalg.CrossRel()),
+            inputs=[("left", self.node), ("right", table.node)],
         )
 
         return Table(
@@ -302,7 +441,6 @@ class Table:
             names=list(self.names) + list(table.names),
             struct=self._merge_structs(table.struct),
             extensions=self._merged_extensions([table]),
-            relations=self.relations,
         )
 
     def join(
@@ -315,13 +453,14 @@ class Table:
             "outer": stalg.JoinRel.JoinType.JOIN_TYPE_OUTER,
         }
 
-        rel = stalg.Rel(
-            join=stalg.JoinRel(
-                left=self.rel,
-                right=right.rel,
-                expression=predicates[0].expression,
-                type=join_mapping[how],
-            )
+        rel = RelNode(
+            stalg.Rel(
+                join=stalg.JoinRel(
+                    expression=predicates[0].expression,
+                    type=join_mapping[how],
+                )
+            ),
+            inputs=[("left", self.node), ("right", right.node)],
         )
 
         return Table(
@@ -329,19 +468,28 @@ class Table:
             names=list(self.names) + list(right.names),
             struct=self._merge_structs(right.struct),
             extensions=self._merged_extensions([right, *predicates]),
-            relations=self.relations,
         )
 
     def view(self):
-        return Table(
-            rel=stalg.Rel(
-                reference=stalg.ReferenceRel(subtree_ordinal=0),
-            ),
+        """The table as a ReferenceRel to a plan relation of its own."""
+        rel = RelNode(
+            stalg.Rel(reference=stalg.ReferenceRel()),
+            inputs=[("subtree_ordinal", self.node)],
+        )
+
+        return self._with_same_schema(rel, extensions=self.extensions)
+
+    def _with_same_schema(self, rel, extensions) -> "Table":
+        # tables that keep the columns share their name index and types
+        table = Table(
+            rel=rel,
             names=self.names,
             struct=self.struct,
-            extensions=self.extensions,
-            relations=[self.rel],
+            extensions=extensions,
         )
+        table._ordinals = self.ordinals
+        table._dtypes = self.dtypes
+        return table
 
     def _merge_structs(self, struct):
         return stt.Type.Struct(types=list(self.struct.types) + list(struct.types))
@@ -1,22 +1,165 @@
+import hashlib
+import math
+import operator
 import re
+import struct
+from typing import Iterator, Optional
+from google.protobuf.descriptor import FieldDescriptor
 from substrait.gen.proto import type_pb2 as stt
 from substrait.gen.proto.type_pb2 import Type
 from substrait.gen.proto.algebra_pb2 import Rel, RelCommon
 import substrait.gen.proto.algebra_pb2 as stalg
-from google.protobuf.descriptor import FieldDescriptor
 
 
-def merge_extensions(extensions, exprs):
-    for c in exprs:
-        if c.extensions:
-            for k, v in c.extensions.items():
-                if k in extensions:
-                    for k1, v1 in c.extensions[k].items():
-                        extensions[k][k1] = v1
-                else:
-                    extensions[k] = v
+def digest(*parts: str | bytes) -> str:
+    """Hex sha256 of a sequence of parts, each one length prefixed."""
+    h = hashlib.sha256()
+    for part in parts:
+        if isinstance(part, str):
+            part = part.encode()
+        h.update(len(part).to_bytes(8, "little"))
+        h.update(part)
+    return h.hexdigest()
+
+
+def function_key(extensions, anchor: int) -> tuple[str, str]:
+    """`(uri, signature)` of the function `extensions` declares with `anchor`.
+
+    Anchors are handed out per process, these are what to hash instead.
+    Undeclared functions only have their anchor.
+    """
+    return extensions.function(anchor) or ("", str(anchor))
+
+
+# message full name -> whether a function reference can be nested in it
+_holds_functions: dict[str, bool] = {}
 
-    return extensions
+
+def _may_hold_functions(descriptor) -> bool:
+    # types and schemas can't, expressions and relations can
+    if descriptor.full_name not in _holds_functions:
+        reachable = {descriptor.full_name: descriptor}
+        stack = [descriptor]
+        while stack:
+            for f in stack.pop().fields:
+                nested = f.message_type
+                if nested is not None and nested.full_name not in reachable:
+                    reachable[nested.full_name] = nested
+                    stack.append(nested)
+        _holds_functions[descriptor.full_name] = any(
+            "function_reference" in d.fields_by_name for d in reachable.values()
+        )
+    return _holds_functions[descriptor.full_name]
+
+
+def _function_calls(message) -> list:
+    # the messages in `message` with a function reference, in field order
+    calls = []
+    stack = [message]
+    while stack:
+        message = stack.pop()
+        if "function_reference" in message.DESCRIPTOR.fields_by_name:
+            calls.append(message)
+        for descriptor, value in reversed(message.ListFields()):
+            if descriptor.type != FieldDescriptor.TYPE_MESSAGE:
+                continue
+            elif not _may_hold_functions(descriptor.message_type):
+                continue
+            elif descriptor.label == FieldDescriptor.LABEL_REPEATED:
+                stack.extend(reversed(value))
+            else:
+                stack.append(value)
+    return calls
+
+
+def stable_digest(message, extensions, *parts: str | bytes) -> str:
+    """`digest` of a message and `parts` that doesn't depend on function anchors.
+
+    The anchors in `message` are numbered in the order they appear instead
+    and the functions they stand for, see `function_key`, are hashed along.
+    """
+    if not _function_calls(message):
+        return digest(message.SerializeToString(deterministic=True), *parts)
+
+    copy = type(message)()
+    copy.CopyFrom(message)
+    numbers: dict[int, int] = {}
+    functions = []
+    for call in _function_calls(copy):
+        anchor = call.function_reference
+        if anchor not in numbers:
+            numbers[anchor] = len(numbers)
+            functions.extend(function_key(extensions, anchor))
+        call.function_reference = numbers[anchor]
+
+    return digest(
+        copy.SerializeToString(deterministic=True),
+        str(len(numbers)),
+        *functions,
+        *parts,
+    )
+
+
+def encode_varint(n: int) -> bytes:
+    """Protobuf's base 128 encoding of a non-negative integer."""
+    out = bytearray()
+    while n > 0x7F:
+        out.append((n & 0x7F) | 0x80)
+        n >>= 7
+    out.append(n)
+    return bytes(out)
+
+
+def field_header(field_number: int, size: int) -> bytes:
+    """Tag and length of a length-delimited field with `size` bytes of content."""
+    return encode_varint(field_number << 3 | 2) + encode_varint(size)
+
+
+def split_fields(data: bytes) -> list[tuple[int, bytes]]:
+    """The serialized fields of a message as `(field number, tag and value)`.
+
+    Concatenating them gives `data` back, in the order they were written.
+    """
+    fields = []
+    position = 0
+    while position < len(data):
+        start = position
+        tag = 0
+        shift = 0
+        while True:
+            byte = data[position]
+            position += 1
+            tag |= (byte & 0x7F) << shift
+            shift += 7
+            if byte < 0x80:
+                break
+
+        wire_type = tag & 7
+        if wire_type == 0:
+            while data[position] >= 0x80:
+                position += 1
+            position += 1
+        elif wire_type == 1:
+            position += 8
+        elif wire_type == 5:
+            position += 4
+        elif wire_type == 2:
+            size = 0
+            shift = 0
+            while True:
+                byte = data[position]
+                position += 1
+                size |= (byte & 0x7F) << shift
+                shift += 7
+                if byte < 0x80:
+                    break
+            position += size
+        else:
+            raise Exception(f"Unhandled wire type {wire_type}")
+
+        fields.append((tag >> 3, data[start:position]))
+
+    return fields
 
 
 def to_substrait_type(dtype: str):
@@ -64,6 +207,85 @@ def apply_emit(raw_schema: stt.Type.Struct, common: RelCommon) -> stt.Type.Struc
         )
 
 
+# (extension file, function name) -> the function on python values, calls of
+# these with only literal arguments are evaluated when the plan is built
+foldable_functions = {
+    ("functions_arithmetic.yaml", "add"): operator.add,
+    ("functions_arithmetic.yaml", "subtract"): operator.sub,
+    ("functions_comparison.yaml", "equal"): operator.eq,
+    ("functions_comparison.yaml", "not_equal"): operator.ne,
+    ("functions_comparison.yaml", "lt"): operator.lt,
+    ("functions_comparison.yaml", "lte"): operator.le,
+    ("functions_comparison.yaml", "gt"): operator.gt,
+    ("functions_comparison.yaml", "gte"): operator.ge,
+    ("functions_boolean.yaml", "and"): lambda *values: all(values),
+    ("functions_boolean.yaml", "or"): lambda *values: any(values),
+}
+
+# data type kind -> Literal field
+_literal_kinds = {
+    "bool": "boolean",
+    "i8": "i8",
+    "i16": "i16",
+    "i32": "i32",
+    "i64": "i64",
+    "fp32": "fp32",
+    "fp64": "fp64",
+    "string": "string",
+}
+
+_integer_bits = {"i8": 8, "i16": 16, "i32": 32, "i64": 64}
+
+
+def fold_function(
+    uri: str, name: str, output_type, arguments: list[stalg.Expression]
+) -> Optional[stalg.Expression.Literal]:
+    """The literal a call with only literal arguments evaluates to.
+
+    Returns None if the call can't be evaluated here, e.g. for other
+    functions, null arguments or integer overflow, which depends on the
+    engine's overflow option.
+    """
+    values = []
+    for argument in arguments:
+        literal_type = argument.literal.WhichOneof("literal_type")
+        if (
+            argument.WhichOneof("rex_type") != "literal"
+            or literal_type not in _literal_kinds.values()
+        ):
+            return None
+        values.append(getattr(argument.literal, literal_type))
+
+    function = foldable_functions.get((uri.rsplit("/", 1)[-1], name))
+    kind = _literal_kinds.get(output_type.kind)
+    if function is None or kind is None:
+        return None
+
+    result = function(*values)
+
+    if kind in _integer_bits:
+        limit = 2 ** (_integer_bits[kind] - 1)
+        if type(result) is not int or not -limit <= result < limit:
+            return None
+    elif kind in ("fp32", "fp64"):
+        if kind == "fp32":
+            result = struct.unpack("f", struct.pack("f", result))[0]
+        if not math.isfinite(result):
+            return None
+    elif type(result) is not {"boolean": bool, "string": str}[kind]:
+        return None
+
+    # the registry leaves the nullability of some return types unspecified,
+    # by default a function's result is nullable if any argument is
+    nullable = (
+        output_type.nullability == Type.NULLABILITY_NULLABLE
+        if output_type.nullability != Type.NULLABILITY_UNSPECIFIED
+        else any(a.literal.nullable for a in arguments)
+    )
+
+    return stalg.Expression.Literal(nullable=nullable, **{kind: result})
+
+
 def infer_literal_type(literal: stalg.Expression.Literal) -> Type:
     literal_type = literal.WhichOneof("literal_type")
 
@@ -162,31 +384,108 @@ def infer_rel_schema(rel: Rel) -> stt.Type.Struct:
     return apply_emit(struct, common)
 
 
-def visit(proto_object, handler):
-    handler(proto_object)
-    fields_to_visit = [
-        field
-        for field in proto_object.DESCRIPTOR.fields
-        if field.type == FieldDescriptor.TYPE_MESSAGE
-    ]
-    for field in fields_to_visit:
-        if field.label == FieldDescriptor.LABEL_REPEATED:
-            for i in proto_object.__getattribute__(field.name):
-                visit(i, handler)
-        elif proto_object.HasField(field.name):
-            visit(proto_object.__getattribute__(field.name), handler)
-
-
-def field_reference_transformer(transforms):
-    def handler(proto_object):
-        if type(proto_object) == stalg.Expression.FieldReference:
-            field = proto_object.direct_reference.struct_field.field
-            new_field = field
-
-            for t in transforms:
-                if field >= t[0][0] and field < t[0][1]:
-                    new_field = field + t[1]
+def _arguments(function) -> list:
+    return [a.value for a in function.arguments if a.HasField("value")] + list(
+        function.args
+    )
 
-            proto_object.direct_reference.struct_field.field = new_field
 
-    return handler
+def _nested(nested) -> list:
+    kind = nested.WhichOneof("nested_type")
+    if kind == "struct":
+        return list(nested.struct.fields)
+    elif kind == "list":
+        return list(nested.list.values)
+    elif kind == "map":
+        return [e for kv in nested.map.key_values for e in (kv.key, kv.value)]
+    return []
+
+
+def _subquery(subquery) -> list:
+    # the relations aren't entered, their field references point to their own input
+    kind = subquery.WhichOneof("subquery_type")
+    if kind == "in_predicate":
+        return list(subquery.in_predicate.needles)
+    elif kind == "set_comparison":
+        return [subquery.set_comparison.left]
+    return []
+
+
+def _optional(message, field) -> list:
+    return [getattr(message, field)] if message.HasField(field) else []
+
+
+# rex_type -> the expressions directly inside that kind of expression
+_nested_expressions = {
+    "literal": lambda m: [],
+    "enum": lambda m: [],
+    "selection": lambda m: _optional(m, "expression"),
+    "scalar_function": _arguments,
+    "window_function": lambda m: _arguments(m)
+    + list(m.partitions)
+    + [s.expr for s in m.sorts],
+    "if_then": lambda m: [e for c in m.ifs for e in (getattr(c, "if"), c.then)]
+    + _optional(m, "else"),
+    "switch_expression": lambda m: _optional(m, "match")
+    + [c.then for c in m.ifs]
+    + _optional(m, "else"),
+    "singular_or_list": lambda m: _optional(m, "value") + list(m.options),
+    "multi_or_list": lambda m: list(m.value) + [e for r in m.options for e in r.fields],
+    "cast": lambda m: _optional(m, "input"),
+    "subquery": _subquery,
+    "nested": _nested,
+}
+
+
+def nested_expressions(expression: stalg.Expression) -> list[stalg.Expression]:
+    """The expressions directly inside `expression`.
+
+    Only the fields that hold expressions are looked at, subqueries contribute
+    the expressions they compare but their relations aren't entered.
+    """
+    rex_type = expression.WhichOneof("rex_type")
+    if rex_type is None:
+        return []
+    elif rex_type not in _nested_expressions:
+        raise Exception(f"Unhandled rex_type {rex_type}")
+
+    return _nested_expressions[rex_type](getattr(expression, rex_type))
+
+
+def walk_expressions(expression: stalg.Expression) -> Iterator[stalg.Expression]:
+    """`expression` and every expression nested in it, parents first."""
+    stack = [expression]
+    while stack:
+        expression = stack.pop()
+        yield expression
+        stack.extend(reversed(nested_expressions(expression)))
+
+
+def shift_field_references(
+    expression: stalg.Expression, transforms: list[tuple[tuple[int, int], int]]
+) -> None:
+    """Shift the direct field references in `expression` in place.
+
+    A reference to a field in `[start, end)` is moved by `offset` for each
+    `((start, end), offset)` in `transforms`, the last match wins.
+    """
+    for e in walk_expressions(expression):
+        if e.WhichOneof("rex_type") != "selection":
+            continue
+
+        selection = e.selection
+        if selection.WhichOneof("reference_type") != "direct_reference":
+            continue
+
+        reference = selection.direct_reference
+        if reference.WhichOneof("reference_type") != "struct_field":
+            continue
+
+        field = reference.struct_field.field
+        new_field = field
+        for (start, end), offset in transforms:
+            if start <= field < end:
+                new_field = field + offset
+
+        if new_field != field:
+            reference.struct_field.field = new_field
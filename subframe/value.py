@@ -1,6 +1,19 @@
 from substrait.gen.proto import algebra_pb2 as stalg
 from substrait.gen.proto import type_pb2 as stt
-from subframe.utils import field_reference_transformer, visit
+from subframe.utils import (
+    digest,
+    fold_function,
+    function_key,
+    shift_field_references,
+    stable_digest,
+)
+from subframe.data_type import DataType, from_proto
+from subframe.extension_set import (
+    ExtensionSet,
+    empty_extensions,
+    extension_set,
+    function_extension,
+)
 
 # from .table import Table
 
@@ -27,53 +40,276 @@ def tran(offsets, new_offsets):
     return transforms
 
 
+# operator name -> (extension uri, function name, column name prefix)
+binary_functions = {
+    "add": ("functions_arithmetic.yaml", "add", "Add"),
+    "subtract": ("functions_arithmetic.yaml", "subtract", "Subtract"),
+    "equal": ("functions_comparison.yaml", "equal", "Equals"),
+    "not_equal": ("functions_comparison.yaml", "not_equal", "NotEquals"),
+    "lt": ("functions_comparison.yaml", "lt", "Less"),
+    "lte": ("functions_comparison.yaml", "lte", "LessEqual"),
+    "gt": ("functions_comparison.yaml", "gt", "Greater"),
+    "gte": ("functions_comparison.yaml", "gte", "GreaterEqual"),
+}
+
+
+def scalar_function_digest(function, argument_digests, extensions: ExtensionSet) -> str:
+    return digest(
+        "scalar_function",
+        *function_key(extensions, function.function_reference),
+        function.output_type.SerializeToString(deterministic=True),
+        *argument_digests,
+    )
+
+
+def _digested_call(expression: stalg.Expression) -> bool:
+    # calls whose digest is derived from their arguments'
+    function = expression.scalar_function
+    return (
+        expression.WhichOneof("rex_type") == "scalar_function"
+        and not function.options
+        and all(a.WhichOneof("arg_type") == "value" for a in function.arguments)
+    )
+
+
+def expression_digest(expression: stalg.Expression, extensions: ExtensionSet) -> str:
+    """Structural hash of an expression whose functions `extensions` declares.
+
+    Matches the fingerprints Values derive from their arguments.
+    """
+    digests = []
+    stack = [(expression, False)]
+    while stack:
+        (expression, expanded) = stack.pop()
+        if not _digested_call(expression):
+            digests.append(stable_digest(expression, extensions))
+        elif not expanded:
+            stack.append((expression, True))
+            stack.extend(
+                (a.value, False) for a in reversed(expression.scalar_function.arguments)
+            )
+        else:
+            count = len(expression.scalar_function.arguments)
+            arguments = digests[len(digests) - count :]
+            del digests[len(digests) - count :]
+            digests.append(
+                scalar_function_digest(
+                    expression.scalar_function, arguments, extensions
+                )
+            )
+
+    return digests[0]
+
+
+def join_name(name: str | tuple) -> str:
+    """`name` itself or, for a tuple of strings and Values, their concatenation.
+
+    Values stand for their names, which may be tuples as well. The tuples
+    are expanded with a stack, so this is linear in the length of the result.
+    """
+    if type(name) is str:
+        return name
+
+    parts = []
+    stack = [name]
+    while stack:
+        part = stack.pop()
+        if type(part) is str:
+            parts.append(part)
+        elif type(part) is tuple:
+            stack.extend(reversed(part))
+        else:
+            stack.append(part._label)
+
+    return "".join(parts)
+
+
 class Value:
+    """A column expression over the concatenated columns of `tables`.
+
+    Columns and scalar function calls are kept symbolically, a column as
+    `(table, ordinal)` and a call as its arguments, so combining Values of
+    different tables doesn't have to renumber anything. `expression` is
+    built from them on first use, with every column resolved against the
+    offsets of its table in `tables`. Other expressions (literals, window
+    functions, ...) are kept as given, relative to the tables they were
+    created with.
+
+    Names derived from other Values, like `Add(a, b)`, are kept as tuples of
+    strings and Values and only joined once they're needed, see `join_name`.
+    """
+
     def __init__(
         self,
-        expression: stalg.Expression,
-        data_type: stt.Type,
+        expression: stalg.Expression | None,
+        data_type: stt.Type | DataType,
         tables: list,
-        name: str = "",
-        extensions={},
+        name: str | tuple = "",
+        extensions: ExtensionSet = empty_extensions,
     ):
-        self.expression = expression
-        self._name = name
+        self._expression = expression
+        self._label = name
         self.tables = tables
-        self.extensions = extensions
-        self.data_type = data_type
+        self.extensions = extension_set(extensions)
+        self.dtype = from_proto(data_type)
+        # the expression as given and the tables its references are relative to
+        self._source = (expression, tables) if expression is not None else None
+        # (table, ordinal) of a column
+        self._column = None
+        # a scalar function call without its arguments and the argument values,
+        # the expression fingerprint is derived from theirs instead of
+        # serializing the whole expression
+        self._function = None
+        self._arguments = ()
+        self._offsets = None
+        self._expression_fingerprint = None
+        self._fingerprint = None
+
+    @property
+    def data_type(self) -> stt.Type:
+        return self.dtype.to_proto()
+
+    @property
+    def _name(self) -> str:
+        if type(self._label) is not str:
+            self._label = join_name(self._label)
+        return self._label
+
+    @property
+    def expression(self) -> stalg.Expression:
+        """The expression, built once and shared, so it must not be modified."""
+        if self._expression is None:
+            expression = stalg.Expression()
+            self._build(expression, self.offsets)
+            self._expression = expression
+        return self._expression
+
+    @property
+    def offsets(self) -> dict:
+        """Table -> (start, end) of its columns in `tables`."""
+        if self._offsets is None:
+            self._offsets = off(self.tables)
+        return self._offsets
+
+    def _build(self, target: stalg.Expression, offsets: dict) -> None:
+        # written in place top down, nesting copies would go through
+        # protobuf's parser which limits the depth of messages
+        stack = [(target, self)]
+        while stack:
+            (target, value) = stack.pop()
+            if value._column is not None:
+                (table, ordinal) = value._column
+                selection = target.selection
+                selection.root_reference.SetInParent()
+                selection.direct_reference.struct_field.field = (
+                    offsets[table][0] + ordinal
+                )
+            elif value._function is not None:
+                function = target.scalar_function
+                function.CopyFrom(value._function)
+                for argument in value._arguments:
+                    stack.append((function.arguments.add().value, argument))
+            else:
+                (expression, tables) = value._source
+                target.CopyFrom(expression)
+                transforms = tran(off(tables), offsets)
+                if transforms:
+                    shift_field_references(target, transforms)
+
+    def fingerprint(self) -> str:
+        """Hash of the expression, its type and the tables it references.
+
+        The name isn't part of it. Functions are hashed by extension uri and
+        signature, so fingerprints are the same in every process.
+        """
+        if self._fingerprint is None:
+            self._fingerprint = digest(
+                self._expression_digest(),
+                self.dtype.to_proto().SerializeToString(deterministic=True),
+                *[t.fingerprint() for t in self.tables],
+            )
+        return self._fingerprint
+
+    def _expression_digest(self) -> str:
+        if self._expression_fingerprint is not None:
+            return self._expression_fingerprint
+
+        # the digests of arguments are those of the expressions they're built
+        # into, they can only be reused if their tables come first here as well
+        def reusable(value):
+            return (
+                value._expression_fingerprint is not None
+                and self.tables[: len(value.tables)] == value.tables
+            )
 
-    def name(self, name: str):
-        return Value(
-            expression=self.expression,
-            data_type=self.data_type,
+        digests = {}
+        stack = [self]
+        while stack:
+            value = stack[-1]
+            if id(value) in digests:
+                stack.pop()
+                continue
+            elif reusable(value):
+                digests[id(value)] = value._expression_fingerprint
+                stack.pop()
+                continue
+
+            if value._function is not None:
+                pending = [a for a in value._arguments if id(a) not in digests]
+                if pending:
+                    stack.extend(pending)
+                    continue
+
+                result = scalar_function_digest(
+                    value._function,
+                    [digests[id(a)] for a in value._arguments],
+                    self.extensions,
+                )
+            else:
+                expression = stalg.Expression()
+                value._build(expression, self.offsets)
+                result = expression_digest(expression, self.extensions)
+
+            stack.pop()
+            digests[id(value)] = result
+            if self.tables[: len(value.tables)] == value.tables:
+                value._expression_fingerprint = result
+
+        return self._expression_fingerprint
+
+    def _with(self, name: str | tuple, tables: list) -> "Value":
+        value = Value(
+            expression=None,
+            data_type=self.dtype,
             name=name,
-            tables=self.tables,
+            tables=tables,
             extensions=self.extensions,
         )
+        value._source = self._source
+        value._column = self._column
+        value._function = self._function
+        value._arguments = self._arguments
+        return value
+
+    def name(self, name: str):
+        value = self._with(name, self.tables)
+        value._expression = self._expression
+        value._offsets = self._offsets
+        value._expression_fingerprint = self._expression_fingerprint
+        value._fingerprint = self._fingerprint
+        return value
 
     def readjust(self, new_tables):
-        offsets = off(self.tables)
-        new_offsets = off(new_tables)
-        transforms = tran(offsets, new_offsets)
-
-        if transforms:
-            new_expression = stalg.Expression()
-            new_expression.CopyFrom(self.expression)
-            visit(new_expression, field_reference_transformer(transforms))
-        else:
-            new_expression = self.expression
+        """The same expression over `new_tables`, which include all of `tables`.
 
-        return Value(
-            expression=new_expression,
-            data_type=self.data_type,
-            name=self._name,
-            tables=new_tables,
-            extensions=self.extensions,
-        )
+        Nothing is renumbered until the expression is built.
+        """
+        if new_tables == self.tables:
+            return self
 
-    def _apply_function(self, other: "Value", url: str, func: str, col_name: str):
-        from subframe import registry
+        return self._with(self._label, new_tables)
 
+    def _merge_tables(self, other: "Value"):
         new_tables = []
 
         for t in self.tables:
@@ -83,115 +319,106 @@ class Value:
             if t not in self.tables:
                 new_tables.append(t)
 
-        other = other.readjust(new_tables)
+        return (new_tables, other.readjust(new_tables))
+
+    def _literal(self) -> stalg.Expression | None:
+        if self._source is not None and self._source[0].HasField("literal"):
+            return self._source[0]
+        return None
+
+    def _apply_function(self, other: "Value", url: str, func: str, col_name: str):
+        from subframe import registry
+
+        (new_tables, other) = self._merge_tables(other)
 
-        (func_entry, rtn) = registry.lookup_function(
+        resolved = registry.resolve_function(
             url,
             function_name=func,
-            signature=[
-                self.data_type,
-                other.data_type,
-            ],
+            signature=(self.dtype, other.dtype),
         )
 
-        output_type = rtn
+        return self._apply_resolved_function(other, new_tables, resolved, col_name)
 
-        return Value(
-            expression=stalg.Expression(
-                scalar_function=stalg.Expression.ScalarFunction(
-                    function_reference=func_entry.anchor,
-                    output_type=output_type,
-                    arguments=[
-                        stalg.FunctionArgument(value=self.expression),
-                        stalg.FunctionArgument(value=other.expression),
-                    ],
-                )
-            ),
+    def _apply_resolved_function(
+        self, other: "Value", new_tables: list, resolved: tuple, col_name: str
+    ):
+        (func_entry, output_type) = resolved
+
+        literals = [self._literal(), other._literal()]
+        folded = (
+            fold_function(func_entry.uri, func_entry.name, output_type, literals)
+            if None not in literals
+            else None
+        )
+        if folded is not None:
+            return Value(
+                expression=stalg.Expression(literal=folded),
+                data_type=output_type,
+                tables=new_tables,
+                name=(f"{col_name}(", self, ", ", other, ")"),
+            )
+
+        value = Value(
+            expression=None,
             data_type=output_type,
             tables=new_tables,
-            name=f"{col_name}({self._name}, {other._name})",
-            extensions={func_entry.uri: {str(func_entry): func_entry.anchor}},
+            name=(f"{col_name}(", self, ", ", other, ")"),
+            extensions=function_extension(
+                func_entry.uri, str(func_entry), func_entry.anchor
+            ).union(self.extensions, other.extensions),
         )
+        value._function = stalg.Expression.ScalarFunction(
+            function_reference=func_entry.anchor,
+            output_type=output_type.to_proto(),
+        )
+        value._arguments = (self, other)
+        return value
 
     def __add__(self, other: "Value"):
-        return self._apply_function(
-            other=other,
-            url="functions_arithmetic.yaml",
-            func="add",
-            col_name="Add",
-        )
+        return self._apply_function(other, *binary_functions["add"])
 
     def __sub__(self, other: "Value"):
-        return self._apply_function(
-            other=other,
-            url="functions_arithmetic.yaml",
-            func="subtract",
-            col_name="Subtract",
-        )
+        return self._apply_function(other, *binary_functions["subtract"])
 
     def __eq__(self, other: "Value"):
-        return self._apply_function(
-            other=other,
-            url="functions_comparison.yaml",
-            func="equal",
-            col_name="Equals",
-        )
+        return self._apply_function(other, *binary_functions["equal"])
 
     def __ne__(self, other: "Value"):
-        return self._apply_function(
-            other=other,
-            url="functions_comparison.yaml",
-            func="not_equal",
-            col_name="NotEquals",
-        )
+        return self._apply_function(other, *binary_functions["not_equal"])
 
     def __lt__(self, other: "Value"):
-        return self._apply_function(
-            other=other, url="functions_comparison.yaml", func="lt", col_name="Less"
-        )
+        return self._apply_function(other, *binary_functions["lt"])
 
     def __le__(self, other: "Value"):
-        return self._apply_function(
-            other=other,
-            url="functions_comparison.yaml",
-            func="lte",
-            col_name="LessEqual",
-        )
+        return self._apply_function(other, *binary_functions["lte"])
 
     def __gt__(self, other: "Value"):
-        return self._apply_function(
-            other=other, url="functions_comparison.yaml", func="gt", col_name="Greater"
-        )
+        return self._apply_function(other, *binary_functions["gt"])
 
     def __ge__(self, other: "Value"):
-        return self._apply_function(
-            other=other,
-            url="functions_comparison.yaml",
-            func="gte",
-            col_name="GreaterEqual",
-        )
+        return self._apply_function(other, *binary_functions["gte"])
 
     def _apply_aggregate_function(self, url: str, func: str, col_name: str):
         from subframe import registry
 
-        (func_entry, rtn) = registry.lookup_function(
-            url, function_name=func, signature=[self.data_type]
+        (func_entry, output_type) = registry.resolve_function(
+            url, function_name=func, signature=(self.dtype,)
         )
 
-        output_type = rtn
-
         aggregate_function = stalg.AggregateFunction(
             function_reference=func_entry.anchor,
             phase=stalg.AggregationPhase.AGGREGATION_PHASE_INITIAL_TO_RESULT,  # TODO
             arguments=[stalg.FunctionArgument(value=self.expression)],
-            output_type=output_type,
+            output_type=output_type.to_proto(),
         )
 
         return AggregateValue(
             aggregate_function=aggregate_function,
             data_type=output_type,
-            extensions={func_entry.uri: {str(func_entry): func_entry.anchor}},
-            name=f"{col_name}({self._name})",
+            extensions=function_extension(
+                func_entry.uri, str(func_entry), func_entry.anchor
+            ).union(self.extensions),
+            name=(f"{col_name}(", self, ")"),
         )
 
     def max(self):
@@ -239,17 +466,12 @@ class Value:
     ):
         from subframe import registry
 
-        (func_entry, rtn) = registry.lookup_function(
+        (func_entry, output_type) = registry.resolve_function(
             url,
             function_name=func,
-            signature=[
-                self.data_type,
-                *[a.data_type for a in additional_arguments],
-            ],
+            signature=(self.dtype, *[a.dtype for a in additional_arguments]),
         )
 
-        output_type = rtn
-
         expression = stalg.Expression(
             window_function=stalg.Expression.WindowFunction(
                 function_reference=func_entry.anchor,
@@ -270,8 +492,20 @@ class Value:
         return Value(
             expression=expression,
             data_type=output_type,
-            name=f"{col_name}({self._name}, {' ,'.join([a._name for a in additional_arguments])})",
-            extensions={func_entry.uri: {str(func_entry): func_entry.anchor}},
+            name=(
+                f"{col_name}(",
+                self,
+                ", ",
+                *[
+                    part
+                    for (i, a) in enumerate(additional_arguments)
+                    for part in ((" ,", a) if i else (a,))
+                ],
+                ")",
+            ),
+            extensions=function_extension(
+                func_entry.uri, str(func_entry), func_entry.anchor
+            ).union(self.extensions, *[a.extensions for a in additional_arguments]),
             tables=self.tables,
         )
 
@@ -296,15 +530,96 @@ class Value:
         )
 
 
+def associative_call(values: list[Value], url: str, func: str, col_name: str) -> Value:
+    """`func` applied to all of `values` for an associative function like add.
+
+    It's a single call if the extension has a variadic implementation for
+    the values' types, otherwise a balanced tree of binary calls, so the
+    nesting only grows logarithmically with the number of values.
+    """
+    from subframe import registry
+
+    if not values:
+        raise Exception(f"{func} needs at least one value")
+    elif len(values) == 1:
+        return values[0]
+
+    tables = []
+    seen = set()
+    for value in values:
+        for t in value.tables:
+            if id(t) not in seen:
+                seen.add(id(t))
+                tables.append(t)
+    values = [v.readjust(tables) for v in values]
+
+    resolved = (
+        registry.resolve_function(
+            url, function_name=func, signature=tuple(v.dtype for v in values)
+        )
+        if len(values) > 2
+        else None
+    )
+    if resolved is None or not resolved[0].variadic:
+        while len(values) > 1:
+            pairs = [
+                left._apply_function(right, url, func, col_name)
+                for (left, right) in zip(values[::2], values[1::2])
+            ]
+            values = pairs + values[len(values) - len(values) % 2 :]
+        return values[0]
+
+    (func_entry, output_type) = resolved
+    value = Value(
+        expression=None,
+        data_type=output_type,
+        tables=tables,
+        name=(
+            f"{col_name}(",
+            *[
+                part
+                for (i, v) in enumerate(values)
+                for part in ((", ", v) if i else (v,))
+            ],
+            ")",
+        ),
+        extensions=function_extension(
+            func_entry.uri, str(func_entry), func_entry.anchor
+        ).union(*[v.extensions for v in values]),
+    )
+    value._function = stalg.Expression.ScalarFunction(
+        function_reference=func_entry.anchor,
+        output_type=output_type.to_proto(),
+    )
+    value._arguments = tuple(values)
+    return value
+
+
 class AggregateValue:
     def __init__(
         self,
         aggregate_function: stalg.AggregateFunction,
-        data_type: stt.Type,
-        name: str,
-        extensions={},
+        data_type: stt.Type | DataType,
+        name: str | tuple,
+        extensions: ExtensionSet = empty_extensions,
     ) -> None:
         self.aggregate_function = aggregate_function
-        self.data_type = data_type
-        self.name = name
-        self.extensions = extensions
+        self.dtype = from_proto(data_type)
+        self._label = name
+        self.extensions = extension_set(extensions)
+        self._fingerprint = None
+
+    @property
+    def name(self) -> str:
+        if type(self._label) is not str:
+            self._label = join_name(self._label)
+        return self._label
+
+    @property
+    def data_type(self) -> stt.Type:
+        return self.dtype.to_proto()
+
+    def fingerprint(self) -> str:
+        if self._fingerprint is None:
+            self._fingerprint = stable_digest(self.aggregate_function, self.extensions)
+        return self._fingerprint
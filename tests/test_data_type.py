@@ -0,0 +1,50 @@
+import pickle
+
+from substrait.gen.proto.type_pb2 import Type
+from subframe.data_type import data_type, from_proto
+
+nullable = Type.NULLABILITY_NULLABLE
+
+
+def test_equal_types_are_interned():
+    assert from_proto(Type(i64=Type.I64(nullability=nullable))) is from_proto(
+        Type(i64=Type.I64(nullability=nullable))
+    )
+    assert from_proto(Type(i64=Type.I64())) is not from_proto(
+        Type(i64=Type.I64(nullability=nullable))
+    )
+    assert from_proto(Type(decimal=Type.Decimal(precision=10, scale=2))) is data_type(
+        "decimal", parameters=(10, 2)
+    )
+
+
+def test_proto_roundtrip():
+    types = [
+        Type(),
+        Type(bool=Type.Boolean(nullability=nullable)),
+        Type(string=Type.String(type_variation_reference=1)),
+        Type(decimal=Type.Decimal(precision=38, scale=4, nullability=nullable)),
+        Type(interval_day=Type.IntervalDay()),
+        Type(interval_day=Type.IntervalDay(precision=3)),
+        Type(varchar=Type.VarChar(length=20)),
+        Type(list=Type.List(type=Type(i32=Type.I32()))),
+        Type(
+            map=Type.Map(key=Type(string=Type.String()), value=Type(fp64=Type.FP64()))
+        ),
+        Type(
+            struct=Type.Struct(
+                types=[Type(i8=Type.I8()), Type(date=Type.Date())],
+                nullability=nullable,
+            )
+        ),
+        Type(user_defined_type_reference=4),
+    ]
+
+    for t in types:
+        assert from_proto(t).to_proto() == t
+
+
+def test_pickle_keeps_interning():
+    dtype = data_type("decimal", nullable, (10, 2))
+
+    assert pickle.loads(pickle.dumps(dtype)) is dtype
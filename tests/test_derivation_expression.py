@@ -1,5 +1,10 @@
 from substrait.gen.proto.type_pb2 import Type
-from subframe.derivation_expression import evaluate
+from subframe.derivation_expression import (
+    _compile_simple,
+    _parse,
+    compile_expression,
+    evaluate,
+)
 
 
 def test_simple_arithmetic():
@@ -83,3 +88,54 @@ DECIMAL<prec, scale>""",
         )
         == func_eval
     )
+
+
+def test_compiled_expression_is_reused():
+    expression = "decimal<P + 1, S + 1>"
+
+    compiled = compile_expression(expression)
+
+    assert compile_expression(expression) is compiled
+    assert compiled({"S": 10, "P": 20}).to_proto() == Type(
+        decimal=Type.Decimal(precision=21, scale=11)
+    )
+    assert compiled({"S": 1, "P": 2}).to_proto() == Type(
+        decimal=Type.Decimal(precision=3, scale=2)
+    )
+
+
+def test_literal_decimal_parameters():
+    assert evaluate("DECIMAL<38, S>", {"S": 2}) == Type(
+        decimal=Type.Decimal(precision=38, scale=2)
+    )
+
+
+def test_less_equal():
+    assert evaluate("var <= 3 ? 1 : 0", {"var": 3}) == 1
+
+
+def test_simple_types_skip_the_parser():
+    values = {"P": 10, "S": 2, "any1": Type(i16=Type.I16())}
+
+    for expression in [
+        "i64",
+        "boolean?",
+        "fp64",
+        "any1",
+        "DECIMAL?<P, S>",
+        "decimal<38,0>",
+    ]:
+        assert _compile_simple(expression) is not None
+        assert _compile_simple(expression)(values) == _parse(expression)(values)
+
+
+def test_simple_parameterized_types():
+    assert evaluate("varchar<L1>", {"L1": 5}) == Type(varchar=Type.VarChar(length=5))
+    assert evaluate("precision_timestamp?<P>", {"P": 6}) == Type(
+        precision_timestamp=Type.PrecisionTimestamp(precision=6)
+    )
+
+
+def test_complex_types_need_the_parser():
+    for expression in ["decimal<P + 1, S>", "List<string>", "var > 3 ? 1 : 0", "any"]:
+        assert _compile_simple(expression) is None
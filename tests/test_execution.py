@@ -3,6 +3,7 @@ import pyarrow.compute as pc
 import pytest
 import ibis
 import subframe
+from subframe.optimizer import optimize
 import tempfile
 import os
 from ibis_substrait.compiler.core import SubstraitCompiler
@@ -622,3 +623,128 @@ def test_lead_lag(consumer, request):
     sf_expr = transform(subframe)
 
     run_parity_test(request.getfixturevalue(consumer), ibis_expr, sf_expr)
+
+
+@pytest.mark.parametrize(
+    "consumer", ["acero_consumer", "datafusion_consumer", "duckdb_consumer"]
+)
+def test_optimized_filters_and_projections(consumer, request):
+
+    def transform(module):
+        table = _orders(module)
+        table = table.filter(table["order_id"] > table["fk_store_id"])
+        table = table.filter(table["fk_customer_id"] > table["order_id"])
+        table = table.select(
+            "order_id", total=table["fk_store_id"] + table["fk_customer_id"]
+        )
+        return table.select("order_id", ids=table["order_id"] - table["total"])
+
+    ibis_expr = transform(ibis)
+    # acero doesn't support ReadRel.projection
+    sf_expr = optimize(
+        transform(subframe), read_projection=consumer != "acero_consumer"
+    )
+
+    assert sf_expr.rel.project.input.HasField("filter")
+
+    run_parity_test(request.getfixturevalue(consumer), ibis_expr, sf_expr)
+
+
+@pytest.mark.parametrize(
+    "consumer",
+    [
+        "acero_consumer",
+        "datafusion_consumer",
+        pytest.param(
+            "duckdb_consumer",
+            marks=[pytest.mark.xfail(Exception, reason="Unimplemented")],
+        ),
+    ],
+)
+def test_optimized_filter_over_join(consumer, request):
+
+    def transform(module):
+        t1 = _orders(module)
+        t2 = _stores(module)
+        joined = t1.join(t2, predicates=[t1["fk_store_id"] == t2["store_id"]])
+        return joined.filter(joined["order_id"] > joined["fk_store_id"]).filter(
+            joined["store_id"] > module.literal(1, type="int64")
+        )
+
+    ibis_expr = transform(ibis)
+    sf_expr = optimize(
+        transform(subframe), read_projection=consumer != "acero_consumer"
+    )
+
+    assert sf_expr.rel.join.left.HasField("filter")
+    assert sf_expr.rel.join.right.HasField("filter")
+
+    run_parity_test(request.getfixturevalue(consumer), ibis_expr, sf_expr)
+
+
+@pytest.mark.parametrize(
+    "consumer", ["acero_consumer", "datafusion_consumer", "duckdb_consumer"]
+)
+def test_optimized_common_subexpressions(consumer, request):
+
+    def transform(module):
+        table = _orders(module)
+        table = table.filter(
+            table["order_id"] + table["fk_store_id"]
+            > table["fk_store_id"] + table["fk_store_id"]
+        )
+        ids = table["order_id"] + table["fk_store_id"]
+        return table.select(
+            plus=ids + table["fk_customer_id"],
+            minus=ids - table["fk_customer_id"],
+        )
+
+    ibis_expr = transform(ibis)
+    sf_expr = optimize(
+        transform(subframe), read_projection=consumer != "acero_consumer"
+    )
+
+    run_parity_test(request.getfixturevalue(consumer), ibis_expr, sf_expr)
+
+
+@pytest.mark.parametrize(
+    "consumer",
+    [
+        pytest.param(
+            "acero_consumer",
+            marks=[pytest.mark.xfail(Exception, reason="Binary and/or kernels only")],
+        ),
+        "datafusion_consumer",
+        "duckdb_consumer",
+    ],
+)
+def test_associative_helpers(consumer, request):
+
+    def transform(module):
+        table = _orders(module)
+        ids = [table["order_id"], table["fk_store_id"], table["fk_customer_id"]]
+        above = [
+            table["order_id"] > table["fk_store_id"],
+            table["fk_customer_id"] > table["order_id"],
+        ]
+        below = [
+            table["order_id"] < table["fk_store_id"],
+            table["fk_customer_id"] < table["order_id"],
+            table["order_id"] == table["fk_store_id"],
+        ]
+        if module is subframe:
+            (total, all_above, any_below) = (
+                subframe.sum_of(ids),
+                subframe.all_of(above),
+                subframe.any_of(below),
+            )
+        else:
+            total = ids[0] + ids[1] + ids[2]
+            all_above = above[0] & above[1]
+            any_below = below[0] | below[1] | below[2]
+
+        return table.filter(all_above).select(total=total, any_below=any_below)
+
+    run_parity_test(
+        request.getfixturevalue(consumer), transform(ibis), transform(subframe)
+    )
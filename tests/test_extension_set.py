@@ -0,0 +1,62 @@
+import subframe
+from subframe.extension_set import (
+    empty_extensions,
+    extension_set,
+    function_extension,
+)
+
+
+def test_functions_are_interned():
+    assert function_extension("a.yaml", "f:i64", 1) is function_extension(
+        "a.yaml", "f:i64", 1
+    )
+    assert extension_set({"a.yaml": {"f:i64": 1}}) is function_extension(
+        "a.yaml", "f:i64", 1
+    )
+    assert extension_set({}) is empty_extensions
+
+
+def test_union():
+    f = function_extension("a.yaml", "f:i64", 1)
+    g = function_extension("a.yaml", "g:i64", 2)
+    h = function_extension("b.yaml", "h:i64", 3)
+
+    assert f.union(empty_extensions) is f
+    assert f.union(f) is f
+
+    fg = f.union(g)
+    fgh = fg.union(h, f)
+
+    assert dict(fg) == {"a.yaml": {"f:i64": 1, "g:i64": 2}}
+    assert {uri: dict(declared) for uri, declared in fgh.items()} == {
+        "a.yaml": {"f:i64": 1, "g:i64": 2},
+        "b.yaml": {"h:i64": 3},
+    }
+    # operands aren't changed
+    assert dict(f) == {"a.yaml": {"f:i64": 1}}
+    assert dict(fg) == {"a.yaml": {"f:i64": 1, "g:i64": 2}}
+
+
+def test_function_by_anchor():
+    fgh = function_extension("a.yaml", "f:i64", 1).union(
+        function_extension("b.yaml", "h:i64", 3)
+    )
+
+    assert fgh.function(3) == ("b.yaml", "h:i64")
+    assert fgh.function(2) is None
+    assert empty_extensions.function(1) is None
+
+
+def test_sibling_tables():
+    t = subframe.table([("a", "int64"), ("b", "int64")], name="t")
+
+    added = t.select(c=t["a"] + t["b"])
+    compared = t.filter((t["a"] - t["b"]) == (t["b"] - t["a"]))
+
+    def names(table):
+        return [e.extension_function.name for e in table.to_substrait().extensions]
+
+    assert len(t.extensions) == 0
+    assert names(added) == ["add:i64_i64"]
+    # the arguments' functions are declared as well
+    assert names(compared) == ["equal:any_any", "subtract:i64_i64"]
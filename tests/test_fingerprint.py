@@ -0,0 +1,119 @@
+import subprocess
+import sys
+
+import subframe
+from subframe.value import expression_digest
+
+
+def orders():
+    return subframe.table([("a", "int64"), ("b", "int64")], name="orders")
+
+
+def test_equal_tables():
+    def build():
+        t = orders()
+        return t.filter(t["a"] > t["b"]).select(c=t["a"] + t["b"]).limit(10, 0)
+
+    assert build().fingerprint() == build().fingerprint()
+
+
+def test_different_tables():
+    t = orders()
+    filtered = t.filter(t["a"] > t["b"])
+
+    fingerprints = {
+        filtered.fingerprint(),
+        t.filter(t["a"] < t["b"]).fingerprint(),
+        filtered.limit(10, 0).fingerprint(),
+        filtered.select("a").fingerprint(),
+        filtered.select(c=filtered["a"]).fingerprint(),
+        subframe.table([("a", "int64")], name="other").fingerprint(),
+    }
+
+    assert len(fingerprints) == 6
+
+
+def test_values():
+    t = orders()
+    u = subframe.table([("a", "int64"), ("b", "int64")], name="other")
+
+    value = t["a"] + t["b"]
+
+    assert value.fingerprint() == (t["a"] + t["b"]).fingerprint()
+    assert value.fingerprint() == value.name("c").fingerprint()
+    assert value.fingerprint() != (t["b"] + t["a"]).fingerprint()
+    assert value.fingerprint() != (u["a"] + u["b"]).fingerprint()
+    assert value._expression_digest() == expression_digest(
+        value.expression, value.extensions
+    )
+
+
+def test_values_of_several_tables():
+    t = orders()
+    u = subframe.table([("c", "int64")], name="other")
+
+    inner = t["a"] + t["b"]
+    inner._expression_digest()
+    # inner's columns come after u's here
+    value = u["c"] + inner
+
+    assert value._expression_digest() == expression_digest(
+        value.expression, value.extensions
+    )
+    assert inner._expression_digest() == expression_digest(
+        inner.expression, inner.extensions
+    )
+    assert value.fingerprint() != (inner + u["c"]).fingerprint()
+
+
+def test_shared_subtrees():
+    t = orders()
+    filtered = t.filter(t["a"] > t["b"])
+    joined = filtered.cross_join(t.filter(t["a"] > t["b"]))
+
+    (left, right) = [child for (_, child) in joined.node.inputs]
+    assert left.key() == right.key()
+    assert left.key() != joined.node.key()
+    assert left.fingerprint(joined.extensions) == right.fingerprint(joined.extensions)
+
+
+def test_deep_pipeline():
+    t = orders()
+    for _ in range(2000):
+        t = t.filter(t["a"] > t["b"])
+
+    assert len(t.fingerprint()) == 64
+
+
+# Prints the fingerprints of a table and a value, loading every extension
+# first if asked to, which hands out different function anchors
+script = """
+import sys
+import subframe
+
+if sys.argv[1:] == ["preload"]:
+    subframe.registry.preload()
+
+t = subframe.table([("a", "int64"), ("b", "int64")], name="orders")
+value = t["a"] + t["b"]
+table = t.filter(t["a"] > t["b"]).group_by("a").agg(value.max())
+anchors = [e.extension_function.function_anchor for e in table.to_substrait().extensions]
+print(anchors, table.fingerprint(), value.fingerprint())
+"""
+
+
+def test_same_in_every_process():
+    def run(*args):
+        result = subprocess.run(
+            [sys.executable, "-c", script, *args],
+            capture_output=True,
+            text=True,
+            check=True,
+        )
+        return result.stdout.split("]")
+
+    (lazy_anchors, lazy) = run()
+    (preloaded_anchors, preloaded) = run("preload")
+
+    assert lazy_anchors != preloaded_anchors
+    assert lazy == preloaded
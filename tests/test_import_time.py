@@ -0,0 +1,40 @@
+import subprocess
+import sys
+
+# Builds a plan that only needs simple return types, none of these should be
+# imported along the way
+script = """
+import subframe
+
+orders = subframe.table([("a", "int64"), ("b", "int64")], name="orders")
+orders.select(orders["a"] + orders["b"], orders["a"] > orders["b"]).to_substrait()
+"""
+
+
+def _imported_modules(code: str) -> list[str]:
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    return [
+        line.split("|")[-1].strip()
+        for line in result.stderr.splitlines()
+        if line.startswith("import time:")
+    ]
+
+
+def test_cold_start_skips_type_parser():
+    modules = _imported_modules(script)
+
+    assert "subframe" in modules
+    assert not [m for m in modules if m.startswith(("antlr4", "subframe.gen"))]
+
+
+def test_type_parser_loads_on_demand():
+    modules = _imported_modules(
+        "from subframe.derivation_expression import evaluate; evaluate('1 + 1')"
+    )
+
+    assert "subframe.gen.SubstraitTypeParser" in modules
@@ -0,0 +1,396 @@
+from substrait.gen.proto import algebra_pb2 as stalg
+
+import subframe
+from subframe.optimizer import (
+    conjuncts,
+    field,
+    field_index,
+    is_trivial,
+    optimize,
+    referenced_fields,
+)
+from subframe.utils import shift_field_references
+
+t = subframe.table([("a", "int64"), ("b", "int64"), ("c", "int64")], name="t")
+
+
+def scan(rel):
+    """The read without the filter conditions pushed into it."""
+    rel = type(rel)(read=rel.read)
+    rel.read.ClearField("best_effort_filter")
+    return rel
+
+
+def test_fuse_projections():
+    inner = t.select(d=t["a"] + t["b"], c="c")
+    outer = inner.select(e=inner["d"] + inner["c"], c="c")
+
+    expected = t.select(e=(t["a"] + t["b"]) + t["c"], c="c")
+
+    assert optimize(outer).rel == expected.rel
+
+
+def test_fuse_projections_keeps_shared_columns():
+    inner = t.select(d=t["a"] + t["b"], c="c")
+    outer = inner.select(e=inner["d"] + inner["c"], d="d")
+
+    assert optimize(outer).rel == outer.rel
+
+
+def test_merge_filters():
+    predicates = [t["a"] > t["b"], t["b"] > t["c"], t["a"] > t["c"]]
+    filtered = t
+    for p in predicates:
+        filtered = filtered.filter(p)
+
+    optimized = optimize(filtered)
+    condition = optimized.rel.filter.condition
+    anchor = condition.scalar_function.function_reference
+
+    assert scan(optimized.rel.filter.input) == t.rel
+    assert optimized.rel.filter.input.read.best_effort_filter == condition
+    assert len(condition.scalar_function.arguments) == 2
+    assert conjuncts(condition, anchor) == [p.expression for p in predicates]
+
+    plan = optimized.to_substrait()
+    assert "and:bool" in [e.extension_function.name for e in plan.extensions]
+
+
+def test_push_limit_through_project():
+    projected = t.select("a", d=t["b"] + t["c"]).limit(5, 2)
+
+    expected = t.limit(5, 2).select("a", d=t["b"] + t["c"])
+
+    assert optimize(projected).rel == expected.rel
+
+
+def test_keep_limit_above_window_functions():
+    projected = t.select("a", r=subframe.row_number()).limit(5, 0)
+
+    assert optimize(projected).rel.WhichOneof("rel_type") == "fetch"
+
+
+def test_push_limit_into_union_all():
+    union = t.union(t.filter(t["a"] > t["b"]), distinct=False).limit(5, 2)
+
+    rel = optimize(union).rel
+
+    assert (rel.fetch.offset, rel.fetch.count) == (2, 5)
+    (first, second) = [i.fetch for i in rel.fetch.input.set.inputs]
+    for branch in (first, second):
+        assert (branch.offset, branch.count) == (0, 7)
+    assert first.input == t.rel
+    assert second.input.filter.condition == (t["a"] > t["b"]).expression
+    assert scan(second.input.filter.input) == t.rel
+
+    # already limited inputs stay as they are
+    assert optimize(optimize(union)).rel == rel
+
+
+def test_keep_limit_above_union_distinct():
+    union = t.union(t, distinct=True).limit(5, 0)
+
+    assert optimize(union).rel == union.rel
+
+
+def test_to_substrait_optimize():
+    filtered = t.filter(t["a"] > t["b"]).filter(t["b"] > t["c"])
+
+    assert filtered.to_substrait(optimize=True) == optimize(filtered).to_substrait()
+    assert filtered.to_substrait(optimize=True) is filtered.to_substrait(optimize=True)
+    assert filtered.to_substrait() != filtered.to_substrait(optimize=True)
+
+
+def test_long_pipeline():
+    table = t
+    for _ in range(500):
+        table = table.filter(table["a"] > table["b"])
+    for _ in range(500):
+        table = table.select("a", "b", "c")
+
+    rel = optimize(table).rel
+
+    assert [field_index(e) for e in rel.project.expressions] == [0, 1, 2]
+    condition = rel.project.input.filter.condition
+    assert (
+        len(conjuncts(condition, condition.scalar_function.function_reference)) == 500
+    )
+    assert scan(rel.project.input.filter.input) == t.rel
+
+
+def read_columns(rel):
+    return [i.field for i in rel.read.projection.select.struct_items]
+
+
+def test_prune_read():
+    wide = subframe.table([(f"c{i}", "int64") for i in range(200)], name="wide")
+    query = wide.filter(wide["c7"] > wide["c3"]).select(s=wide["c150"] + wide["c7"])
+
+    rel = optimize(query).rel
+    read = rel.project.input.filter.input
+
+    assert read_columns(read) == [3, 7, 150]
+    assert (
+        rel.project.input.filter.condition == (t["b"] > t["a"]).expression
+    )  # c7 and c3 are now columns 1 and 0
+    assert list(rel.project.common.emit.output_mapping) == [3]
+    assert rel.project.expressions[0] == (t["c"] + t["b"]).expression
+
+
+def test_prune_read_with_filter():
+    wide = subframe.table([(c, "int64") for c in "abcd"], name="wide")
+    query = wide.filter(wide["d"] > wide["c"]).select("d")
+
+    read = optimize(query).rel.project.input.filter.input
+
+    assert read_columns(read) == [2, 3]
+    # the pushed down condition refers to the projected columns
+    assert read.read.best_effort_filter == (t["b"] > t["a"]).expression
+
+
+def test_prune_keeps_used_columns():
+    query = t.select(s=t["a"] + t["b"], c="c")
+
+    assert optimize(query).rel == query.rel
+
+
+def test_prune_join():
+    u = subframe.table([("x", "int64"), ("y", "int64"), ("z", "int64")], name="u")
+    query = t.join(u, [t["a"] == u["x"]]).select("c", "z")
+
+    rel = optimize(query).rel
+    join = rel.project.input.join
+
+    assert read_columns(join.left) == [0, 2]
+    assert read_columns(join.right) == [0, 2]
+    assert sorted(referenced_fields(join.expression)) == [0, 2]
+    assert [field_index(e) for e in rel.project.expressions] == [1, 3]
+
+
+def test_prune_union_all():
+    other = subframe.table([("a", "int64"), ("b", "int64"), ("c", "int64")], name="t")
+    query = t.union(other.filter(other["b"] > other["c"]), distinct=False).select("a")
+
+    rel = optimize(query).rel
+    (first, second) = rel.project.input.set.inputs
+
+    assert read_columns(first) == [0]
+    assert scan(second.project.input.filter.input) == other.rel
+    assert [field_index(e) for e in second.project.expressions] == [0]
+
+
+def test_prune_union_of_joins():
+    u = subframe.table([("x", "int64"), ("y", "int64")], name="u")
+    projected = t.select("a", "b")
+    joined = projected.join(u, [projected["a"] == u["x"]])
+    query = joined.union(joined, distinct=False)
+
+    rel = optimize(query).rel
+
+    for branch in rel.set.inputs:
+        assert read_columns(branch.join.left.project.input) == [0, 1]
+        assert [field_index(e) for e in branch.join.left.project.expressions] == [
+            0,
+            1,
+        ]
+        assert not branch.join.right.read.HasField("projection")
+    assert optimize(query).to_substrait().relations[0].root.names == [
+        "a",
+        "b",
+        "x",
+        "y",
+    ]
+
+
+def test_keep_columns_of_union_distinct():
+    query = t.union(t, distinct=True).select("a")
+
+    rel = optimize(query).rel
+
+    assert [i.read == t.rel.read for i in rel.project.input.set.inputs] == [True] * 2
+
+
+def test_prune_aggregate_input():
+    query = t.group_by("b").agg(t["a"].max())
+
+    rel = optimize(query).rel
+
+    assert read_columns(rel.aggregate.input) == [0, 1]
+
+
+def test_prune_shared_input():
+    wide = subframe.table([(c, "int64") for c in "abcd"], name="wide")
+    filtered = wide.filter(wide["a"] > wide["a"])
+    query = filtered.select("b").union(filtered.select("c"), distinct=False)
+
+    rel = optimize(query).rel
+    (first, second) = rel.set.inputs
+
+    assert read_columns(first.project.input.filter.input) == [0, 1, 2]
+    assert first.project.input == second.project.input
+
+
+def test_prune_without_read_projection():
+    query = t.select("c")
+
+    rel = optimize(query, read_projection=False).rel
+
+    assert [field_index(e) for e in rel.project.expressions] == [0]
+    assert [field_index(e) for e in rel.project.input.project.expressions] == [2]
+    assert rel.project.input.project.input == t.rel
+
+
+def test_push_filter_through_project():
+    projected = t.select("a", "b", s=t["a"] + t["c"], d=t["b"] + t["c"])
+    query = projected.filter(projected["b"] > projected["a"]).filter(
+        projected["s"] > projected["d"]
+    )
+
+    rel = optimize(query).rel
+
+    # only the condition on computed columns stays above the projection
+    assert rel.filter.condition == (projected["s"] > projected["d"]).expression
+    assert rel.filter.input.project.input.filter.condition == (
+        (t["b"] > t["a"]).expression
+    )
+
+
+def test_push_filter_into_join():
+    u = subframe.table([("x", "int64"), ("y", "int64")], name="u")
+    joined = t.join(u, [t["a"] == u["x"]])
+    query = (
+        joined.filter(joined["b"] > joined["c"])
+        .filter(joined["y"] > joined["x"])
+        .filter(joined["a"] > joined["y"])
+    )
+
+    rel = optimize(query).rel
+
+    assert rel.filter.condition == query.rel.filter.condition
+    join = rel.filter.input.join
+    assert join.left.filter.condition == (t["b"] > t["c"]).expression
+    assert join.right.filter.condition == (u["y"] > u["x"]).expression
+
+
+def test_push_filter_into_left_join():
+    u = subframe.table([("x", "int64"), ("y", "int64")], name="u")
+    joined = t.join(u, [t["a"] == u["x"]], how="left")
+    query = joined.filter(joined["b"] > joined["c"]).filter(joined["y"] > joined["x"])
+
+    rel = optimize(query).rel
+    join = rel.filter.input.join
+
+    assert rel.filter.condition == (joined["y"] > joined["x"]).expression
+    assert join.left.filter.condition == (t["b"] > t["c"]).expression
+    assert join.right.WhichOneof("rel_type") == "read"
+
+
+def test_push_filter_into_union():
+    query = t.union(t, distinct=True)
+    query = query.filter(query["a"] > query["b"])
+
+    rel = optimize(query).rel
+
+    for branch in rel.set.inputs:
+        assert branch.filter.condition == (t["a"] > t["b"]).expression
+        assert scan(branch.filter.input) == t.rel
+
+
+def test_fold_filter():
+    assert optimize(t.filter(subframe.literal(True))).rel == t.rel
+
+    one = subframe.literal(1, type="int64")
+    query = t.filter(t["a"] > t["b"]).filter(one == one)
+    rel = optimize(query).rel
+
+    assert rel.filter.condition == (t["a"] > t["b"]).expression
+
+
+def test_fold_pushed_down_literals():
+    projected = t.select("a", one=subframe.literal(1, type="int64"))
+    query = projected.filter(projected["one"] > subframe.literal(2, type="int64"))
+
+    rel = optimize(query).rel
+    condition = rel.project.input.filter.condition
+
+    assert condition.literal.boolean is False
+
+
+def test_eliminate_common_subexpressions():
+    total = t["a"] + t["b"]
+    query = t.select(x=total + t["c"], y=total - t["c"], total=total)
+
+    rel = optimize(query).rel
+    (inner, outer) = (rel.project.input.project, rel.project)
+
+    assert inner.expressions[-1] == total.expression
+    assert all(is_trivial(e) for e in inner.expressions[:-1])
+    # computed once, by the last column of the inner projection
+    hoisted = len(inner.common.emit.output_mapping) - 1
+    assert [hoisted in referenced_fields(e) for e in outer.expressions] == [True] * 3
+
+
+def test_eliminate_common_subexpressions_with_filter():
+    total = t["a"] + t["b"]
+    filtered = t.filter(total > t["b"] + t["c"])
+    query = filtered.select(x=total + t["c"])
+
+    rel = optimize(query).rel
+    filter_rel = rel.project.input.filter
+    inner = filter_rel.input.project
+
+    assert inner.expressions[-1] == total.expression
+    assert all(is_trivial(e) for e in inner.expressions[:-1])
+    hoisted = len(inner.common.emit.output_mapping) - 1
+    assert hoisted in referenced_fields(filter_rel.condition)
+    assert hoisted in referenced_fields(rel.project.expressions[0])
+
+
+def test_keep_views():
+    view = t.filter(t["a"] > t["b"]).view()
+    query = view.select("c")
+
+    plan = optimize(query).to_substrait()
+    (shared, root) = plan.relations
+
+    assert shared.rel.filter.condition == (t["a"] > t["b"]).expression
+    assert scan(shared.rel.filter.input) == t.rel
+    assert root.root.input.project.input.reference.subtree_ordinal == 0
+
+
+def nested_references() -> stalg.Expression:
+    # if f0 then cast(f1) else f2 in (subquery over its own f5)
+    haystack = stalg.Rel(
+        filter=stalg.FilterRel(input=t.rel, condition=field(5)),
+    )
+    in_predicate = stalg.Expression(
+        subquery=stalg.Expression.Subquery(
+            in_predicate=stalg.Expression.Subquery.InPredicate(
+                needles=[field(2)], haystack=haystack
+            )
+        )
+    )
+    return stalg.Expression(
+        if_then=stalg.Expression.IfThen(
+            ifs=[
+                stalg.Expression.IfThen.IfClause(
+                    **{"if": field(0)},
+                    then=stalg.Expression(cast=stalg.Expression.Cast(input=field(1))),
+                )
+            ],
+            **{"else": in_predicate},
+        )
+    )
+
+
+def test_referenced_fields_skip_subquery_relations():
+    assert referenced_fields(nested_references()) == {0, 1, 2}
+
+
+def test_shift_field_references():
+    expression = nested_references()
+    shift_field_references(expression, [((1, 3), 10)])
+
+    assert referenced_fields(expression) == {0, 11, 12}
+    in_predicate = getattr(expression.if_then, "else").subquery.in_predicate
+    assert field_index(in_predicate.haystack.filter.condition) == 5
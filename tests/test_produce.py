@@ -1,5 +1,8 @@
+import pytest
 import subframe
 from substrait.json import dump_json
+from subframe.optimizer import referenced_fields
+from subframe.utils import walk_expressions
 
 data = subframe.table(
     [("a", "int64")],
@@ -97,3 +100,232 @@ def test_cte():
   }
 }"""
     assert out == expected
+
+
+def test_binary_op_matches_operators():
+    table = subframe.table([("a", "int64"), ("b", "int64"), ("c", "int64")], name="t")
+
+    expected = table.select(
+        table["a"] + table["b"], table["b"] + table["c"], table["a"] > table["c"]
+    )
+
+    actual = table.select(
+        *table.binary_op("add", [("a", "b"), ("b", table["c"])]),
+        *table.binary_op("gt", [(table["a"], "c")]),
+    )
+
+    assert actual.names == expected.names
+    assert actual.to_substrait() == expected.to_substrait()
+
+
+def test_long_pipeline():
+    table = subframe.table([("a", "int64"), ("b", "int64")], name="t")
+    for _ in range(500):
+        table = table.filter(table["a"] > table["b"]).select("a", "b")
+
+    rel = table.to_substrait().relations[0].root.input
+    depth = 0
+    while rel.WhichOneof("rel_type") != "read":
+        rel = getattr(rel, rel.WhichOneof("rel_type")).input
+        depth += 1
+
+    assert depth == 1000
+    assert rel.read.named_table.names == ["t"]
+
+
+def test_shared_input():
+    filtered = data.filter(data["a"] > data["a"])
+    joined = filtered.cross_join(filtered).union(filtered.cross_join(filtered))
+
+    rel = joined.to_substrait().relations[0].root.input
+
+    assert len(rel.set.inputs) == 2
+    for side in (rel.set.inputs[0].cross.left, rel.set.inputs[1].cross.right):
+        assert side == filtered.rel
+
+
+def test_plan_is_memoized():
+    table = data.select(data["a"] + data["a"])
+
+    assert table.to_substrait() is table.to_substrait()
+    assert table.to_substrait_bytes() is table.to_substrait_bytes()
+    assert table.to_substrait_bytes() == table.to_substrait().SerializeToString()
+
+
+def test_plan_bytes():
+    filtered = data.filter(data["a"] > data["a"])
+    tables = [
+        filtered.select(b=data["a"] + data["a"]).limit(5, 1),
+        filtered.cross_join(filtered).union(ref.view(), filtered.view()),
+        data.join(ref, [data["a"] == ref["a"]]).order_by("a"),
+    ]
+
+    for table in tables:
+        for ctes in (False, True):
+            for optimize in (False, True):
+                plan = table.to_substrait(optimize=optimize, ctes=ctes)
+                assert (
+                    table.to_substrait_bytes(optimize=optimize, ctes=ctes)
+                    == plan.SerializeToString()
+                )
+
+
+def test_plan_bytes_lift_cached_subtrees():
+    filtered = data.filter(data["a"] > data["a"])
+    query = filtered.union(filtered, distinct=False)
+
+    # the inlined bytes cached by the first call aren't used with ctes
+    assert query.to_substrait_bytes() == query.to_substrait().SerializeToString()
+    assert (
+        query.to_substrait_bytes(ctes=True)
+        == query.to_substrait(ctes=True).SerializeToString()
+    )
+
+
+def test_plan_bytes_reuse_subtrees():
+    base = data.union(ref, distinct=False)
+    base_bytes = base.node.serialize()
+    assert base.node.serialize() is base_bytes
+
+    # the base isn't looked into again
+    base.node._fields = None
+    query = base.filter(base["a"] > base["a"]).limit(10, 0)
+    assert base_bytes in query.to_substrait_bytes()
+    assert base.node._fields is None
+    assert query.to_substrait_bytes() == query.to_substrait().SerializeToString()
+
+
+def test_column_index():
+    table = subframe.table([("a", "int64"), ("b", "int64"), ("a", "int64")], name="t")
+    filtered = table.filter(table["a"] > table["b"]).limit(10, 0)
+
+    assert table.ordinals == {"a": 0, "b": 1}
+    assert filtered.ordinals is table.ordinals
+    assert filtered["b"].expression == table["b"].expression
+
+    with pytest.raises(ValueError):
+        table["c"]
+
+
+def test_columns_of_several_tables():
+    u = subframe.table([("b", "int64"), ("c", "int64")], name="u")
+
+    inner = u["b"] + u["c"]
+    outer = (u["c"] + data["a"]) + (data["a"] + inner)
+
+    def fields(value):
+        return [
+            e.selection.direct_reference.struct_field.field
+            for e in walk_expressions(value.expression)
+            if e.HasField("selection")
+        ]
+
+    # u comes first in outer, data after it
+    assert fields(inner) == [0, 1]
+    assert fields(outer) == [1, 2, 2, 0, 1]
+
+    joined = data.join(u, [data["a"] == u["c"]])
+    assert fields(joined["c"]) == [2]
+    assert referenced_fields(joined.rel.join.expression) == {0, 2}
+
+
+def test_deep_names():
+    table = subframe.table([("a", "int64"), ("b", "int64")], name="t")
+    value = table["a"]
+    values = []
+    for _ in range(5000):
+        value = value + table["b"]
+        values.append(value)
+
+    assert values[1]._name == "Add(Add(a, b), b)"
+    assert value._name == "Add(" * 5000 + "a" + ", b)" * 5000
+    # intermediate names aren't built along the way
+    assert type(values[-2]._label) is tuple
+    assert values[1].max().name == "Max(Add(Add(a, b), b))"
+
+
+def test_associative_helpers():
+    table = subframe.table([(f"c{i}", "int64") for i in range(10_000)], name="t")
+    columns = [table[f"c{i}"] for i in range(10_000)]
+
+    # add isn't variadic, the additions form a balanced tree
+    total = subframe.sum_of(columns)
+    depth = 0
+    expression = total.expression
+    while expression.HasField("scalar_function"):
+        expression = expression.scalar_function.arguments[0].value
+        depth += 1
+    assert depth == 14
+
+    # and is variadic
+    condition = subframe.all_of([c > columns[0] for c in columns[1:]])
+    assert len(condition.expression.scalar_function.arguments) == 9_999
+    assert condition._name.startswith("And(Greater(c1, c0), Greater(c2, c0), ")
+
+    plan = table.filter(condition).select(total=total).to_substrait()
+    assert {e.extension_function.name for e in plan.extensions} == {
+        "add:i64_i64",
+        "and:bool",
+        "gt:any_any",
+    }
+    assert subframe.any_of(columns[:1]) is columns[0]
+
+
+def test_constant_folding():
+    one = subframe.literal(1, type="int64")
+    two = subframe.literal(2, type="int64")
+
+    total = one + two
+    assert total.expression.literal.i64 == 3
+    assert total.dtype is (data["a"] + data["a"]).dtype
+
+    assert (one > two).expression.literal.boolean is False
+    assert (two - one).expression.literal.i64 == 1
+    assert (subframe.literal("a") == subframe.literal("a")).expression.literal.boolean
+
+    # overflow behaviour is up to the engine
+    largest = subframe.literal(2**31 - 1)
+    assert (largest + subframe.literal(1)).expression.HasField("scalar_function")
+    # columns aren't folded
+    assert (data["a"] + one).expression.HasField("scalar_function")
+
+
+def test_multiple_views():
+    plan = data.view().union(ref.view(), data.view()).to_substrait()
+
+    assert [r.rel.read.named_table.names[0] for r in plan.relations[:-1]] == [
+        "data",
+        "ref",
+    ]
+    inputs = plan.relations[-1].root.input.set.inputs
+    assert [i.reference.subtree_ordinal for i in inputs] == [0, 1, 0]
+
+
+def test_view_of_view():
+    filtered = data.filter(data["a"] > data["a"]).view()
+    plan = filtered.select("a").view().union(ref).to_substrait()
+
+    (first, second, root) = plan.relations
+    assert first.rel.filter.input.HasField("read")
+    assert second.rel.project.input.reference.subtree_ordinal == 0
+    assert root.root.input.set.inputs[0].reference.subtree_ordinal == 1
+
+
+def test_ctes():
+    filtered = data.filter(data["a"] > data["a"])
+    # equal subtrees are shared too, not only the same Table
+    again = data.filter(data["a"] > data["a"])
+    joined = filtered.cross_join(again).union(filtered.cross_join(data))
+
+    plan = joined.to_substrait(ctes=True)
+    (shared, root) = plan.relations
+    rel = root.root.input
+
+    assert shared.rel == filtered.rel
+    assert rel.set.inputs[0].cross.left.reference.subtree_ordinal == 0
+    assert rel.set.inputs[0].cross.right.reference.subtree_ordinal == 0
+    assert rel.set.inputs[1].cross.left.reference.subtree_ordinal == 0
+    # leaves aren't lifted
+    assert rel.set.inputs[1].cross.right == data.rel
+
+    assert len(joined.to_substrait().relations) == 1
@@ -1,6 +1,7 @@
 import yaml
 
 from substrait.gen.proto.type_pb2 import Type
+from subframe.data_type import from_proto
 from subframe.extension_registry import FunctionRegistry
 
 content = """%YAML 1.2
@@ -188,3 +189,168 @@ def test_decimal_violates_constraint():
         )
         is None
     )
+
+
+def test_extension_files_are_loaded_lazily():
+    lazy_registry = FunctionRegistry()
+    arithmetic_uri = lazy_registry.uri_aliases["functions_arithmetic.yaml"]
+
+    assert not lazy_registry._extension_mapping
+    assert arithmetic_uri in lazy_registry._pending_files
+
+    assert lazy_registry.lookup_function(
+        uri="functions_arithmetic.yaml", function_name="add", signature=[i8(), i8()]
+    )[1] == Type(i8=Type.I8())
+
+    assert list(lazy_registry._extension_mapping.keys()) == [arithmetic_uri]
+    assert arithmetic_uri not in lazy_registry._pending_files
+
+
+def test_preload():
+    eager_registry = FunctionRegistry()
+    eager_registry.preload()
+
+    assert not eager_registry._pending_files
+    assert set(eager_registry.uri_aliases.values()) <= set(
+        eager_registry._extension_mapping.keys()
+    )
+
+
+def test_snapshot_roundtrip(tmp_path):
+    snapshot_path = FunctionRegistry().use_snapshot(tmp_path)
+    assert snapshot_path.exists()
+
+    cached_registry = FunctionRegistry()
+    assert cached_registry.use_snapshot(tmp_path) == snapshot_path
+    assert not cached_registry._pending_files
+
+    func_entry, rtn = cached_registry.lookup_function(
+        uri="functions_arithmetic.yaml", function_name="add", signature=[i8(), i8()]
+    )
+    assert rtn == Type(i8=Type.I8())
+    assert func_entry.anchor not in [
+        f.anchor for fs in registry._extension_mapping["test"].values() for f in fs
+    ]
+
+
+def test_snapshot_is_rebuilt_when_user_file_changes(tmp_path):
+    extension_file = tmp_path / "functions_test.yaml"
+    extension_file.write_text(content)
+
+    first_registry = FunctionRegistry()
+    first_registry.register_extension_yaml(extension_file, uri="test")
+    first_snapshot = first_registry.use_snapshot(tmp_path / "cache")
+
+    extension_file.write_text(content.replace("return: i16", "return: i32"))
+
+    second_registry = FunctionRegistry()
+    second_registry.register_extension_yaml(extension_file, uri="test")
+    second_snapshot = second_registry.use_snapshot(tmp_path / "cache")
+
+    assert first_snapshot != second_snapshot
+    assert second_registry.lookup_function(
+        uri="test", function_name="add", signature=[i8(), i8(), bool()]
+    )[1] == Type(i32=Type.I32())
+
+
+def test_resolution_cache():
+    cached_registry = FunctionRegistry(cache_size=2)
+    cached_registry.register_extension_dict(yaml.safe_load(content), uri="test")
+
+    for _ in range(3):
+        assert cached_registry.lookup_function(
+            uri="test", function_name="add", signature=[i8(), i8()]
+        )[1] == Type(i8=Type.I8())
+
+    assert cached_registry.cache_info() == (2, 1, 0, 2, 1)
+
+    cached_registry.lookup_function(uri="test", function_name="sub", signature=[])
+    cached_registry.lookup_function(
+        uri="test", function_name="add", signature=[i16(), i16(), i8()]
+    )
+
+    assert cached_registry.cache_info() == (2, 3, 1, 2, 2)
+
+
+def test_resolution_cache_is_cleared_on_registration():
+    cached_registry = FunctionRegistry()
+    cached_registry.register_extension_dict(yaml.safe_load(content), uri="test")
+
+    assert (
+        cached_registry.lookup_function(
+            uri="test", function_name="sub", signature=[i8(), i8()]
+        )
+        is None
+    )
+
+    cached_registry.register_extension_dict(
+        {
+            "scalar_functions": [
+                {
+                    "name": "sub",
+                    "impls": [
+                        {"args": [{"value": "i8"}, {"value": "i8"}], "return": "i8"}
+                    ],
+                }
+            ]
+        },
+        uri="test",
+    )
+
+    assert cached_registry.lookup_function(
+        uri="test", function_name="sub", signature=[i8(), i8()]
+    )[1] == Type(i8=Type.I8())
+
+
+def test_indexed_dispatch_keeps_first_match():
+    dispatch_registry = FunctionRegistry()
+    dispatch_registry.register_extension_dict(
+        {
+            "scalar_functions": [
+                {
+                    "name": "ordered",
+                    "impls": [
+                        {"args": [{"value": "i16"}, {"value": "i16"}], "return": "i16"},
+                        {
+                            "args": [{"value": "any1"}],
+                            "variadic": {"min": 2},
+                            "return": "any1",
+                        },
+                        {"args": [{"value": "i8"}, {"value": "i8"}], "return": "i16"},
+                    ],
+                }
+            ]
+        },
+        uri="test",
+    )
+
+    overloads = dispatch_registry._extension_mapping["test"]["ordered"]
+    assert len(overloads.candidates([from_proto(i8()), from_proto(i8())])) == 2
+    assert len(overloads.candidates([from_proto(bool())])) == 0
+
+    for signature, rtn in [
+        ([i16(), i16()], i16()),
+        ([i8(), i8()], i8()),
+        ([bool(), bool(), bool()], bool()),
+    ]:
+        assert (
+            dispatch_registry.lookup_function(
+                uri="test", function_name="ordered", signature=signature
+            )[1]
+            == rtn
+        )
+
+
+def test_lookup_many():
+    many_registry = FunctionRegistry()
+    many_registry.register_extension_dict(yaml.safe_load(content), uri="test")
+
+    results = many_registry.lookup_many(
+        uri="test",
+        function_name="add",
+        signatures=[[i8(), i8()], [i16(), i16(), i8()], [i8(), i8()], [i8()]],
+    )
+
+    assert [r[1] if r else None for r in results] == [i8(), i8(), i8(), None]
+    assert results[0][0] is results[2][0]
+    assert many_registry.cache_info().misses == 3